@@ -39,14 +39,19 @@ setup(
           "srun-mon=sruns_monitor.scripts.launch_monitor:main"
       ]
   },
+  extras_require = {
+    "zstd": ["zstandard"]
+  },
   keywords = "archive sequencing runs monitor",
   install_requires = [
     "docutils",
     "google-cloud-pubsub",
     "google-cloud-firestore",
     "google-cloud-storage",
+    "google-crc32c",
     "jsonschema",
-    "psutil"
+    "psutil",
+    "requests"
   ],
   long_description = long_description,
   long_description_content_type = "text/x-rst",
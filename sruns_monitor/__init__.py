@@ -61,12 +61,153 @@ C_GCP_BUCKET_NAME = "gcp_bucket_name"
 #: JSON configuration parameter name for specifying the folder to write to in the Google bucket.
 C_GCP_BUCKET_BASEDIR = "gcp_bucket_basedir"
 
+#: JSON configuration parameter name for specifying the storage backend to upload to, either 'gcs'
+#: (GCP Storage, the default) or 'local' (a local directory, i.e. for offline testing).
+C_STORAGE_BACKEND = "storage_backend"
+
+#: JSON configuration parameter name for specifying the directory in which the local storage
+#: backend keeps the bucket, as a subdirectory named after the bucket.
+C_LOCAL_STORAGE_DIR = "local_storage_dir"
+
 #: JSON configuration parameter name for specifying how long to pause between monitor scans.
 C_CYCLE_PAUSE_SEC = "cycle_pause_sec"
 
 #: JSON configuration parameter name for specifying how long a child prcocess can run.
 C_TASK_RUNTIME_LIMIT_SEC = "task_runtime_limit_sec"
 
+#: JSON configuration parameter name for enabling streaming mode, where the run directory is tarred
+#: straight into a resumable upload to the Google Storage bucket instead of to a local tarfile.
+C_STREAM_UPLOAD = "stream_upload"
+
+#: JSON configuration parameter name for specifying the size, in MB, of each chunk sent to the
+#: Google Storage bucket in streaming mode. This is also the size of the in-memory buffer.
+C_STREAM_CHUNK_SIZE_MB = "stream_chunk_size_mb"
+
+#: JSON configuration parameter name for specifying the size, in MB, of each part in a parallel
+#: composite upload of a tarfile. Tarfiles larger than this are split into parts that are uploaded
+#: concurrently and then composed into a single object in the bucket.
+C_UPLOAD_PART_SIZE_MB = "upload_part_size_mb"
+
+#: JSON configuration parameter name for specifying the size, in MB, of each chunk sent in the
+#: resumable upload session of a tarfile. The upload's progress is saved after each chunk.
+C_UPLOAD_CHUNK_SIZE_MB = "upload_chunk_size_mb"
+
+#: JSON configuration parameter name for specifying how many parts of a parallel composite upload
+#: are uploaded concurrently.
+C_UPLOAD_WORKERS = "upload_workers"
+
+#: JSON configuration parameter name for specifying the compression format of tarred run
+#: directories. One of 'gzip' or 'zstd'. If not set, tarfiles aren't compressed.
+C_TAR_COMPRESSION = "tar_compression"
+
+#: JSON configuration parameter name for specifying the number of workers that compress a tar
+#: stream in parallel.
+C_COMPRESSION_WORKERS = "compression_workers"
+
+#: JSON configuration parameter name for specifying how to partition run directories into shards
+#: that are tarred concurrently and uploaded independently. One of 'lane' or 'top_level'. If not
+#: set, a single tarball is created per run.
+C_TAR_SHARD_BY = "tar_shard_by"
+
+#: JSON configuration parameter name for specifying the number of shards to tar concurrently.
+C_TAR_SHARD_WORKERS = "tar_shard_workers"
+
+#: JSON configuration parameter name for enabling incremental archiving, where the cycle directories
+#: of runs that are still in progress are tarred and uploaded as soon as the sequencer is done with them.
+C_INCREMENTAL_ARCHIVING = "incremental_archiving"
+
+#: JSON configuration parameter name for specifying how long in minutes a cycle directory must go
+#: unmodified before it can be archived incrementally.
+C_INCREMENTAL_SETTLE_MINUTES = "incremental_settle_minutes"
+
+#: JSON configuration parameter name for specifying the minimum number of cycle directories in
+#: an increment.
+C_INCREMENTAL_MIN_DIRS = "incremental_min_dirs"
+
+#: JSON configuration parameter name for specifying how many files the tar task opens and reads
+#: ahead of the member it's writing.
+C_TAR_PREFETCH_FILES = "tar_prefetch_files"
+
+#: JSON configuration parameter name for specifying how many MB the tar task writes in-between
+#: checkpoints of an uncompressed tarfile.
+C_TAR_CHECKPOINT_MB = "tar_checkpoint_mb"
+
+#: JSON configuration parameter name for specifying the maximum combined bandwidth, in MB per second,
+#: that the workflow processes may use for reading run directories and uploading to GCP Storage.
+C_BANDWIDTH_LIMIT_MB = "bandwidth_limit_mb"
+
+#: JSON configuration parameter name for specifying time-of-day windows in which a different
+#: combined bandwidth limit applies. Each window is an object with the keys 'start' and 'end' (local
+#: times formatted as 'HH:MM') and 'limit_mb'.
+C_BANDWIDTH_SCHEDULE = "bandwidth_schedule"
+
+#: JSON configuration parameter name for specifying a bandwidth limit, in MB per second, for the
+#: runs in a particular watch directory. The value is an object that maps watch directory paths to
+#: their limits. These apply on top of the combined limit.
+C_WATCHDIR_BANDWIDTH_LIMITS_MB = "watchdir_bandwidth_limits_mb"
+
+#: JSON configuration parameter name for specifying the maximum number of workflow stages that run
+#: at the same time.
+C_MAX_CONCURRENT_WORKFLOWS = "max_concurrent_workflows"
+
+#: JSON configuration parameter name for specifying the maximum number of tar stages that run at
+#: the same time.
+C_MAX_CONCURRENT_TARS = "max_concurrent_tars"
+
+#: JSON configuration parameter name for specifying the maximum number of upload stages that run at
+#: the same time.
+C_MAX_CONCURRENT_UPLOADS = "max_concurrent_uploads"
+
+#: JSON configuration parameter name for specifying the order in which runs that are queued for a
+#: workflow slot are admitted.
+C_SCHEDULING_POLICY = "scheduling_policy"
+
+#: JSON configuration parameter name for specifying a mapping of watch directory paths to
+#: priorities, for the watchdir priority scheduling policy.
+C_WATCHDIR_PRIORITIES = "watchdir_priorities"
+
+#: JSON configuration parameter name for enabling the event-loop mode of the monitor, in which
+#: scanning, reaping child processes, reading their error messages, sweeping and notifications run
+#: independently of each other.
+C_EVENT_LOOP = "event_loop"
+
+#: JSON configuration parameter name for enabling inotify to detect when runs are finished, rather
+#: than listing every run directory on every scan.
+C_INOTIFY = "inotify"
+
+#: JSON configuration parameter name for specifying how often, in seconds, watch directories that
+#: are watched with inotify are reconciled with a full scan. Without inotify, how often run
+#: directories without a sentinal file are checked even if their modification time didn't change.
+C_RECONCILE_SCAN_SEC = "reconcile_scan_sec"
+
+#: JSON configuration parameter name for specifying how long, in seconds, to wait for the scan of
+#: a watch directory before reporting it as degraded and skipping it.
+C_SCAN_TIMEOUT_SEC = "scan_timeout_sec"
+
+#: JSON configuration parameter name for specifying the number of long-lived worker processes that
+#: run workflow stages with clients that they keep, rather than a new process for each stage.
+C_WORKER_PROCESSES = "worker_processes"
+
+#: JSON configuration parameter name for specifying the lease store that monitors on several nodes
+#: share to split the runs between them, one of the `sruns_monitor.lease_utils.STORE_*` values. If
+#: not set, the monitor processes every run that it finds.
+C_LEASE_STORE = "lease_store"
+
+#: JSON configuration parameter name for specifying the path to the shared SQLite database of the
+#: 'sqlite' lease store.
+C_LEASE_DB = "lease_db"
+
+#: JSON configuration parameter name for specifying the Firestore collection of the 'firestore'
+#: lease store.
+C_LEASE_COLLECTION = "lease_collection"
+
+#: JSON configuration parameter name for specifying how long, in seconds, the lease of a run lasts
+#: unless the node that holds it renews it.
+C_LEASE_TTL_SEC = "lease_ttl_sec"
+
+#: JSON configuration parameter name for specifying the name by which the node holds leases.
+C_NODE_NAME = "node_name"
+
 ### Attribute names for Firestore database
 FIRESTORE_ATTR_RUN_NAME = "name"
 
@@ -77,6 +218,19 @@ FIRESTORE_ATTR_WF_STATUS = "workflow_status"
 #: Bucket storage object path for the tarred run directory in the form bucket_name/path/to/run.tar.gz.
 FIRESTORE_ATTR_STORAGE = "storage"
 
+#: For a run that was tarred in sharded mode, the list of bucket storage object paths of the shards,
+#: each in the form bucket_name/path/to/run.shard.tar. The storage attribute then holds the path to
+#: the shard manifest.
+FIRESTORE_ATTR_STORAGE_SHARDS = "storage_shards"
+
+#: The base64-encoded CRC32C checksum of the object that the storage attribute points to. This is
+#: the encoding that GCP Storage uses in object metadata, so clients can compare it against the
+#: object's metadata without downloading it.
+FIRESTORE_ATTR_CRC32C = "crc32c"
+
+#: The base64-encoded MD5 hash of the object that the storage attribute points to.
+FIRESTORE_ATTR_MD5 = "md5"
+
 #: Firestore database attribute name. Used when setting or getting the JSON serialization of 
 #: a Pub/Sub message associated with this document.
 FIRESTORE_ATTR_SS_PUBSUB_DATA = "samplesheet_pubsub_data"
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""
+A multi-core compression stage for tar streams, in the spirit of pigz. The input is split into
+independent blocks that are compressed concurrently on a thread or process pool, and each compressed
+block is written out in order as its own gzip member (or zstd frame). A concatenation of gzip members
+is itself a valid gzip stream that any gzip reader, including Python's `tarfile` module, can read.
+The same holds for concatenated zstd frames.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import collections
+import gzip
+import io
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+#: Compression format name for gzip.
+FORMAT_GZIP = "gzip"
+
+#: Compression format name for zstd. Requires the optional `zstandard` package.
+FORMAT_ZSTD = "zstd"
+
+#: Maps each supported compression format to the file extension to add after '.tar'.
+EXTENSIONS = {
+    FORMAT_GZIP: ".gz",
+    FORMAT_ZSTD: ".zst"
+}
+
+#: The default number of uncompressed bytes in each independently compressed block.
+BLOCK_SIZE = 4 * 1024 * 1024
+
+#: The default compression level for each format.
+LEVELS = {
+    FORMAT_GZIP: 6,
+    FORMAT_ZSTD: 3
+}
+
+
+def compress_block(fmt, level, block):
+    """
+    Compresses a single block into a complete gzip member or zstd frame. This is a module-level
+    function so that it can be pickled for use in a process pool.
+
+    Args:
+        fmt: `str`. One of `FORMAT_GZIP` or `FORMAT_ZSTD`.
+        level: `int`. The compression level.
+        block: `bytes`. The data to compress.
+
+    Returns:
+        `bytes`.
+    """
+    if fmt == FORMAT_ZSTD:
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(block)
+    # mtime=0 keeps the output deterministic.
+    return gzip.compress(block, compresslevel=level, mtime=0)
+
+
+def decompress_blocks(fmt, data):
+    """
+    Decompresses one or more consecutive blocks as written by `ParallelCompressor`, i.e. a range of
+    the compressed stream that starts at one of its `block_offsets` and ends at another (or at the
+    end of the stream).
+
+    Args:
+        fmt: `str`. One of `FORMAT_GZIP` or `FORMAT_ZSTD`.
+        data: `bytes`. The compressed blocks.
+
+    Returns:
+        `bytes`.
+    """
+    if fmt == FORMAT_ZSTD:
+        import zstandard
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True)
+        return reader.read()
+    return gzip.decompress(data)
+
+
+class ParallelCompressor:
+    """
+    A writable file-like object that compresses whatever is written to it on a pool of workers and
+    writes the compressed stream to another file object. Memory use is bounded to roughly
+    2 * `workers` blocks, since writes block once that many blocks are waiting to be written out.
+
+    After `close` is called, the attributes `bytes_in`, `bytes_out` and `seconds` and the method
+    `mb_per_sec` describe how the compression went.
+
+    Example::
+
+        with open("run.tar.gz", "wb") as fh:
+            compressor = ParallelCompressor(fileobj=fh)
+            with tarfile.open(fileobj=compressor, mode="w|") as tb:
+                tb.add("run_dir")
+            compressor.close()
+    """
+
+    def __init__(self, fileobj, fmt=FORMAT_GZIP, level=None, workers=None, block_size=BLOCK_SIZE, use_processes=False):
+        """
+        Args:
+            fileobj: A writable file-like object to write the compressed stream to. It is not closed
+                by `close`.
+            fmt: `str`. One of `FORMAT_GZIP` or `FORMAT_ZSTD`.
+            level: `int`. The compression level. Defaults to the level for `fmt` in `LEVELS`.
+            workers: `int`. The number of workers in the pool. Defaults to the number of CPUs.
+            block_size: `int`. The number of uncompressed bytes in each block.
+            use_processes: `boolean`. True means to compress on a process pool rather than a thread
+                pool. zlib releases the GIL while compressing, so threads are normally sufficient
+                and avoid copying each block to another process.
+
+        Raises:
+            `ValueError`: `fmt` isn't a supported compression format.
+            `ImportError`: `fmt` is `FORMAT_ZSTD` but the `zstandard` package isn't installed.
+        """
+        if fmt not in EXTENSIONS:
+            raise ValueError("Unsupported compression format '{}'.".format(fmt))
+        if fmt == FORMAT_ZSTD:
+            import zstandard # Fail early rather than in a worker.
+        self.fileobj = fileobj
+        self.fmt = fmt
+        self.level = level if level is not None else LEVELS[fmt]
+        self.workers = workers or os.cpu_count() or 1
+        self.block_size = block_size
+        if use_processes:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        #: The number of uncompressed bytes written so far.
+        self.bytes_in = 0
+        #: The number of compressed bytes written to `self.fileobj` so far.
+        self.bytes_out = 0
+        #: The offset in the compressed stream at which each block starts. Since block i holds the
+        #: uncompressed bytes from i * `block_size` onwards, this allows a range of the uncompressed
+        #: stream to be read by decompressing only the blocks that it spans.
+        self.block_offsets = []
+        #: The number of seconds from instantiation until `close` was called.
+        self.seconds = 0
+        self.closed = False
+        self._buf = bytearray()
+        # Futures for compressed blocks in the order that they need to be written out.
+        self._pending = collections.deque()
+        self._start_time = time.time()
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        self._buf += data
+        while len(self._buf) >= self.block_size:
+            self._submit(bytes(self._buf[:self.block_size]))
+            del self._buf[:self.block_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _submit(self, block):
+        self._pending.append(self.executor.submit(compress_block, self.fmt, self.level, block))
+        while len(self._pending) > 2 * self.workers:
+            self._write_next()
+
+    def _write_next(self):
+        compressed = self._pending.popleft().result()
+        self.block_offsets.append(self.bytes_out)
+        self.fileobj.write(compressed)
+        self.bytes_out += len(compressed)
+
+    def close(self):
+        """
+        Compresses any remaining input, writes out all compressed blocks and shuts down the pool.
+        """
+        if self.closed:
+            return
+        try:
+            if self._buf:
+                self._submit(bytes(self._buf))
+                self._buf = bytearray()
+            while self._pending:
+                self._write_next()
+        finally:
+            self.executor.shutdown()
+            self.closed = True
+        self.seconds = time.time() - self._start_time
+
+    def abort(self):
+        """
+        Shuts down the pool without writing out any more compressed blocks, i.e. when the stream
+        being compressed failed part way through. Blocks that are being compressed are waited for
+        and discarded. Does nothing if the compressor is already closed.
+        """
+        if self.closed:
+            return
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._buf = bytearray()
+        self.executor.shutdown()
+        self.closed = True
+
+    def mb_per_sec(self):
+        """
+        Returns:
+            `float`. The throughput in MB of uncompressed input per second.
+        """
+        if not self.seconds:
+            return 0.0
+        return self.bytes_in / 1024 / 1024 / self.seconds
+
+    def log_stats(self, name):
+        """
+        Logs the compression ratio and throughput.
+
+        Args:
+            name: `str`. Identifies what was compressed in the log message, i.e. a tarball name.
+        """
+        ratio = self.bytes_out / self.bytes_in if self.bytes_in else 0
+        logger.info("Compressed {} with {}: {:.1f} MB to {:.1f} MB (ratio {:.3f}) at {:.1f} MB/s using {} workers.".format(
+            name, self.fmt, self.bytes_in / 1024 / 1024, self.bytes_out / 1024 / 1024, ratio,
+            self.mb_per_sec(), self.workers))
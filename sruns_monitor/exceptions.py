@@ -17,4 +17,12 @@ class FirestoreDocumentMissingStoragePath(Exception):
 
                                                                                                        
 class MissingTarfile(Exception):                                                                       
+    pass
+
+
+class ChecksumMismatch(Exception):
+    """
+    Raised when an object in GCP Storage doesn't have the checksum of the local file it was uploaded
+    from.
+    """
     pass   
@@ -77,4 +77,28 @@ class SeqRunsFirestoreDoc:
             msg += f" Did the sequencing run finish uploading to Google Storeage yet?"
             raise exceptions.FirestoreDocumentMissingStoragePath(msg)
         return gs_rundir_path
-    
+
+    def get_shard_storage_paths(self):
+        """
+        Gets the paths to the shards of the raw run directory in Google Storage, for a run that was
+        tarred in sharded mode.
+
+        Returns:
+            `list`. Empty if the run wasn't tarred in sharded mode.
+        """
+        return self.data.get(srm.FIRESTORE_ATTR_STORAGE_SHARDS, [])
+
+    def get_storage_checksums(self):
+        """
+        Gets the checksums of the object at the storage path, which can be compared against the
+        object's metadata in Google Storage (i.e. with `gsutil ls -L`) to verify it without
+        downloading it.
+
+        Returns:
+            `dict` with the keys `sruns_monitor.FIRESTORE_ATTR_CRC32C` and
+            `sruns_monitor.FIRESTORE_ATTR_MD5`. The values are base64-encoded, or None if not set.
+        """
+        return {
+            srm.FIRESTORE_ATTR_CRC32C: self.data.get(srm.FIRESTORE_ATTR_CRC32C),
+            srm.FIRESTORE_ATTR_MD5: self.data.get(srm.FIRESTORE_ATTR_MD5)
+        }
@@ -1,70 +1,315 @@
 # -*- coding: utf-8 -*-
 
+import base64
+import collections
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
+import json
 import logging
 import subprocess
 
+import google_crc32c
 from google.cloud import storage
 
 import sruns_monitor as srm
+from sruns_monitor import exceptions as srm_exceptions
+from sruns_monitor import storage_backends
 from sruns_monitor import utils
 
 
 logger = logging.getLogger(__name__)
 
+#: The default size in bytes of each byte range fetched in a sliced download.
+DOWNLOAD_SLICE_SIZE = 64 * 1024 * 1024
+
+#: The default number of byte ranges fetched concurrently in a sliced download.
+DOWNLOAD_WORKERS = 8
+
+#: The default number of files uploaded concurrently by `upload_folder`.
+UPLOAD_FOLDER_WORKERS = 16
+
+#: The name of the sync manifest that `upload_folder` keeps in the folder by default.
+UPLOAD_MANIFEST_NAME = ".upload_manifest.json"
+
 def get_bucket(bucket_name):
     client = storage.Client()
     return client.bucket(bucket_name)
 
-def download(bucket, object_path, download_dir):
+def download(bucket, object_path, download_dir, slice_size=None, workers=DOWNLOAD_WORKERS):
     """
     Downloads the specified object from the specified bucket in `download_dir`.
     The file will be downloaded in the directory specified by the `download_dir` argument.
 
+    When `slice_size` is set and the object is larger than that, a sliced download is performed
+    instead of a single-stream download; see `sliced_download`.
+
     Args:
-        bucket: `google.cloud.storage.bucket.Bucket` instance (i.e. from `get_bucket()`).
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance (i.e. from `get_bucket()`).
         object_path: `str`. The object path within `bucket` to download.
         download_dir: `str`. Directory in which to download the file.
+        slice_size: `int`. Size in bytes of each byte range in a sliced download. A false value
+            disables sliced downloads.
+        workers: `int`. The number of byte ranges to fetch concurrently in a sliced download.
 
     Returns:
         `str`: The full path of the downloaded bucket object.
     """
     if not os.path.exists(download_dir):
         os.makedirs(download_dir)
-    blob = bucket.blob(object_path)
+    backend = storage_backends.as_backend(bucket)
     filename = os.path.join(download_dir, os.path.basename(object_path))
+    if slice_size:
+        info = backend.stat(object_path)
+        if info is None:
+            raise FileNotFoundError(f"gs://{bucket.name}/{object_path} doesn't exist.")
+        if info.size > slice_size:
+            sliced_download(bucket=backend, object_path=object_path, filename=filename, slice_size=slice_size,
+                            workers=workers, info=info)
+            return filename
     logger.info(f"Downloading gs://{bucket.name}/{object_path} to {download_dir}")
-    blob.download_to_filename(filename)
+    backend.download_to_filename(object_path, filename)
     return filename
 
+def _download_slice(backend, object_path, generation, fd, offset, length):
+    """
+    Fetches `length` bytes of the object, beginning at `offset`, and writes them at the same offset
+    in the file open at `fd`. Used by `sliced_download` as the target of a worker thread.
+
+    Returns:
+        `bytes`. The data fetched.
+    """
+    data = backend.read_range(object_path, start=offset, end=offset + length, generation=generation)
+    os.pwrite(fd, data, offset)
+    return data
+
+def sliced_download(bucket, object_path, filename, slice_size=DOWNLOAD_SLICE_SIZE, workers=DOWNLOAD_WORKERS, info=None):
+    """
+    Downloads an object by fetching byte ranges of `slice_size` bytes concurrently. The local file
+    is preallocated to the object's size and each range is written at its offset with a positional
+    write, so the ranges can land in any order.
+
+    The CRC32C checksum of the data is computed as the ranges complete, in order, and is compared
+    against the object's metadata at the end. At most 2 * `workers` ranges are held in memory.
+
+    Args:
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance (i.e. from `get_bucket()`).
+        object_path: `str`. The object path within `bucket` to download.
+        filename: `str`. The path of the local file to write.
+        slice_size: `int`. Size in bytes of each byte range.
+        workers: `int`. The number of byte ranges to fetch concurrently.
+        info: `sruns_monitor.storage_backends.ObjectInfo`. The object's metadata, if already known.
+
+    Returns:
+        `None`.
+
+    Raises:
+        `FileNotFoundError`: The object doesn't exist.
+        `sruns_monitor.exceptions.ChecksumMismatch`: The downloaded data doesn't have the object's
+            CRC32C checksum. As on any other error, the partial local file is removed.
+    """
+    backend = storage_backends.as_backend(bucket)
+    if info is None:
+        info = backend.stat(object_path)
+        if info is None:
+            raise FileNotFoundError(f"gs://{bucket.name}/{object_path} doesn't exist.")
+    logger.info(f"Downloading gs://{bucket.name}/{object_path} to {filename} in slices of {slice_size} bytes using {workers} workers")
+    crc32c = google_crc32c.Checksum()
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        try:
+            # posix_fallocate raises EINVAL for a length of 0.
+            if info.size:
+                os.posix_fallocate(fd, 0, info.size)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Futures in order of offset, so the checksum is computed over the data in order.
+                pending = collections.deque()
+                for offset, length in utils.get_byte_ranges(size=info.size, part_size=slice_size):
+                    # Pin the generation so that every range comes from the same version of the object.
+                    pending.append(executor.submit(_download_slice, backend, object_path, info.generation, fd, offset, length))
+                    while len(pending) > 2 * workers:
+                        crc32c.update(pending.popleft().result())
+                while pending:
+                    crc32c.update(pending.popleft().result())
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        checksum = base64.b64encode(crc32c.digest()).decode("ascii")
+        if checksum != info.crc32c:
+            raise srm_exceptions.ChecksumMismatch(
+                f"Downloaded {filename} has CRC32C {checksum} rather than {info.crc32c} as in gs://{bucket.name}/{object_path}.")
+    except BaseException:
+        # Don't leave a preallocated file behind that looks like a complete download.
+        os.remove(filename)
+        raise
+
 def upload_file(bucket, filepath, object_path):
     """
     Uploads the specified file to the specified bucket at the specified location.
 
     Args:
-        bucket: `google.cloud.storage.bucket.Bucket` instance (i.e. from `get_bucket()`).
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance (i.e. from `get_bucket()`).
         filepath: `str`. Local path to a file to upload into the bucket.
         object_path: `str`. The object path to upload to.
     """
-    blob = bucket.blob(object_path)
     logger.info(f"Uploading file '{filepath}' to gs://{bucket.name}/{object_path}")
-    blob.upload_from_filename(filepath)
+    with open(filepath, "rb") as fh:
+        storage_backends.as_backend(bucket).upload_from_file(object_path, fh, size=os.path.getsize(filepath))
 
 
-def upload_folder(bucket, folder, bucket_path):
+def upload_folder(bucket, folder, bucket_path, workers=UPLOAD_FOLDER_WORKERS, manifest_file=None):
     """
-    Uploads the specified file to the specified bucket at the specified location.
+    Uploads the files in the specified folder, recursively, to the specified bucket at the specified
+    location. Files are uploaded concurrently on a pool of `workers` threads, since for many small
+    files the time is mostly spent waiting on each request.
+
+    A local sync manifest records the size, mtime and CRC32C checksum of each file that was
+    uploaded, so that calling this again only uploads the files that are new or that changed. A file
+    whose size and mtime are unchanged is skipped without being read. Otherwise, its CRC32C checksum
+    is computed and the file is skipped if that's unchanged too, i.e. if it was only touched. The
+    manifest is specific to `bucket` and `bucket_path`; uploading to another location uploads
+    everything. The entries of files that were removed from the folder are dropped, so the manifest
+    doesn't grow without bound as files come and go. The manifest is saved even if an upload fails,
+    so the files that made it aren't uploaded again on the next call.
 
     Args:
-        bucket: `google.cloud.storage.bucket.Bucket` instance (i.e. from `get_bucket()`).
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance (i.e. from `get_bucket()`).
         folder: `str`. Local path to a folder to upload into the bucket.
         bucket_path: `str`. The object path to upload to.
+        workers: `int`. The number of files to upload concurrently.
+        manifest_file: `str`. The path of the sync manifest. Defaults to a file named
+            `UPLOAD_MANIFEST_NAME` in `folder`, which isn't itself uploaded.
+
+    Returns:
+        `list`. The paths, relative to `folder`, of the files that were uploaded.
     """
+    folder = folder.rstrip("/")
     bucket_path = bucket_path.strip("/")
-    bucket_base_path = bucket_path + "/" + os.path.basename(folder) 
-    for root,dirnames,filenames in os.walk(folder):
+    bucket_base_path = bucket_path + "/" + os.path.basename(folder)
+    if not manifest_file:
+        manifest_file = os.path.join(folder, UPLOAD_MANIFEST_NAME)
+    manifest = {"bucket": bucket.name, "bucket_path": bucket_base_path, "files": {}}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as fh:
+            saved = json.load(fh)
+        if saved["bucket"] == bucket.name and saved["bucket_path"] == bucket_base_path:
+            manifest = saved
+    # Only the files that are still in the folder are kept.
+    saved_files = manifest["files"]
+    files = manifest["files"] = {}
+    to_upload = {}
+    for root, dirnames, filenames in os.walk(folder):
         for f in filenames:
             filepath = os.path.join(root, f)
-            object_path = bucket_base_path + "/" + filepath.split(folder)[-1].strip("/")
-            upload_file(bucket, filepath, object_path)
-    
+            if os.path.abspath(filepath) == os.path.abspath(manifest_file):
+                continue
+            relpath = os.path.relpath(filepath, folder)
+            stat = os.stat(filepath)
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime}
+            saved_entry = saved_files.get(relpath)
+            if saved_entry and (saved_entry["size"], saved_entry["mtime"]) == (entry["size"], entry["mtime"]):
+                files[relpath] = saved_entry
+                continue
+            entry["crc32c"] = utils.get_file_crc32c(filepath)
+            if saved_entry and saved_entry["crc32c"] == entry["crc32c"]:
+                files[relpath] = entry
+                continue
+            to_upload[relpath] = entry
+    logger.info(f"Uploading {len(to_upload)} new or changed file(s) from '{folder}' to gs://{bucket.name}/{bucket_base_path}")
+    uploaded = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for relpath in to_upload:
+                object_path = bucket_base_path + "/" + relpath.replace(os.sep, "/")
+                future = executor.submit(upload_file, bucket, os.path.join(folder, relpath), object_path)
+                futures[future] = relpath
+            for future in as_completed(futures):
+                # Re-raises any exception from the worker thread.
+                future.result()
+                relpath = futures[future]
+                files[relpath] = to_upload[relpath]
+                uploaded.append(relpath)
+    finally:
+        tmp_file = manifest_file + ".tmp"
+        with open(tmp_file, "w") as fh:
+            json.dump(manifest, fh)
+        # Replace atomically so that a crash can't leave a truncated manifest behind.
+        os.replace(tmp_file, manifest_file)
+    return uploaded
+
+def get_tar_index(bucket, object_path):
+    """
+    Fetches the tar member index that the monitor uploads next to each tarball, named after the
+    tarball with the suffix `sruns_monitor.utils.TAR_INDEX_SUFFIX`.
+
+    Args:
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance (i.e. from `get_bucket()`).
+        object_path: `str`. The object path of the tarball within `bucket`.
+
+    Returns:
+        `dict`. The index as described in `sruns_monitor.utils.write_tar_index`.
+    """
+    return json.loads(storage_backends.as_backend(bucket).read_range(object_path + utils.TAR_INDEX_SUFFIX))
+
+def fetch_tar_members(bucket, object_path, names, index=None):
+    """
+    Fetches individual members of a tarball in the specified bucket with ranged reads, rather than
+    downloading the whole tarball. Members that are close together in the tarball are fetched in a
+    single request; see `sruns_monitor.utils.group_tar_members`.
+
+    Args:
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance (i.e. from `get_bucket()`).
+        object_path: `str`. The object path of the tarball within `bucket`.
+        names: `list` of member names, i.e. 'run_name/RunInfo.xml'.
+        index: `dict`. The tarball's member index. Fetched with `get_tar_index` if not provided.
+
+    Yields:
+        (name, data) two-item tuples, in the order that the members are in the tarball.
+
+    Raises:
+        `KeyError`: One of `names` isn't a regular file in the tarball.
+    """
+    if index is None:
+        index = get_tar_index(bucket, object_path)
+    backend = storage_backends.as_backend(bucket)
+    for group in utils.group_tar_members(index, names):
+        start, end = utils.get_tar_span(index, group)
+        logger.info(f"Fetching {len(group)} member(s) from gs://{bucket.name}/{object_path} at bytes {start}-{end}")
+        data = backend.read_range(object_path, start=start, end=end)
+        yield from utils.read_tar_members(index, data, group).items()
+
+def download_tar_members(bucket, object_path, paths, download_dir, index=None):
+    """
+    Downloads individual files and/or directories from a tarball in the specified bucket with
+    ranged reads, i.e. a run's RunInfo.xml and SampleSheet.csv, or a single lane. Files are written
+    beneath `download_dir` at their path in the tarball, as `sruns_monitor.utils.extract` would.
+
+    Args:
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance (i.e. from `get_bucket()`).
+        object_path: `str`. The object path of the tarball within `bucket`.
+        paths: `list` of member names and/or directory names in the tarball; see
+            `sruns_monitor.utils.select_tar_members`.
+        download_dir: `str`. Directory in which to download the files.
+        index: `dict`. The tarball's member index. Fetched with `get_tar_index` if not provided.
+
+    Returns:
+        `list`. The local paths of the downloaded files.
+    """
+    if index is None:
+        index = get_tar_index(bucket, object_path)
+    names = utils.select_tar_members(index, paths)
+    filenames = []
+    for name, data in fetch_tar_members(bucket, object_path, names, index=index):
+        filename = os.path.join(download_dir, name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "wb") as fh:
+            fh.write(data)
+        filenames.append(filename)
+    return filenames
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+"""
+Leases that let several monitors, i.e. on different VMs that mount the same watch directory, split
+the runs between them. A monitor only works on a run while it holds the run's lease, which it takes
+when it first sees the run and keeps by renewing it periodically, which is the heartbeat. If the
+monitor dies, its leases expire and another monitor takes the runs over. Once the workflow of a run
+is complete, its lease is marked as done and is kept by its owner for good, so that no other monitor
+processes the run again before it's moved out of the watch directory.
+
+The leases are kept in a `LeaseStore` that all of the monitors share: `SQLiteLeaseStore`, a SQLite
+database on a shared file system, or `FirestoreLeaseStore`, a Firestore collection.
+
+Expiry times are compared against each monitor's own clock, so the lease time to live should be
+well above any clock skew between the nodes.
+"""
+
+import collections
+import logging
+import sqlite3
+import time
+
+
+logger = logging.getLogger(__name__)
+
+#: Lease store name for a SQLite database on a shared file system.
+STORE_SQLITE = "sqlite"
+
+#: Lease store name for a Firestore collection.
+STORE_FIRESTORE = "firestore"
+
+#: The lease of a run. `owner` is the name of the node that holds it, and `expires_at` is in seconds
+#: since the epoch. A lease that's `done` doesn't expire.
+Lease = collections.namedtuple("Lease", ["run_name", "owner", "expires_at", "done"])
+
+
+class LeaseStore:
+    """
+    The operations that a lease store provides. Each of them is atomic, so that two nodes can't
+    both take the same lease.
+    """
+
+    def get(self, run_name):
+        """
+        Returns:
+            `Lease`, or None if the run doesn't have a lease.
+        """
+        raise NotImplementedError
+
+    def acquire(self, run_name, owner, ttl_sec):
+        """
+        Takes the lease of a run, unless another node holds it and it hasn't expired or is done. If
+        `owner` already holds it, the lease is extended.
+
+        Args:
+            run_name: `str`. The name of a sequencing run.
+            owner: `str`. The name of the node.
+            ttl_sec: `float`. How long in seconds the lease lasts unless it's renewed.
+
+        Returns:
+            `tuple` of the `Lease` after the call, which belongs to `owner` if it was taken, and the
+            `Lease` before the call, or None if the run didn't have one.
+        """
+        raise NotImplementedError
+
+    def renew(self, run_names, owner, ttl_sec):
+        """
+        Extends the leases of the given runs that `owner` still holds.
+
+        Returns:
+            `set` of the names of the runs whose leases `owner` still holds. The others were taken
+            over by other nodes.
+        """
+        raise NotImplementedError
+
+    def complete(self, run_name, owner):
+        """
+        Marks the lease of a run that `owner` holds as done.
+        """
+        raise NotImplementedError
+
+    def release(self, run_names, owner):
+        """
+        Gives up the leases of the given runs that `owner` holds and that aren't done, so that other
+        nodes can take them over right away.
+        """
+        raise NotImplementedError
+
+
+def next_lease(current, run_name, owner, ttl_sec):
+    """
+    Decides what `LeaseStore.acquire` stores.
+
+    Args:
+        current: `Lease`, or None if the run doesn't have one.
+        run_name: `str`. The name of a sequencing run.
+        owner: `str`. The name of the node that asks for the lease.
+        ttl_sec: `float`. How long in seconds the lease lasts unless it's renewed.
+
+    Returns:
+        `Lease` to store, or None to leave `current` as it is.
+    """
+    if current:
+        if current.done:
+            return None
+        if current.owner != owner and current.expires_at > time.time():
+            return None
+    return Lease(run_name=run_name, owner=owner, expires_at=time.time() + ttl_sec, done=False)
+
+
+class SQLiteLeaseStore(LeaseStore):
+    """
+    Keeps the leases in a SQLite database that all of the nodes open, i.e. on NFS. SQLite locks the
+    database file for each transaction, so the file system must support POSIX advisory locks, as
+    NFSv4 does. The default rollback journal is used, since WAL mode doesn't work over a network file
+    system.
+
+    A `SQLiteLeaseStore` may be used by a thread other than the one that created it, but only by one
+    thread at a time.
+    """
+
+    #: The name of the table that stores the leases.
+    LEASES_TABLE_NAME = "leases"
+    #: 'leases' table attribute name that stores the name of the sequencing run.
+    LEASES_RUN_NAME = "run_name"
+    #: 'leases' table attribute name that stores the name of the node that holds the lease.
+    LEASES_OWNER = "owner"
+    #: 'leases' table attribute name that stores when the lease expires, in seconds since the epoch.
+    LEASES_EXPIRES_AT = "expires_at"
+    #: 'leases' table attribute name that stores 1 if the lease is done, and 0 otherwise.
+    LEASES_DONE = "done"
+
+    def __init__(self, dbname, timeout=30):
+        """
+        Args:
+            dbname: `str`. The path to the shared SQLite database, which is created if it doesn't
+                exist.
+            timeout: `float`. How long in seconds to wait for another node's transaction.
+        """
+        self.dbname = dbname
+        # Transactions are begun explicitly, with BEGIN IMMEDIATE, so that reading a lease and
+        # taking it happen under the same write lock.
+        self.conn = sqlite3.connect(dbname, timeout=timeout, isolation_level=None,
+                                    check_same_thread=False)
+        sql = """
+            CREATE TABLE IF NOT EXISTS {table} (
+              {run_name} TEXT PRIMARY KEY,
+              {owner} TEXT NOT NULL,
+              {expires_at} REAL NOT NULL,
+              {done} INTEGER NOT NULL DEFAULT 0)
+            """.format(table=self.LEASES_TABLE_NAME,
+                       run_name=self.LEASES_RUN_NAME,
+                       owner=self.LEASES_OWNER,
+                       expires_at=self.LEASES_EXPIRES_AT,
+                       done=self.LEASES_DONE)
+        self.conn.execute(sql)
+
+    def _transaction(self, fn, *args):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(*args)
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+        return result
+
+    def get(self, run_name):
+        sql = "SELECT {run_name}, {owner}, {expires_at}, {done} FROM {table} WHERE {run_name}=?".format(
+            table=self.LEASES_TABLE_NAME,
+            run_name=self.LEASES_RUN_NAME,
+            owner=self.LEASES_OWNER,
+            expires_at=self.LEASES_EXPIRES_AT,
+            done=self.LEASES_DONE)
+        res = self.conn.execute(sql, (run_name,)).fetchone()
+        if not res:
+            return None
+        return Lease(run_name=res[0], owner=res[1], expires_at=res[2], done=bool(res[3]))
+
+    def _put(self, lease):
+        sql = "INSERT OR REPLACE INTO {table}({run_name}, {owner}, {expires_at}, {done}) VALUES(?, ?, ?, ?)".format(
+            table=self.LEASES_TABLE_NAME,
+            run_name=self.LEASES_RUN_NAME,
+            owner=self.LEASES_OWNER,
+            expires_at=self.LEASES_EXPIRES_AT,
+            done=self.LEASES_DONE)
+        self.conn.execute(sql, (lease.run_name, lease.owner, lease.expires_at, int(lease.done)))
+
+    def acquire(self, run_name, owner, ttl_sec):
+        def acquire():
+            current = self.get(run_name)
+            lease = next_lease(current, run_name=run_name, owner=owner, ttl_sec=ttl_sec)
+            if not lease:
+                return current, current
+            self._put(lease)
+            return lease, current
+        return self._transaction(acquire)
+
+    def renew(self, run_names, owner, ttl_sec):
+        def renew():
+            held = set()
+            for run_name in run_names:
+                current = self.get(run_name)
+                if not current or current.owner != owner:
+                    continue
+                held.add(run_name)
+                if not current.done:
+                    self._put(current._replace(expires_at=time.time() + ttl_sec))
+            return held
+        return self._transaction(renew)
+
+    def complete(self, run_name, owner):
+        sql = "UPDATE {table} SET {done}=1 WHERE {run_name}=? AND {owner}=?".format(
+            table=self.LEASES_TABLE_NAME,
+            done=self.LEASES_DONE,
+            run_name=self.LEASES_RUN_NAME,
+            owner=self.LEASES_OWNER)
+        self._transaction(self.conn.execute, sql, (run_name, owner))
+
+    def release(self, run_names, owner):
+        sql = "DELETE FROM {table} WHERE {run_name}=? AND {owner}=? AND {done}=0".format(
+            table=self.LEASES_TABLE_NAME,
+            run_name=self.LEASES_RUN_NAME,
+            owner=self.LEASES_OWNER,
+            done=self.LEASES_DONE)
+        self._transaction(self.conn.executemany, sql, [(i, owner) for i in run_names])
+
+
+class FirestoreLeaseStore(LeaseStore):
+    """
+    Keeps the leases in a Firestore collection, with a document per run that's named after it. Each
+    operation runs in a Firestore transaction.
+    """
+
+    def __init__(self, collection):
+        """
+        Args:
+            collection: `str`. The name of the Firestore collection.
+        """
+        # Imported here so that the SQLite lease store works without GCP credentials.
+        from google.cloud import firestore
+        self.firestore = firestore
+        self.client = firestore.Client()
+        self.collection = self.client.collection(collection)
+
+    def _get(self, run_name, transaction=None):
+        snapshot = self.collection.document(run_name).get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        doc = snapshot.to_dict()
+        return Lease(run_name=run_name, owner=doc["owner"], expires_at=doc["expires_at"],
+                     done=doc.get("done", False))
+
+    def _put(self, lease, transaction):
+        transaction.set(self.collection.document(lease.run_name), lease._asdict())
+
+    def get(self, run_name):
+        return self._get(run_name)
+
+    def acquire(self, run_name, owner, ttl_sec):
+        @self.firestore.transactional
+        def acquire(transaction):
+            current = self._get(run_name, transaction=transaction)
+            lease = next_lease(current, run_name=run_name, owner=owner, ttl_sec=ttl_sec)
+            if not lease:
+                return current, current
+            self._put(lease, transaction)
+            return lease, current
+        return acquire(self.client.transaction())
+
+    def renew(self, run_names, owner, ttl_sec):
+        @self.firestore.transactional
+        def renew(transaction, run_name):
+            current = self._get(run_name, transaction=transaction)
+            if not current or current.owner != owner:
+                return False
+            if not current.done:
+                self._put(current._replace(expires_at=time.time() + ttl_sec), transaction)
+            return True
+        return set(i for i in run_names if renew(self.client.transaction(), i))
+
+    def complete(self, run_name, owner):
+        @self.firestore.transactional
+        def complete(transaction):
+            current = self._get(run_name, transaction=transaction)
+            if current and current.owner == owner:
+                self._put(current._replace(done=True), transaction)
+        complete(self.client.transaction())
+
+    def release(self, run_names, owner):
+        @self.firestore.transactional
+        def release(transaction, run_name):
+            current = self._get(run_name, transaction=transaction)
+            if current and current.owner == owner and not current.done:
+                transaction.delete(self.collection.document(run_name))
+        for run_name in run_names:
+            release(self.client.transaction(), run_name)
+
+
+def get_lease_store(store, dbname=None, collection=None):
+    """
+    Creates a lease store by name.
+
+    Args:
+        store: `str`. One of `STORE_SQLITE` or `STORE_FIRESTORE`.
+        dbname: `str`. For `STORE_SQLITE`, the path to the shared SQLite database.
+        collection: `str`. For `STORE_FIRESTORE`, the name of the Firestore collection.
+
+    Returns:
+        `LeaseStore`.
+
+    Raises:
+        `ValueError`: `store` isn't a known lease store name, or `dbname` or `collection` is missing.
+    """
+    if store == STORE_SQLITE:
+        if not dbname:
+            raise ValueError("The SQLite lease store requires a database path.")
+        return SQLiteLeaseStore(dbname)
+    if store == STORE_FIRESTORE:
+        if not collection:
+            raise ValueError("The Firestore lease store requires a collection name.")
+        return FirestoreLeaseStore(collection)
+    raise ValueError("Unknown lease store '{}'.".format(store))
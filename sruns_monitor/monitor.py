@@ -6,25 +6,38 @@
 # 2019-05-16
 ###
 
+import asyncio
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import json
 import logging
+import multiprocessing
 from multiprocessing import Process, Queue, Lock
 import os
 from pprint import pformat
 import queue
 import shutil
 import signal
+import socket
 import sys
 import tarfile
 import traceback
 import time
 
-from google.cloud import storage, firestore
+from google.cloud import firestore
 
 import psutil
 
 import sruns_monitor as srm
 import sruns_monitor.utils as utils
+from sruns_monitor import compress_utils
+from sruns_monitor import lease_utils
+from sruns_monitor import process_table
+from sruns_monitor import scheduling
+from sruns_monitor import storage_backends
+from sruns_monitor import throttle_utils
+from sruns_monitor import watch_utils
+from sruns_monitor import worker_pool
 from sruns_monitor.sqlite_utils import Db
 from sruns_monitor import exceptions as srm_exceptions
 
@@ -40,6 +53,10 @@ class Monitor:
     #: The sential file can vary by sequencing platform. For NovaSeq, can use CopyComplete.txt.
     SENTINAL_FILES = set(["CopyComplete.txt"])
 
+    #: In event-loop mode, how long in seconds a wait for an error message from a child process
+    #: blocks at a time.
+    REAP_INTERVAL_SEC = 1
+
     def __init__(self, conf_file, verbose=True):
         """
         Args:
@@ -96,18 +113,187 @@ class Monitor:
         #: The directory in the bucket in which to store tarred run directories. If not provided,
         #: defaults to the root level directory.
         self.bucket_basedir = self.conf.get(srm.C_GCP_BUCKET_BASEDIR, "/")
+        #: The storage backend to upload to, one of the `sruns_monitor.storage_backends.BACKEND_*`
+        #: values. Defaults to GCP Storage.
+        self.storage_backend = self.conf.get(srm.C_STORAGE_BACKEND, storage_backends.BACKEND_GCS)
+        #: For the local storage backend, the directory that holds the bucket directory.
+        self.local_storage_dir = self.conf.get(srm.C_LOCAL_STORAGE_DIR)
+        #: If True, the run directory is tarred straight into the bucket rather than to a local
+        #: tarfile that is uploaded afterwards. See `task_stream`. Defaults to False.
+        self.stream_upload = self.conf.get(srm.C_STREAM_UPLOAD, False)
+        #: In streaming mode, the size in bytes of each chunk sent in the resumable upload session.
+        #: Defaults to `sruns_monitor.utils.STREAM_CHUNK_SIZE`.
+        self.stream_chunk_size = utils.STREAM_CHUNK_SIZE
+        if srm.C_STREAM_CHUNK_SIZE_MB in self.conf:
+            self.stream_chunk_size = self.conf[srm.C_STREAM_CHUNK_SIZE_MB] * 1024 * 1024
+        #: The size in bytes of each part in a parallel composite upload of a tarfile. None means
+        #: that tarfiles are uploaded in a single stream.
+        self.upload_part_size = None
+        if srm.C_UPLOAD_PART_SIZE_MB in self.conf:
+            self.upload_part_size = self.conf[srm.C_UPLOAD_PART_SIZE_MB] * 1024 * 1024
+        #: The size in bytes of each chunk sent in the resumable upload session of a tarfile.
+        #: Defaults to `sruns_monitor.utils.UPLOAD_CHUNK_SIZE`.
+        self.upload_chunk_size = utils.UPLOAD_CHUNK_SIZE
+        if srm.C_UPLOAD_CHUNK_SIZE_MB in self.conf:
+            self.upload_chunk_size = self.conf[srm.C_UPLOAD_CHUNK_SIZE_MB] * 1024 * 1024
+        #: The number of parts of a parallel composite upload to upload concurrently. Defaults to
+        #: `sruns_monitor.utils.UPLOAD_WORKERS`.
+        self.upload_workers = self.conf.get(srm.C_UPLOAD_WORKERS, utils.UPLOAD_WORKERS)
+        #: The compression format to use when tarring run directories, one of the
+        #: `sruns_monitor.compress_utils.FORMAT_*` values, or None for no compression (the default).
+        self.tar_compression = self.conf.get(srm.C_TAR_COMPRESSION)
+        #: The number of workers used to compress a tar stream. Defaults to the number of CPUs.
+        self.compression_workers = self.conf.get(srm.C_COMPRESSION_WORKERS)
+        #: How to partition run directories into shards that are tarred concurrently, one of the
+        #: `sruns_monitor.utils.SHARD_BY_*` values. None (the default) means that a single tarball
+        #: is created. Sharded mode takes precedence over streaming mode.
+        self.tar_shard_by = self.conf.get(srm.C_TAR_SHARD_BY)
+        #: The number of shards to tar concurrently. Defaults to 4.
+        self.tar_shard_workers = self.conf.get(srm.C_TAR_SHARD_WORKERS, 4)
+        #: The number of files that the tar task reads ahead of the member it's writing. 0 disables
+        #: reading ahead. Defaults to `sruns_monitor.utils.TAR_PREFETCH_FILES`.
+        self.tar_prefetch_files = self.conf.get(srm.C_TAR_PREFETCH_FILES, utils.TAR_PREFETCH_FILES)
+        #: The minimum number of bytes the tar task writes in-between checkpoints of an uncompressed
+        #: tarfile. Defaults to `sruns_monitor.utils.CHECKPOINT_BYTES`.
+        self.tar_checkpoint_bytes = utils.CHECKPOINT_BYTES
+        if srm.C_TAR_CHECKPOINT_MB in self.conf:
+            self.tar_checkpoint_bytes = self.conf[srm.C_TAR_CHECKPOINT_MB] * 1024 * 1024
+        #: If True, cycle directories of runs that are still in progress are archived as the
+        #: sequencer finishes with them; see `task_archive_increment`. Defaults to False.
+        self.incremental_archiving = self.conf.get(srm.C_INCREMENTAL_ARCHIVING, False)
+        #: How long in minutes a cycle directory must go unmodified before it can be archived
+        #: incrementally. Defaults to 10.
+        self.incremental_settle_minutes = self.conf.get(srm.C_INCREMENTAL_SETTLE_MINUTES, 10)
+        #: The minimum number of cycle directories in an increment. Defaults to 20.
+        self.incremental_min_dirs = self.conf.get(srm.C_INCREMENTAL_MIN_DIRS, 20)
+        #: The `sruns_monitor.throttle_utils.Governor` that all child processes share to keep their
+        #: combined bandwidth within the configured limits. It's installed even without limits, so
+        #: that each child process's throughput is logged.
+        self.governor = self.get_governor()
+        throttle_utils.install(self.governor)
+        #: The maximum number of workflow stages that run at the same time, across all runs. Runs
+        #: that are ready for a stage are queued until a slot is free. Defaults to 4.
+        self.max_concurrent_workflows = self.conf.get(srm.C_MAX_CONCURRENT_WORKFLOWS, 4)
+        #: The maximum number of tar (or streaming) stages that run at the same time. Defaults to
+        #: `self.max_concurrent_workflows`.
+        self.max_concurrent_tars = self.conf.get(srm.C_MAX_CONCURRENT_TARS, self.max_concurrent_workflows)
+        #: The maximum number of upload (or streaming) stages that run at the same time. Defaults to
+        #: `self.max_concurrent_workflows`.
+        self.max_concurrent_uploads = self.conf.get(srm.C_MAX_CONCURRENT_UPLOADS, self.max_concurrent_workflows)
+        #: The order in which queued runs are admitted, one of the `sruns_monitor.scheduling.POLICY_*`
+        #: values. Defaults to first in, first out by the time that the sentinal file appeared.
+        self.scheduling_policy = self.conf.get(srm.C_SCHEDULING_POLICY, scheduling.POLICY_FIFO)
+        #: For the watchdir priority scheduling policy, maps watch directory paths to priorities.
+        #: Runs in watch directories with a higher priority are admitted first.
+        self.watchdir_priorities = self.conf.get(srm.C_WATCHDIR_PRIORITIES, {})
+        #: For the shortest first scheduling policy, maps the names of queued runs to the
+        #: `concurrent.futures.Future` of the size of their run directory; see `update_rundir_sizes`.
+        self.rundir_size_futures = {}
+        #: The `sruns_monitor.process_table.ProcessTable` of the child processes that run workflow
+        #: stages or archive increments. They're reaped as soon as they exit; see `_on_sigchld`.
+        self.process_table = process_table.ProcessTable()
+        #: The number of long-lived worker processes that run workflow stages. 0, the default,
+        #: means to start a new process for each stage instead.
+        self.worker_processes = self.conf.get(srm.C_WORKER_PROCESSES, 0)
+        #: The `sruns_monitor.worker_pool.WorkerPool` that runs the workflow stages if
+        #: `self.worker_processes` is set, or None. The workers are started by `start`.
+        self.worker_pool = None
+        if self.worker_processes:
+            self.worker_pool = worker_pool.WorkerPool(size=self.worker_processes,
+                                                      initializer=self.worker_init,
+                                                      handler=self.worker_run_stage)
+        #: Maps the process ID of a worker process to the `dict` of the clients that it keeps for
+        #: its whole life; see `worker_init`. Other processes create new clients when they need them.
+        self.worker_clients = {}
+        #: The name of the lease store that this monitor shares with those on other nodes, one of
+        #: the `sruns_monitor.lease_utils.STORE_*` values, or None to process every run found.
+        self.lease_store_name = self.conf.get(srm.C_LEASE_STORE)
+        if self.lease_store_name == lease_utils.STORE_SQLITE and not self.conf.get(srm.C_LEASE_DB):
+            raise srm_exceptions.ConfigException("'lease_db' is required for the 'sqlite' lease store.")
+        if self.lease_store_name == lease_utils.STORE_FIRESTORE and not self.conf.get(srm.C_LEASE_COLLECTION):
+            raise srm_exceptions.ConfigException("'lease_collection' is required for the 'firestore' lease store.")
+        #: The `sruns_monitor.lease_utils.LeaseStore`, once it's created by `get_lease_store`.
+        self.lease_store = None
+        #: How long in seconds the lease of a run lasts unless it's renewed. Defaults to 600.
+        self.lease_ttl_sec = self.conf.get(srm.C_LEASE_TTL_SEC, 600)
+        #: The name by which this monitor holds leases. Defaults to the host name.
+        self.node_name = self.conf.get(srm.C_NODE_NAME, socket.gethostname())
+        #: The names of the runs whose leases this monitor holds.
+        self.leases = set()
+        #: When the leases in `self.leases` were last renewed, in seconds since the epoch.
+        self.leases_renewed_at = 0
         #signal.signal(signal.SIGTERM, self._cleanup)
         signal.signal(signal.SIGINT, self._cleanup)
         signal.signal(signal.SIGTERM, self._cleanup)
         #: The name of the local SQLite database.  Name defaults to sruns.db if not provided in
         #: the configuration.
         self.sqlite_dbname = self.conf.get(srm.C_SQLITE_DB, "sruns.db")
-        #: A `sqlite3.Connection` instance.
-        self.sqlite_conn = self.get_sqlite_conn()
+        #: A `sruns_monitor.watch_utils.RunWatcher` that `scan` gets finished runs from if the
+        #: `sruns_monitor.C_INOTIFY` configuration parameter is set, or None to list every run
+        #: directory on every scan.
+        self.run_watcher = None
+        if self.conf.get(srm.C_INOTIFY, False):
+            self.run_watcher = watch_utils.RunWatcher(
+                watchdirs=self.watchdirs,
+                sentinal_files=self.SENTINAL_FILES,
+                reconcile_sec=self.conf.get(srm.C_RECONCILE_SCAN_SEC, watch_utils.RECONCILE_SEC))
+        #: How often, in seconds, a scan checks run directories without a sentinal file again even
+        #: though their modification time didn't change; see `scan_watchdir`. Taken from the
+        #: `sruns_monitor.C_RECONCILE_SCAN_SEC` configuration parameter.
+        self.recheck_sec = self.conf.get(srm.C_RECONCILE_SCAN_SEC, watch_utils.RECONCILE_SEC)
+        #: How long, in seconds, `scan` waits for the scans of the watch directories before
+        #: reporting those that haven't finished as degraded. Defaults to 60.
+        self.scan_timeout_sec = self.conf.get(srm.C_SCAN_TIMEOUT_SEC, 60)
+        #: Maps each watch directory to the `concurrent.futures.Future` of its latest scan.
+        self.scan_futures = {}
+        #: The `concurrent.futures.Future` of the latest poll of `self.run_watcher`.
+        self.watcher_future = None
+        #: Maps each watch directory to the number of seconds that its latest finished scan took.
+        self.scan_latency = {}
+        #: The watch directories that couldn't be scanned the last time.
+        self.degraded_watchdirs = set()
+        #: If True, `start` runs the event-loop mode; see `run_event_loop`. Defaults to False.
+        self.event_loop = self.conf.get(srm.C_EVENT_LOOP, False)
+        #: In event-loop mode, the `concurrent.futures.ThreadPoolExecutor` that sends emails, so that
+        #: a slow mail server doesn't hold anything up. None otherwise.
+        self.mail_executor = None
+        #: The process ID of the main process. Child processes don't use `self.mail_executor`.
+        self.main_pid = os.getpid()
+        signal.signal(signal.SIGCHLD, self._on_sigchld)
+        #: A `sruns_monitor.sqlite_utils.Db` instance. In event-loop mode, it's used by the control
+        #: thread rather than the main thread that creates it.
+        self.sqlite_conn = Db(dbname=self.sqlite_dbname, verbose=self.verbose,
+                              check_same_thread=not self.event_loop)
+
+
+    def get_governor(self):
+        """
+        Creates a bandwidth governor from the configuration parameters
+        `sruns_monitor.C_BANDWIDTH_LIMIT_MB`, `sruns_monitor.C_BANDWIDTH_SCHEDULE` and
+        `sruns_monitor.C_WATCHDIR_BANDWIDTH_LIMITS_MB`.
 
+        Returns:
+            `sruns_monitor.throttle_utils.Governor`.
+        """
+        mb = 1024 * 1024
+        rate = None
+        if srm.C_BANDWIDTH_LIMIT_MB in self.conf:
+            rate = self.conf[srm.C_BANDWIDTH_LIMIT_MB] * mb
+        schedule = []
+        for window in self.conf.get(srm.C_BANDWIDTH_SCHEDULE, []):
+            schedule.append((throttle_utils.parse_time_of_day(window["start"]),
+                             throttle_utils.parse_time_of_day(window["end"]),
+                             window["limit_mb"] * mb))
+        watchdir_rates = {}
+        for path, limit in self.conf.get(srm.C_WATCHDIR_BANDWIDTH_LIMITS_MB, {}).items():
+            watchdir_rates[path] = limit * mb
+        return throttle_utils.Governor(rate=rate, schedule=schedule, watchdir_rates=watchdir_rates)
 
     def get_firestore_conn(self):
         if self.firestore_collection:
+            coll = self.worker_clients.get(os.getpid(), {}).get("firestore")
+            if coll:
+                return coll
             return firestore.Client().collection(self.firestore_collection)
         return False
 
@@ -120,20 +306,139 @@ class Monitor:
         """
         return Db(dbname=self.sqlite_dbname, verbose=self.verbose)
 
+    def worker_init(self):
+        """
+        Runs once in each worker process of `self.worker_pool`, and creates the storage backend,
+        the Firestore client and the SQLite connection that the worker keeps for its whole life.
+        A client that can't be created now, i.e. because the network is down, is created by each
+        stage that needs it instead, as without a worker pool.
+
+        This method is meant to serve as the `initializer` of a `sruns_monitor.worker_pool.WorkerPool`,
+        and is not meant to be called directly by users of this library.
+        """
+        clients = {"sqlite": self.get_sqlite_conn()}
+        try:
+            clients["storage"] = self.get_storage_backend()
+            if self.firestore_collection:
+                clients["firestore"] = self.get_firestore_conn()
+        except Exception as e:
+            self.logger.warning("Worker process {} couldn't create its clients: {}".format(os.getpid(), e))
+        self.worker_clients[os.getpid()] = clients
+
+    def worker_run_stage(self, run_name, stage):
+        """
+        Runs a stage of the workflow in a worker process of `self.worker_pool`, with the worker's
+        SQLite connection. See `_workflow`.
+
+        This method is meant to serve as the `handler` of a `sruns_monitor.worker_pool.WorkerPool`,
+        and is not meant to be called directly by users of this library.
+        """
+        sqlite_conn = self.worker_clients[os.getpid()]["sqlite"]
+        self.run_stage(state=self.state, run_name=run_name, stage=stage, sqlite_conn=sqlite_conn)
+
+    def get_lease_store(self):
+        """
+        Creates the lease store on first use, rather than in the constructor, so that the worker
+        processes don't inherit its connection.
+
+        Returns:
+            `sruns_monitor.lease_utils.LeaseStore`, or None if leases aren't configured.
+        """
+        if self.lease_store_name and not self.lease_store:
+            self.lease_store = lease_utils.get_lease_store(
+                store=self.lease_store_name,
+                dbname=self.conf.get(srm.C_LEASE_DB),
+                collection=self.conf.get(srm.C_LEASE_COLLECTION))
+        return self.lease_store
+
+    def hold_lease(self, run_name):
+        """
+        Takes the lease of a run, unless this monitor already holds it. A lease that another node
+        let expire is taken over.
+
+        Args:
+            run_name: `str`. The name of a sequencing run.
+
+        Returns:
+            `boolean`. True if this monitor may work on the run, which is always the case if leases
+            aren't configured.
+        """
+        lease_store = self.get_lease_store()
+        if not lease_store or run_name in self.leases:
+            return True
+        lease, previous = lease_store.acquire(run_name, owner=self.node_name, ttl_sec=self.lease_ttl_sec)
+        if lease.owner != self.node_name:
+            self.logger.info("Skipping run {}, whose lease is held by node {}.".format(run_name, lease.owner))
+            return False
+        if previous and previous.owner != self.node_name:
+            msg = "Took over run {} from node {}, whose lease expired.".format(run_name, previous.owner)
+            self.logger.warning(msg)
+            self.send_mail(subject="Took over run {}".format(run_name), body=msg)
+        self.leases.add(run_name)
+        return True
+
+    def renew_leases(self):
+        """
+        The heartbeat. Renews the leases that this monitor holds, at most every third of
+        `self.lease_ttl_sec`. If another node took over a run, i.e. because this monitor didn't
+        renew its lease in time, the run's child process is killed and the run is taken out of the
+        queue.
+        """
+        lease_store = self.get_lease_store()
+        if not lease_store or time.time() - self.leases_renewed_at < self.lease_ttl_sec / 3:
+            return
+        leases = set(self.leases)
+        held = lease_store.renew(leases, owner=self.node_name, ttl_sec=self.lease_ttl_sec)
+        self.leases_renewed_at = time.time()
+        for run_name in leases - held:
+            self.leases.discard(run_name)
+            msg = "Lost the lease of run {} to another node.".format(run_name)
+            child = self.process_table.get(run_name)
+            if child:
+                child.process.kill()
+                msg += " Killed its {} process {}.".format(child.kind, child.process.pid)
+            if self.sqlite_conn.get_run(run_name):
+                self.sqlite_conn.update_run(name=run_name, payload={Db.TASKS_QUEUED_AT: 0})
+            self.logger.error(msg)
+            self.send_mail(subject="Lost run {}".format(run_name), body=msg)
+
+    def complete_lease(self, run_name):
+        """
+        Marks the lease of a run whose workflow is complete as done, so that no other node processes
+        the run.
+        """
+        lease_store = self.get_lease_store()
+        if lease_store:
+            lease_store.complete(run_name, owner=self.node_name)
+            self.leases.discard(run_name)
+
     def get_mail_params(self):
         return self.conf.get(srm.C_MAIL)
 
+    def get_storage_backend(self):
+        """
+        Creates the storage backend given by the configuration parameters
+        `sruns_monitor.C_STORAGE_BACKEND` and `sruns_monitor.C_LOCAL_STORAGE_DIR`, for the bucket
+        designated by `self.bucket_name`.
+
+        Returns:
+            `sruns_monitor.storage_backends.StorageBackend`.
+        """
+        backend = self.worker_clients.get(os.getpid(), {}).get("storage")
+        if backend:
+            return backend
+        return storage_backends.get_backend(self.storage_backend, bucket_name=self.bucket_name,
+                                            local_dir=self.local_storage_dir)
+
     def _validate_bucket(self):
         """
-        Tries to create a `google.cloud.storage.bucket.Bucket` instance to ensure that we can
-        connect to the bucket designated by `self.bucket_name`. If we can here, then a child process
-        should also be able to when it needs to. While we could store the bucket instance in our own
-        instance variable, it's probably not safe to share these amongst child processes, so better
-        to let each child process make it's own bucket instance.
+        Tries to create a storage backend to ensure that we can connect to the bucket designated by
+        `self.bucket_name`. If we can here, then a child process should also be able to when it
+        needs to. While we could store the backend instance in our own instance variable, it's
+        probably not safe to share these amongst child processes, so better to let each child
+        process make it's own instance.
         """
-        storage_client = storage.Client()
-        # A `google.cloud.storage.bucket.Bucket` instance.
-        self.client.get_bucket(self.bucket_name)
+        self.get_storage_backend()
 
     def _cleanup(self, signum, frame):
         """
@@ -150,16 +455,60 @@ class Monitor:
         self.logger.error(msg)
         # Email notification
         self.send_mail(subject="Shutting down", body=msg)
+        if self.leases and os.getpid() == self.main_pid:
+            # Lets the other nodes take the runs over right away.
+            self.get_lease_store().release(self.leases, owner=self.node_name)
         child_processes = psutil.Process().children()
         # Kill child processes by sending a SIGKILL.
         [c.kill() for c in child_processes] # equiv. to os.kill(pid, signal.SIGKILL) on UNIX.
         self.sqlite_conn.conn.close()
         sys.exit(128 + signum)
 
-    def _workflow(self, state, run_name):
+    def _on_sigchld(self, signum, frame):
+        """
+        Reaps the child processes that exited as soon as the main process is notified. The exit
+        codes are recorded in SQLite by the next call to `reap_children`, since this may run in the
+        middle of another SQLite transaction. Child processes inherit this handler, but leave their
+        own children, i.e. those of a `concurrent.futures.ProcessPoolExecutor`, alone.
+
+        Args:
+            signum: Don't call explicitly. Only used internally when this method is serving as a
+                handler for a specific type of signal in the funtion `signal.signal`.
+            frame: Don't call explicitly. Only used internally when this method is serving as a
+                handler for a specific type of signal in the funtion `signal.signal`.
+        """
+        if os.getpid() == self.main_pid:
+            self.process_table.reap()
+
+    def get_next_stage(self, rec, sqlite_conn):
         """
-        Runs the workflow. Knows which stages to run, which is useful if the workflow needs to
-        be rerun from a particular point.
+        Determines which stage of the workflow a run needs next. Knowing this is what allows the
+        workflow to be rerun from a particular point.
+
+        Args:
+            rec: `dict`. The local database record of the run.
+            sqlite_conn: `sruns_monitor.sqlite_utils.Db` instance.
+
+        Returns:
+            `str`: One of the `sruns_monitor.sqlite_utils.Db.STAGE_*` values.
+            `None`: The workflow is complete.
+        """
+        if not rec[Db.TASKS_TARFILE]:
+            sharded = self.tar_shard_by or sqlite_conn.get_shards(rec[Db.TASKS_NAME])
+            # If a local tarfile was already made, i.e. before streaming mode was enabled, then it's
+            # uploaded instead.
+            if self.stream_upload and not sharded:
+                return Db.STAGE_STREAM
+            return Db.STAGE_TAR
+        if not rec[Db.TASKS_GCP_TARFILE]:
+            return Db.STAGE_UPLOAD
+        return None
+
+    def _workflow(self, state, run_name, stage):
+        """
+        Runs a stage of the workflow. Once the tar stage completes, the run is queued for the upload
+        stage, which runs in another child process. That way, one run can be tarred while another
+        is uploaded.
 
         This method is meant to serve as the value of the `target` parameter in a call to
         `multiprocessing.Process`, and is not meant to be called directly by users of this library.
@@ -167,15 +516,53 @@ class Monitor:
         Args:
             state: `multiprocessing.Queue` instance.
             run_name: `str`. The name of a sequencing run.
+            stage: `str`. One of the `sruns_monitor.sqlite_utils.Db.STAGE_*` values.
         """
         sl = self.get_sqlite_conn()
-        rec = sl.get_run(run_name)
-        if not rec[Db.TASKS_TARFILE]:
-            self.task_tar(state=state, run_name=run_name, sqlite_conn=sl)
-        if not rec[Db.TASKS_GCP_TARFILE]:
-            self.task_upload(state=state, run_name=run_name, sqlite_conn=sl)
+        self.run_stage(state=state, run_name=run_name, stage=stage, sqlite_conn=sl)
         sl.conn.close()
 
+    def run_stage(self, state, run_name, stage, sqlite_conn):
+        """
+        Runs a stage of the workflow in the calling process. See `_workflow`.
+
+        Args:
+            state: `multiprocessing.Queue` instance.
+            run_name: `str`. The name of a sequencing run.
+            stage: `str`. One of the `sruns_monitor.sqlite_utils.Db.STAGE_*` values.
+            sqlite_conn: `sruns_monitor.sqlite_utils.Db` instance.
+        """
+        rec = sqlite_conn.get_run(run_name)
+        throttle_utils.set_context(label=run_name, watchdir=os.path.dirname(rec[Db.TASKS_RUNDIR_PATH]))
+        if stage == Db.STAGE_STREAM:
+            self.task_stream(state=state, run_name=run_name, sqlite_conn=sqlite_conn)
+        elif stage == Db.STAGE_TAR:
+            self.task_tar(state=state, run_name=run_name, sqlite_conn=sqlite_conn)
+            self.queue_stage(run_name=run_name, sqlite_conn=sqlite_conn)
+        elif stage == Db.STAGE_UPLOAD:
+            self.task_upload(state=state, run_name=run_name, sqlite_conn=sqlite_conn)
+
+    def get_tarball_name(self, run_name, shard=None):
+        """
+        Returns the name of the tarball for a run, which is the run name with a .tar extension plus
+        a compression extension if `self.tar_compression` is set, i.e. .tar.gz. The tarball of a
+        shard also has the shard name before the extension, i.e. run_name.L001.tar.
+
+        Args:
+            run_name: `str`. The name of a sequencing run.
+            shard: `str`. The name of a shard of the run, if the run is tarred in sharded mode.
+
+        Returns:
+            `str`.
+        """
+        tarball_name = run_name
+        if shard:
+            tarball_name += "." + shard
+        tarball_name += ".tar"
+        if self.tar_compression:
+            tarball_name += compress_utils.EXTENSIONS[self.tar_compression]
+        return tarball_name
+
     def firestore_update_status(self, run_name, status):
         """
         This method only has an effect if Firestore is configured for use.
@@ -194,12 +581,25 @@ class Monitor:
 
     def task_tar(self, state,  run_name, sqlite_conn):
         """
-        Creates a gzip tarfile of the run directory and updates the Firestore record's status to
+        Creates a tarfile of the run directory and updates the Firestore record's status to
         indicate that this task is running. The tarfile will be created in the calling directory
-        and named the same as the `run_name` parameter, but with a .tar.gz suffix.
+        and named as given by `get_tarball_name`. The tarfile is compressed only if
+        `self.tar_compression` is set.
+
+        An uncompressed tarfile is checkpointed as it's created so that if this task is interrupted,
+        it picks up where it left off the next time; see `tar_with_checkpoints`.
+
+        If `self.tar_shard_by` is set, or parts of the run were already archived while it was in
+        progress, the run directory is instead tarred into shards; see `tar_shards`.
+
+        Alongside each tarfile, a tar member index is written that the upload task uploads next to it,
+        which allows individual files to be fetched from the bucket with ranged reads; see
+        `sruns_monitor.utils.write_tar_index` and `sruns_monitor.gcstorage_utils.download_tar_members`.
 
         Once tarring is complete, the local database record is updated such that the attribute
-        `sqlite_utils.Db.TASKS_TARFILE` is set to the path of the tarfile. Note that this method
+        `sqlite_utils.Db.TASKS_TARFILE` is set to the path of the tarfile (the shard manifest in
+        sharded mode), and the attributes `sqlite_utils.Db.TASKS_CRC32C` and `sqlite_utils.Db.TASKS_MD5`
+        are set to its checksums, which are computed as the tarfile is written. Note that this method
         also updates the local database record to set the pid field with the process ID its running
         in.
 
@@ -210,14 +610,27 @@ class Monitor:
         """
         try:
             sqlite_conn.update_run(name=run_name, payload={Db.TASKS_PID: os.getpid()})
-            tarball_name = run_name + ".tar"
+            tarball_name = self.get_tarball_name(run_name)
             self.logger.info("Tarring sequencing run {}.".format(run_name))
             # Update status of Firestore record
             self.firestore_update_status(run_name=run_name, status=Db.RUN_STATUS_TARRING)
             rec = sqlite_conn.get_run(run_name)
             run_path = rec[Db.TASKS_RUNDIR_PATH]
-            tarball = utils.tar(run_path, tarball_name)
-            sqlite_conn.update_run(name=run_name, payload={Db.TASKS_TARFILE: tarball_name})
+            if self.tar_shard_by or sqlite_conn.get_shards(run_name):
+                tarball_name, checksums = self.tar_shards(run_name=run_name, run_path=run_path, sqlite_conn=sqlite_conn)
+            elif self.tar_compression:
+                checksums = utils.tar(run_path, tarball_name, compress=self.tar_compression,
+                                      compress_workers=self.compression_workers,
+                                      index_file=tarball_name + utils.TAR_INDEX_SUFFIX,
+                                      prefetch=self.tar_prefetch_files)
+            else:
+                checksums = self.tar_with_checkpoints(rec=rec, tarball_name=tarball_name, sqlite_conn=sqlite_conn)
+            # Any upload session from before is for an earlier tarfile, so it can't be resumed.
+            sqlite_conn.update_run(name=run_name, payload={
+                Db.TASKS_TARFILE: tarball_name,
+                Db.TASKS_UPLOAD_SESSION: "",
+                Db.TASKS_CRC32C: checksums["crc32c"],
+                Db.TASKS_MD5: checksums["md5"]})
             # Update status of Firestore record
             self.firestore_update_status(run_name=run_name, status=Db.RUN_STATUS_TARRING_COMPLETE)
         except Exception as e:
@@ -226,6 +639,263 @@ class Monitor:
             # any potential downstream loggers as well. This does not effect the main thread.
             raise
 
+    def tar_with_checkpoints(self, rec, tarball_name, sqlite_conn):
+        """
+        Creates an uncompressed tarfile of the run directory with `sruns_monitor.utils.tar_resumable`,
+        saving each checkpoint in the local database record's attributes
+        `sqlite_utils.Db.TASKS_TAR_MEMBERS` and `sqlite_utils.Db.TASKS_TAR_OFFSET`. If the record
+        already has a checkpoint from an earlier attempt, and the partial tarfile is still there, the
+        tarfile is resumed from the checkpoint rather than started over.
+
+        Args:
+            rec: `dict`. The local database record of the run.
+            tarball_name: `str`. The name of the tarfile.
+            sqlite_conn: `sqlite3.Connection` instance for the local SQLite database.
+
+        Returns:
+            `dict`. The tarfile's checksums as returned by `sruns_monitor.utils.tar_resumable`.
+        """
+        run_name = rec[Db.TASKS_NAME]
+        members = rec[Db.TASKS_TAR_MEMBERS]
+        offset = rec[Db.TASKS_TAR_OFFSET]
+        if members:
+            if os.path.exists(tarball_name) and os.path.getsize(tarball_name) >= offset:
+                self.logger.info("Resuming tarfile {} after member {} at byte offset {}.".format(tarball_name, members, offset))
+            else:
+                self.logger.info("Can't resume tarfile {} since it's missing or truncated. Starting over.".format(tarball_name))
+                members = 0
+                offset = 0
+
+        def checkpoint(members, offset):
+            sqlite_conn.update_run(name=run_name, payload={Db.TASKS_TAR_MEMBERS: members, Db.TASKS_TAR_OFFSET: offset})
+
+        return utils.tar_resumable(input_dir=rec[Db.TASKS_RUNDIR_PATH], tarball_name=tarball_name,
+                                   members=members, offset=offset, checkpoint=checkpoint,
+                                   checkpoint_bytes=self.tar_checkpoint_bytes,
+                                   index_file=tarball_name + utils.TAR_INDEX_SUFFIX,
+                                   prefetch=self.tar_prefetch_files)
+
+    def tar_shards(self, run_name, run_path, sqlite_conn):
+        """
+        Tars the run directory into several shards concurrently on a pool of `self.tar_shard_workers`
+        processes. The run directory is partitioned as specified by `self.tar_shard_by`; see
+        `sruns_monitor.utils.partition_rundir`. If `self.tar_shard_by` isn't set, there is a single
+        shard for the whole run directory. Each shard is recorded in the local database's shards
+        table and its tarfile attribute is set once the shard is tarred, so if this method is
+        interrupted, only the shards that weren't finished are tarred again on the next attempt.
+
+        Any paths that were already archived while the run was in progress (see
+        `task_archive_increment`) are left out of the shards. Increments that were started but never
+        tarred are discarded, so that their paths are included here instead.
+
+        Once all shards are tarred, a manifest in JSON format is written that lists each shard's
+        tarfile, including those of the increments, along with the location that the upload task will
+        upload it to and its checksums. Each shard's checksums are also stored in its record.
+
+        Args:
+            run_name: `str`. The name of a sequencing run.
+            run_path: `str`. The path to the run directory.
+            sqlite_conn: `sqlite3.Connection` instance for the local SQLite database.
+
+        Returns:
+            `tuple`. The name of the manifest file, run_name.shards.json, and the manifest's checksums
+            as returned by `sruns_monitor.utils.ChecksumWriter.checksums`.
+        """
+        finished = set()
+        archived = []
+        for shard in sqlite_conn.get_shards(run_name):
+            if shard[Db.SHARDS_TARFILE]:
+                finished.add(shard[Db.SHARDS_NAME])
+                if shard[Db.SHARDS_MEMBERS]:
+                    archived.extend(json.loads(shard[Db.SHARDS_MEMBERS]))
+            elif shard[Db.SHARDS_MEMBERS]:
+                sqlite_conn.delete_shard(run_name=run_name, shard=shard[Db.SHARDS_NAME])
+        if self.tar_shard_by:
+            partitions = utils.partition_rundir(run_path, self.tar_shard_by)
+        else:
+            partitions = [(utils.SHARD_REST, None, [])]
+        # The worker processes need to be forked to inherit the bandwidth governor.
+        with ProcessPoolExecutor(max_workers=self.tar_shard_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+            futures = {}
+            for shard_name, include, exclude in partitions:
+                if shard_name in finished:
+                    continue
+                shard_tarball = self.get_tarball_name(run_name, shard=shard_name)
+                sqlite_conn.insert_shard(run_name=run_name, shard=shard_name)
+                self.logger.info("Tarring shard {} of sequencing run {}.".format(shard_name, run_name))
+                future = executor.submit(
+                    utils.tar, input_dir=run_path, tarball_name=shard_tarball,
+                    compress=self.tar_compression, compress_workers=self.compression_workers,
+                    include=include, exclude=exclude + archived,
+                    index_file=shard_tarball + utils.TAR_INDEX_SUFFIX, prefetch=self.tar_prefetch_files)
+                futures[future] = (shard_name, shard_tarball)
+            for future in as_completed(futures):
+                # Re-raises any exception from the worker process.
+                checksums = future.result()
+                shard_name, shard_tarball = futures[future]
+                sqlite_conn.update_shard(run_name=run_name, shard=shard_name, payload={
+                    Db.SHARDS_TARFILE: shard_tarball,
+                    Db.SHARDS_CRC32C: checksums["crc32c"],
+                    Db.SHARDS_MD5: checksums["md5"]})
+        manifest = {
+            "run_name": run_name,
+            "shard_by": self.tar_shard_by,
+            "shards": []
+        }
+        for shard in sqlite_conn.get_shards(run_name):
+            blob_name = self.create_blob_name(run_name=run_name, filename=shard[Db.SHARDS_TARFILE])
+            manifest["shards"].append({
+                "shard": shard[Db.SHARDS_NAME],
+                "tarfile": shard[Db.SHARDS_TARFILE],
+                "storage": "/".join([self.bucket_name, blob_name]),
+                "crc32c": shard[Db.SHARDS_CRC32C],
+                "md5": shard[Db.SHARDS_MD5]
+            })
+        manifest_name = run_name + ".shards.json"
+        with open(manifest_name, "wb") as fh:
+            writer = utils.ChecksumWriter(fh)
+            writer.write(json.dumps(manifest, indent=4).encode("utf-8"))
+        return manifest_name, writer.checksums()
+
+    def task_archive_increment(self, state, run_path):
+        """
+        Archives the cycle directories of a run that is still in progress, which the sequencer has
+        finished writing to (see `sruns_monitor.utils.get_completed_cycle_dirs`) and that weren't
+        already archived. Once there are at least `self.incremental_min_dirs` of them, they are tarred
+        into an increment shard that is named incNNN (i.e. run_name.inc001.tar) and uploaded right
+        away. Any earlier increment that wasn't finished is tarred and/or uploaded first.
+
+        Each increment is recorded in the local database's shards table along with the list of paths
+        that it holds, which the tar task leaves out once the run is complete; see `tar_shards`. A
+        record isn't created in the tasks table, so that the run is still treated as new once it's
+        complete.
+
+        This method is meant to serve as the value of the `target` parameter in a call to
+        `multiprocessing.Process`, and is not meant to be called directly by users of this library.
+
+        Args:
+            state: `multiprocessing.Queue` instance.
+            run_path: `str`. The path to a run directory that is in progress.
+        """
+        run_name = os.path.basename(run_path)
+        sqlite_conn = self.get_sqlite_conn()
+        throttle_utils.set_context(label=run_name + " (increment)", watchdir=os.path.dirname(run_path))
+        try:
+            shards = sqlite_conn.get_shards(run_name)
+            archived = set()
+            for shard in shards:
+                if shard[Db.SHARDS_MEMBERS]:
+                    archived.update(json.loads(shard[Db.SHARDS_MEMBERS]))
+            completed_dirs = utils.get_completed_cycle_dirs(
+                input_dir=run_path, settle_seconds=self.incremental_settle_minutes * 60)
+            new_dirs = [i for i in completed_dirs if i not in archived]
+            if len(new_dirs) >= self.incremental_min_dirs:
+                shard_name = "inc{:03d}".format(len(shards) + 1)
+                sqlite_conn.insert_shard(run_name=run_name, shard=shard_name, members=json.dumps(new_dirs))
+                shards = sqlite_conn.get_shards(run_name)
+            pending = [i for i in shards if not i[Db.SHARDS_GCP_TARFILE]]
+            if not pending:
+                return
+            # A `sruns_monitor.storage_backends.StorageBackend` instance.
+            bucket = self.get_storage_backend()
+            for shard in pending:
+                shard_name = shard[Db.SHARDS_NAME]
+                shard_tarball = shard[Db.SHARDS_TARFILE]
+                checksums = {"crc32c": shard[Db.SHARDS_CRC32C], "md5": shard[Db.SHARDS_MD5]}
+                if not shard_tarball:
+                    shard_tarball = self.get_tarball_name(run_name, shard=shard_name)
+                    self.logger.info("Tarring increment {} of in-progress sequencing run {}.".format(shard_name, run_name))
+                    checksums = utils.tar(run_path, shard_tarball, compress=self.tar_compression,
+                                          compress_workers=self.compression_workers,
+                                          include=json.loads(shard[Db.SHARDS_MEMBERS]),
+                                          index_file=shard_tarball + utils.TAR_INDEX_SUFFIX,
+                                          prefetch=self.tar_prefetch_files)
+                    sqlite_conn.update_shard(run_name=run_name, shard=shard_name, payload={
+                        Db.SHARDS_TARFILE: shard_tarball,
+                        Db.SHARDS_CRC32C: checksums["crc32c"],
+                        Db.SHARDS_MD5: checksums["md5"]})
+                shard_blob_path = self.upload_tarfile(bucket=bucket, run_name=run_name, tarfile=shard_tarball,
+                                                      crc32c=checksums["crc32c"], md5=checksums["md5"])
+                sqlite_conn.update_shard(run_name=run_name, shard=shard_name, payload={Db.SHARDS_GCP_TARFILE: shard_blob_path})
+                self.remove_tarfile(shard_tarball)
+        except Exception as e:
+            state.put((run_name, os.getpid(), e))
+            # Let child process terminate as it would have so this error is spit out into
+            # any potential downstream loggers as well. This does not effect the main thread.
+            raise
+        finally:
+            sqlite_conn.conn.close()
+
+    def upload_tarfile(self, bucket, run_name, tarfile, session_url=None, checkpoint=None, crc32c="", md5=""):
+        """
+        Uploads a tarfile of a run to GCP Storage and names the blob as given by `create_blob_name`.
+
+        When `checkpoint` is provided, the upload is done in a resumable upload session whose
+        progress is passed to `checkpoint`; see `sruns_monitor.utils.resumable_upload_to_gcp`.
+        That isn't the case for a tarfile that is large enough to be uploaded as a parallel composite
+        upload.
+
+        If the blob already exists with the same size and CRC32C checksum as the tarfile, i.e. because
+        an earlier attempt uploaded it but crashed before recording that, the upload is skipped; see
+        `sruns_monitor.utils.blob_matches_file`.
+
+        If `crc32c` is provided, the uploaded object's checksums are compared against the given ones
+        once the upload completes; see `sruns_monitor.utils.verify_blob_checksums`.
+
+        If the tarfile has a tar member index, it's uploaded afterwards next to the tarfile, named
+        with the suffix `sruns_monitor.utils.TAR_INDEX_SUFFIX`.
+
+        Args:
+            bucket: `sruns_monitor.storage_backends.StorageBackend` instance.
+            run_name: `str`. The name of a sequencing run.
+            tarfile: `str`. The path to the tarfile to upload.
+            session_url: `str`. The URI of the resumable upload session from an earlier attempt to
+                resume.
+            checkpoint: A callable that takes the parameters session_url and offset.
+            crc32c: `str`. The base64-encoded CRC32C checksum of the tarfile.
+            md5: `str`. The base64-encoded MD5 hash of the tarfile.
+
+        Returns:
+            `str`. The location of the blob formatted as '$bucket_name/blob_path'.
+
+        Raises:
+            `sruns_monitor.exceptions.ChecksumMismatch`: The uploaded object's checksums differ.
+        """
+        blob_name = self.create_blob_name(run_name=run_name, filename=tarfile)
+        composite = self.upload_part_size and os.path.getsize(tarfile) > self.upload_part_size
+        if utils.blob_matches_file(bucket=bucket, blob_name=blob_name, source_file=tarfile, crc32c=crc32c):
+            self.logger.info("Not uploading {} since GCP Storage bucket {} already has an identical {}.".format(tarfile, self.bucket_name, blob_name))
+        elif checkpoint and not composite:
+            self.logger.info("Uploading {} to GCP Storage bucket {} as {}.".format(tarfile,self.bucket_name, blob_name))
+            utils.resumable_upload_to_gcp(bucket=bucket, blob_name=blob_name, source_file=tarfile,
+                                          session_url=session_url, checkpoint=checkpoint,
+                                          chunk_size=self.upload_chunk_size)
+        else:
+            self.logger.info("Uploading {} to GCP Storage bucket {} as {}.".format(tarfile,self.bucket_name, blob_name))
+            utils.upload_to_gcp(bucket=bucket, blob_name=blob_name, source_file=tarfile,
+                                part_size=self.upload_part_size, workers=self.upload_workers)
+        if crc32c:
+            utils.verify_blob_checksums(bucket=bucket, blob_name=blob_name, crc32c=crc32c, md5=md5)
+            self.logger.info("Verified the checksums of {} in GCP Storage.".format(blob_name))
+        else:
+            self.logger.info("Not verifying {} in GCP Storage since its checksums are unknown.".format(blob_name))
+        index_file = tarfile + utils.TAR_INDEX_SUFFIX
+        if os.path.exists(index_file):
+            utils.upload_to_gcp(bucket=bucket, blob_name=blob_name + utils.TAR_INDEX_SUFFIX, source_file=index_file)
+        return "/".join([self.bucket_name, blob_name])
+
+    def remove_tarfile(self, tarfile):
+        """
+        Removes a local tarfile along with its tar member index, if there is one.
+
+        Args:
+            tarfile: `str`. The path to the tarfile.
+        """
+        os.remove(tarfile)
+        index_file = tarfile + utils.TAR_INDEX_SUFFIX
+        if os.path.exists(index_file):
+            os.remove(index_file)
+
     def task_upload(self, state, run_name, sqlite_conn):
         """
         Uploads the tarred run dirctory to GCP Storage in the directory specified by `self.bucket_basedir`.
@@ -239,6 +909,24 @@ class Monitor:
         Note that this method also updates the local database record to set the pid field with
         the process ID its running in.
 
+        If `self.upload_part_size` is set and the tarfile is larger than it, the tarfile is uploaded
+        as a parallel composite upload; see `sruns_monitor.utils.composite_upload_to_gcp`.
+
+        The tarfile is uploaded in a resumable upload session. The session URI and the number of
+        bytes that GCP Storage confirmed are saved in the local database record's attributes
+        `sqlite_utils.Db.TASKS_UPLOAD_SESSION` and `sqlite_utils.Db.TASKS_UPLOAD_OFFSET` after each
+        chunk, so that if this task is interrupted, the next attempt continues from the confirmed
+        offset. A new session is only started if the saved one has expired.
+
+        Each uploaded object's checksums are compared against those computed when it was tarred. If
+        they differ, `sruns_monitor.exceptions.ChecksumMismatch` is raised and the run isn't marked as
+        uploaded, so that the upload is attempted again from scratch.
+
+        If the run was tarred in sharded mode, then each shard's tarfile is uploaded first, and
+        the shard's record in the local database is updated (and its local tarfile removed) as soon as
+        it's uploaded. The tarfile of the run is the shard manifest in that case, which is uploaded
+        last so that its presence in the bucket indicates that all shards are there.
+
         Finally, the local tarfile is removed.
 
         Args:
@@ -256,21 +944,94 @@ class Monitor:
             tarfile = rec[Db.TASKS_TARFILE]
             if not tarfile:
                 raise srm_exceptions.MissingTarfile("Run {} does not have a tarfile.".format(run_name))
-            # Upload tarfile to GCP bucket
-            blob_name = self.create_blob_name(run_name=run_name, filename=tarfile)
-            storage_client = storage.Client()
-            # A `google.cloud.storage.bucket.Bucket` instance.
-            bucket = storage_client.get_bucket(self.bucket_name)
-            self.logger.info("Uploading {} to GCP Storage bucket {} as {}.".format(tarfile,self.bucket_name, blob_name))
+            # A `sruns_monitor.storage_backends.StorageBackend` instance.
+            bucket = self.get_storage_backend()
             # Update status of Firestore record
             self.firestore_update_status(run_name=run_name, status=Db.RUN_STATUS_UPLOADING)
-            utils.upload_to_gcp(bucket=bucket, blob_name=blob_name, source_file=tarfile)
-            bucket_blob_path = "/".join([self.bucket_name, blob_name])
+            for shard in sqlite_conn.get_shards(run_name):
+                if shard[Db.SHARDS_GCP_TARFILE]:
+                    continue
+                shard_blob_path = self.upload_tarfile(bucket=bucket, run_name=run_name, tarfile=shard[Db.SHARDS_TARFILE],
+                                                      crc32c=shard[Db.SHARDS_CRC32C], md5=shard[Db.SHARDS_MD5])
+                sqlite_conn.update_shard(run_name=run_name, shard=shard[Db.SHARDS_NAME], payload={Db.SHARDS_GCP_TARFILE: shard_blob_path})
+                self.remove_tarfile(shard[Db.SHARDS_TARFILE])
+            # Upload tarfile to GCP bucket
+
+            def checkpoint(session_url, offset):
+                sqlite_conn.update_run(name=run_name, payload={Db.TASKS_UPLOAD_SESSION: session_url, Db.TASKS_UPLOAD_OFFSET: offset})
+
+            try:
+                bucket_blob_path = self.upload_tarfile(bucket=bucket, run_name=run_name, tarfile=tarfile,
+                                                       session_url=rec[Db.TASKS_UPLOAD_SESSION], checkpoint=checkpoint,
+                                                       crc32c=rec[Db.TASKS_CRC32C], md5=rec[Db.TASKS_MD5])
+            except srm_exceptions.ChecksumMismatch:
+                # The session is complete, so resuming it would only yield the same object.
+                sqlite_conn.update_run(name=run_name, payload={Db.TASKS_UPLOAD_SESSION: ""})
+                raise
             sqlite_conn.update_run(
                 name=run_name,
-                payload={Db.TASKS_GCP_TARFILE: bucket_blob_path})
+                payload={Db.TASKS_GCP_TARFILE: bucket_blob_path, Db.TASKS_UPLOAD_SESSION: ""})
             # Remove local tarfile
-            os.remove(tarfile)
+            self.remove_tarfile(tarfile)
+            # Update status of Firestore record
+            self.firestore_update_status(run_name=run_name, status=Db.RUN_STATUS_UPLOADING_COMPLETE)
+        except Exception as e:
+            state.put((run_name, os.getpid(), e))
+            # Let child process terminate as it would have so this error is spit out into
+            # any potential downstream loggers as well. This does not effect the main thread.
+            raise
+
+    def task_stream(self, state, run_name, sqlite_conn):
+        """
+        Tars the run directory straight into GCP Storage, combining `task_tar` and `task_upload`
+        without writing a local tarfile. The blob is named as $basedir/run_name/run_name.tar.
+        The Firestore record's status is updated to indicate that this task is running.
+
+        Once the upload is finalized, the local database record is updated such that both the
+        attributes `sqlite_utils.Db.TASKS_TARFILE` and `sqlite_utils.Db.TASKS_GCP_TARFILE` are set, the
+        former to the name of the tarball (which doesn't exist locally) and the latter to the location
+        of the blob formatted as '$bucket_name/blob_path'. Both are set in a single update so that a
+        crash in-between can't leave behind a record that points to a missing local tarfile. The
+        checksums computed as the tar stream was produced are compared against the object's metadata
+        and stored in the same update. The tar member index is written locally as the tar stream is
+        produced and uploaded next to the blob afterwards.
+        Note that this method also updates the local database record to set the pid field with
+        the process ID its running in.
+
+        Args:
+            state: `multiprocessing.Queue` instance.
+            run_name: `str`. The name of a sequencing run.
+            sqlite_conn: `sqlite3.Connection` instance for the local SQLite database.
+        """
+        try:
+            sqlite_conn.update_run(name=run_name, payload={Db.TASKS_PID: os.getpid()})
+            tarball_name = self.get_tarball_name(run_name)
+            rec = sqlite_conn.get_run(run_name)
+            run_path = rec[Db.TASKS_RUNDIR_PATH]
+            blob_name = self.create_blob_name(run_name=run_name, filename=tarball_name)
+            # A `sruns_monitor.storage_backends.StorageBackend` instance.
+            bucket = self.get_storage_backend()
+            self.logger.info("Streaming sequencing run {} to GCP Storage bucket {} as {}.".format(run_name, self.bucket_name, blob_name))
+            # Update status of Firestore record
+            self.firestore_update_status(run_name=run_name, status=Db.RUN_STATUS_STREAMING)
+            index_file = tarball_name + utils.TAR_INDEX_SUFFIX
+            checksums = utils.stream_tar_to_gcp(
+                input_dir=run_path, bucket=bucket, blob_name=blob_name,
+                chunk_size=self.stream_chunk_size, compress=self.tar_compression,
+                compress_workers=self.compression_workers, index_file=index_file,
+                prefetch=self.tar_prefetch_files)
+            utils.verify_blob_checksums(bucket=bucket, blob_name=blob_name, crc32c=checksums["crc32c"],
+                                        md5=checksums["md5"])
+            utils.upload_to_gcp(bucket=bucket, blob_name=blob_name + utils.TAR_INDEX_SUFFIX, source_file=index_file)
+            os.remove(index_file)
+            bucket_blob_path = "/".join([self.bucket_name, blob_name])
+            sqlite_conn.update_run(
+                name=run_name,
+                payload={
+                    Db.TASKS_TARFILE: tarball_name,
+                    Db.TASKS_GCP_TARFILE: bucket_blob_path,
+                    Db.TASKS_CRC32C: checksums["crc32c"],
+                    Db.TASKS_MD5: checksums["md5"]})
             # Update status of Firestore record
             self.firestore_update_status(run_name=run_name, status=Db.RUN_STATUS_UPLOADING_COMPLETE)
         except Exception as e:
@@ -292,16 +1053,16 @@ class Monitor:
     def kill_childprocess_if_running_to_long(self, pid):
         """
         Args:
-            pid: `int`. The process ID of a child process.
+            pid: `int`. The process ID of a child process in `self.process_table`.
 
         Returns:
             `Boolean`. `True` if the process was killed (kill signal sent) False otherwise.
         """
-        process = utils.get_process(pid)
-        if process:
-            if utils.running_too_long(process, self.process_runtime_limit_sec):
+        child = self.process_table.children.get(pid)
+        if child and self.process_runtime_limit_sec:
+            if time.time() - child.started_at > self.process_runtime_limit_sec:
                 self.logger.info("Killing process {} for running too long".format(pid))
-                process.kill()
+                child.process.kill()
                 return True
                 # The next iteration of the monitor will see that the pid isn't running and restart
                 # the workflow if it hasn't finished yet.
@@ -369,7 +1130,12 @@ class Monitor:
             * the GCP storage attribute (identified by the variable `sruns_monitor.FIRESTORE_ATTR_STORAGE`)
               to the location of the gzip tarfile of the run directory in GCP bucket storage. This
               value is extracted from the local record in the SQLite database, and is formatted as
-              '$bucket_name/blob_path'.
+              '$bucket_name/blob_path'. For a run that was tarred in sharded mode, this is the location
+              of the shard manifest, and the shard attribute (identified by the variable
+              `sruns_monitor.FIRESTORE_ATTR_STORAGE_SHARDS`) is set to the list of the shards' locations.
+            * the checksum attributes (identified by the variables `sruns_monitor.FIRESTORE_ATTR_CRC32C`
+              and `sruns_monitor.FIRESTORE_ATTR_MD5`) to the checksums of the object at the storage
+              location, when they are known.
             * the workflow status attribute (identified by the variable `sruns_monitor.FIRESTORE_ATTR_WF_STATUS`.
               to completed.
 
@@ -388,31 +1154,435 @@ class Monitor:
                 srm.FIRESTORE_ATTR_WF_STATUS: Db.RUN_STATUS_COMPLETE,
                 srm.FIRESTORE_ATTR_STORAGE: rec[Db.TASKS_GCP_TARFILE]
             }
+            if rec[Db.TASKS_CRC32C]:
+                firestore_payload[srm.FIRESTORE_ATTR_CRC32C] = rec[Db.TASKS_CRC32C]
+                firestore_payload[srm.FIRESTORE_ATTR_MD5] = rec[Db.TASKS_MD5]
+            shards = self.sqlite_conn.get_shards(run_name)
+            if shards:
+                firestore_payload[srm.FIRESTORE_ATTR_STORAGE_SHARDS] = [i[Db.SHARDS_GCP_TARFILE] for i in shards]
             self.logger.info("Firestore: Update run record {} with {}.".format(run_name, firestore_payload))
             firestore_conn.document(run_name).update(firestore_payload)
         self.send_mail(subject="Finished processing run {}".format(run_name), body=run_name)
 
+    def queue_stage(self, run_name, sqlite_conn):
+        """
+        Queues the run for the next stage of its workflow, if any. The stage is started by
+        `admit_queued_runs` once a slot is free.
+
+        Args:
+            run_name: `str`. The name of a sequencing run.
+            sqlite_conn: `sruns_monitor.sqlite_utils.Db` instance.
+        """
+        rec = sqlite_conn.get_run(run_name)
+        stage = self.get_next_stage(rec=rec, sqlite_conn=sqlite_conn)
+        if not stage:
+            return
+        self.logger.info("Queueing run {} for the {} stage.".format(run_name, stage))
+        sqlite_conn.update_run(name=run_name, payload={
+            Db.TASKS_STAGE: stage,
+            Db.TASKS_QUEUED_AT: time.time(),
+            Db.TASKS_PID: 0
+        })
+
     def run_workflow(self, run_name):
-        p = Process(target=self._workflow, args=(self.state, run_name))
-        p.start()
+        """
+        Queues the run for the next stage of its workflow, unless it's already queued. This is how
+        the workflow of a new run is started, and how the workflow of a run whose child process
+        failed is restarted from where it left off.
+
+        Args:
+            run_name: `str`. The name of a sequencing run.
+        """
+        rec = self.sqlite_conn.get_run(run_name)
+        if rec[Db.TASKS_QUEUED_AT]:
+            return
+        run_path = rec[Db.TASKS_RUNDIR_PATH]
+        # The ready time is kept from the first time that the run was queued. The size, which only
+        # the shortest first scheduling policy needs, is recorded by `update_rundir_sizes`.
+        if not rec[Db.TASKS_READY_AT]:
+            for sentinal_file_name in self.SENTINAL_FILES:
+                sentinal_file_path = os.path.join(run_path, sentinal_file_name)
+                if os.path.exists(sentinal_file_path):
+                    self.sqlite_conn.update_run(name=run_name, payload={
+                        Db.TASKS_READY_AT: os.path.getctime(sentinal_file_path)})
+                    break
+        self.queue_stage(run_name=run_name, sqlite_conn=self.sqlite_conn)
+
+    def stages_running(self):
+        """
+        Returns:
+            `collections.Counter`. Maps each of the `sruns_monitor.sqlite_utils.Db.STAGE_*` values,
+            and `sruns_monitor.process_table.KIND_INCREMENT`, to the number of workflow stages or
+            increments of that kind started by this monitor that are still running.
+        """
+        return self.process_table.count_kinds()
+
+    def stage_has_slot(self, stage, running):
+        """
+        Args:
+            stage: `str`. One of the `sruns_monitor.sqlite_utils.Db.STAGE_*` values, or
+                `sruns_monitor.process_table.KIND_INCREMENT`.
+            running: `collections.Counter`. The number of stages of each kind that are running, as
+                returned by `stages_running`.
+
+        Returns:
+            `boolean`. True if another stage of the given kind can start without going over
+            `self.max_concurrent_workflows`, `self.max_concurrent_tars` or
+            `self.max_concurrent_uploads`. A streaming stage counts as both a tar and an upload, and
+            an increment, which is tarred before it's uploaded, counts as a tar.
+        """
+        if sum(running.values()) >= self.max_concurrent_workflows:
+            return False
+        tar_kinds = (Db.STAGE_TAR, Db.STAGE_STREAM, process_table.KIND_INCREMENT)
+        if stage in tar_kinds:
+            if sum(running[i] for i in tar_kinds) >= self.max_concurrent_tars:
+                return False
+        if stage in (Db.STAGE_UPLOAD, Db.STAGE_STREAM):
+            if running[Db.STAGE_UPLOAD] + running[Db.STAGE_STREAM] >= self.max_concurrent_uploads:
+                return False
+        return True
+
+    def update_rundir_sizes(self, records):
+        """
+        Records the sizes of the run directories of queued runs, for the shortest first scheduling
+        policy. Each size is computed on a daemon thread, since walking a large run directory, i.e.
+        on NFS, can take minutes, and the result is recorded by a later call. A run whose size
+        couldn't be computed is admitted as if it were empty.
+
+        Args:
+            records: `dict`. Maps the names of queued runs to their records, as returned by
+                `sruns_monitor.sqlite_utils.Db.get_run`. The sizes are updated in place.
+
+        Returns:
+            `set` of the names of the runs whose size isn't known yet.
+        """
+        pending = set()
+        for run_name, rec in records.items():
+            if rec[Db.TASKS_RUNDIR_SIZE] is not None:
+                continue
+            future = self.rundir_size_futures.get(run_name)
+            if not future:
+                self.rundir_size_futures[run_name] = utils.run_in_daemon_thread(
+                    utils.get_dir_size, rec[Db.TASKS_RUNDIR_PATH])
+                pending.add(run_name)
+            elif not future.done():
+                pending.add(run_name)
+            elif future.exception():
+                # The failed future is kept, so that the size isn't computed again.
+                self.logger.warning("Couldn't get the size of run {}: {}".format(run_name, future.exception()))
+            else:
+                del self.rundir_size_futures[run_name]
+                rec[Db.TASKS_RUNDIR_SIZE] = future.result()
+                self.logger.info("Run {} is {} bytes.".format(run_name, rec[Db.TASKS_RUNDIR_SIZE]))
+                self.sqlite_conn.update_run(name=run_name, payload={
+                    Db.TASKS_RUNDIR_SIZE: rec[Db.TASKS_RUNDIR_SIZE]})
+        return pending
+
+    def admit_queued_runs(self):
+        """
+        Starts the queued workflow stages that there are free slots for, in the order given by
+        `self.scheduling_policy`; see `sruns_monitor.scheduling.order_runs`. A run whose stage has no
+        free slot doesn't hold up runs queued for other stages behind it. The process ID is set in
+        the run's record right away, so that the run isn't seen as not running before the child
+        process gets to it. How long the run waited in the queue is recorded as well.
+
+        With the shortest first scheduling policy, a run waits until the size of its run directory
+        is known; see `update_rundir_sizes`.
+        """
+        running = self.stages_running()
+        records = {}
+        for run_name in self.sqlite_conn.get_queued_runs():
+            records[run_name] = self.sqlite_conn.get_run(run_name)
+        sizing = set()
+        if self.scheduling_policy == scheduling.POLICY_SHORTEST_FIRST:
+            sizing = self.update_rundir_sizes(records)
+        queued = scheduling.order_runs([rec for name, rec in records.items() if name not in sizing],
+                                       policy=self.scheduling_policy,
+                                       watchdir_priorities=self.watchdir_priorities)
+        waiting = len(sizing)
+        for run_name in queued:
+            rec = records[run_name]
+            # Runs queued by an earlier version of the monitor don't have a stage yet.
+            stage = rec[Db.TASKS_STAGE] or self.get_next_stage(rec=rec, sqlite_conn=self.sqlite_conn)
+            if self.process_table.get(run_name) or not self.stage_has_slot(stage, running):
+                # A run that was just queued for its next stage by its previous stage's child
+                # process may still be waiting on that process to exit.
+                waiting += 1
+                continue
+            worker_pid = None
+            if self.worker_pool:
+                worker_pid = self.worker_pool.get_idle_worker()
+                if not worker_pid:
+                    waiting += 1
+                    continue
+            wait_sec = time.time() - rec[Db.TASKS_QUEUED_AT]
+            self.logger.info("Starting the {} stage of run {} after {:.0f} seconds in the queue.".format(
+                stage, run_name, wait_sec))
+            if worker_pid:
+                self.worker_pool.submit(worker_pid, run_name, stage)
+                p = self.worker_pool.workers[worker_pid]
+            else:
+                p = Process(target=self._workflow, args=(self.state, run_name, stage))
+                p.start()
+            self.process_table.add(run_name=run_name, kind=stage, process=p)
+            running[stage] += 1
+            self.sqlite_conn.update_run(name=run_name, payload={
+                Db.TASKS_PID: p.pid,
+                Db.TASKS_STAGE: stage,
+                Db.TASKS_QUEUED_AT: 0,
+                Db.TASKS_QUEUE_WAIT_SEC: wait_sec
+            })
+        if waiting:
+            self.logger.info("{} run(s) queued for a workflow stage; running stages: {}.".format(
+                waiting, dict(running)))
 
     def scan(self):
         """
-        Finds all sequencing runs in `self.watchdirs` that are finished sequencing.
+        Finds all sequencing runs in `self.watchdirs` that are finished sequencing, and with
+        `self.incremental_archiving`, those that are still in progress. If `self.run_watcher` is
+        set, the finished runs in the watch directories that it watches with inotify are taken from
+        it rather than found by listing every run directory. Those watch directories are only
+        scanned too if `self.incremental_archiving` is set, since inotify doesn't tell which runs
+        are in progress.
+
+        The other watch directories, i.e. those on a network filesystem, are scanned concurrently,
+        each in its own thread (see `scan_watchdir`), so that a slow or hung mount doesn't hold up
+        the others. The watcher is polled in a thread of its own as well, since it reconciles the
+        watch directories that it watches every so often. Watch directories that aren't scanned or
+        polled within `self.scan_timeout_sec`, or whose scan or poll fails, are reported as degraded,
+        and none of their runs are returned, even those that another scan of the same watch
+        directory found. A scan or poll that hangs isn't started again until it returns.
+
+        Returns:
+            `tuple` of two sorted `list`s of the paths of run directories: those that are finished
+            sequencing, and those that are in progress.
+        """
+        run_paths = set()
+        in_progress = set()
+        watchdirs = self.watchdirs
+        watched = []
+        started = []
+        # The watch directories that failed in this cycle, whether polled or scanned.
+        failed = set()
+        # The watch directories that were checked in this cycle, to the detail of their recovery.
+        checked = {}
+        if self.run_watcher:
+            watched = [i for i in self.watchdirs if os.path.normpath(i) not in self.run_watcher.polled_watchdirs]
+            if not self.incremental_archiving:
+                watchdirs = [i for i in self.watchdirs if i not in watched]
+            if not self.watcher_future or self.watcher_future.done():
+                # The watcher is only ever used by one thread at a time, since a poll that hangs
+                # isn't started again until it returns.
+                self.watcher_future = utils.run_in_daemon_thread(self.run_watcher.poll, False)
+                started.append(self.watcher_future)
+        for watchdir in watchdirs:
+            future = self.scan_futures.get(watchdir)
+            if future and not future.done():
+                # Still hung from an earlier scan, which isn't waited for again.
+                continue
+            cache = self.sqlite_conn.get_scan_cache(watchdir)
+            self.scan_futures[watchdir] = utils.run_in_daemon_thread(self.scan_watchdir, watchdir, cache)
+            started.append(self.scan_futures[watchdir])
+        concurrent.futures.wait(started, timeout=self.scan_timeout_sec)
+        if self.run_watcher:
+            future = self.watcher_future
+            if not future.done():
+                for watchdir in watched:
+                    failed.add(watchdir)
+                    self.report_degraded_watchdir(watchdir, "The inotify watcher wasn't polled within {} seconds.".format(
+                        self.scan_timeout_sec))
+            elif future.exception():
+                for watchdir in watched:
+                    failed.add(watchdir)
+                    self.report_degraded_watchdir(watchdir, "The inotify watcher failed: {}".format(future.exception()))
+            else:
+                for watchdir in watched:
+                    checked[watchdir] = "The inotify watcher was polled."
+                run_paths.update(future.result())
+        for watchdir in watchdirs:
+            future = self.scan_futures[watchdir]
+            if not future.done():
+                failed.add(watchdir)
+                self.report_degraded_watchdir(watchdir, "The scan didn't finish within {} seconds.".format(
+                    self.scan_timeout_sec))
+                continue
+            if future.exception():
+                failed.add(watchdir)
+                self.report_degraded_watchdir(watchdir, "The scan failed: {}".format(future.exception()))
+                continue
+            found, found_in_progress, updated, deleted, latency = future.result()
+            self.sqlite_conn.update_scan_cache(records=updated, deleted_paths=deleted)
+            self.scan_latency[watchdir] = latency
+            self.logger.debug("Scanned {} in {:.3f} seconds; checked {} run directories.".format(
+                watchdir, latency, len(updated)))
+            checked[watchdir] = "It was scanned in {:.3f} seconds.".format(latency)
+            run_paths.update(found)
+            in_progress.update(found_in_progress)
+        # A watch directory is only recovered once both its poll and its scan succeed in the same cycle.
+        for watchdir, detail in checked.items():
+            if watchdir not in failed:
+                self.report_recovered_watchdir(watchdir, detail)
+        # A watch directory that's degraded isn't touched again in this cycle, i.e. by the checks of
+        # a run's sentinal file in `process_rundirs`.
+        degraded = set(os.path.normpath(i) for i in self.degraded_watchdirs)
+        run_paths = [i for i in run_paths if os.path.dirname(os.path.normpath(i)) not in degraded]
+        in_progress = [i for i in in_progress if os.path.dirname(os.path.normpath(i)) not in degraded]
+        return sorted(run_paths), sorted(in_progress)
+
+    def report_degraded_watchdir(self, watchdir, reason):
+        """
+        Logs that a watch directory couldn't be scanned, and sends an email notification the first
+        time, i.e. when it becomes degraded.
+
+        Args:
+            watchdir: `str`. The path to the watch directory.
+            reason: `str`. Why the watch directory couldn't be scanned.
+        """
+        msg = "Watch directory {} is degraded and was skipped. {}".format(watchdir, reason)
+        if watchdir in self.degraded_watchdirs:
+            self.logger.warning(msg)
+            return
+        self.degraded_watchdirs.add(watchdir)
+        self.logger.error(msg)
+        self.send_mail(subject="Watch directory degraded", body=msg)
+
+    def report_recovered_watchdir(self, watchdir, detail):
+        """
+        Logs that a watch directory that was degraded was scanned again, and sends an email
+        notification. Does nothing if the watch directory wasn't degraded.
+
+        Args:
+            watchdir: `str`. The path to the watch directory.
+            detail: `str`. How the watch directory was scanned.
+        """
+        if watchdir not in self.degraded_watchdirs:
+            return
+        self.degraded_watchdirs.discard(watchdir)
+        msg = "Watch directory {} recovered. {}".format(watchdir, detail)
+        self.logger.info(msg)
+        self.send_mail(subject="Watch directory recovered", body=msg)
+
+    def has_sentinal_file(self, run_path):
+        """
+        Returns:
+            `boolean`. True if the run directory has one of `self.SENTINAL_FILES`. Each sentinal file
+            path is checked directly rather than listing the run directory, which can hold a great
+            many files.
+        """
+        for sentinal_file in self.SENTINAL_FILES:
+            if os.path.exists(os.path.join(run_path, sentinal_file)):
+                return True
+        return False
+
+    def scan_watchdir(self, watchdir, cache):
+        """
+        Finds the run directories in a watch directory that have a sentinal file, using the scan
+        cache from the SQLite database. This only touches the filesystem, so that it can run in
+        another thread than the one that owns `self.sqlite_conn`. A run directory is only checked for a sentinal file if its
+        inode or modification time differs from those in its scan cache record, since creating the
+        sentinal file updates the modification time of the run directory. As the modification time
+        can be coarse or lag behind on network filesystems, run directories without a sentinal file
+        are checked again anyway once their record is older than `self.recheck_sec`. Records of run
+        directories that are gone are to be deleted.
+
+        With `self.incremental_archiving`, a run directory without a sentinal file is checked for a
+        RunInfo.xml file at the same time, which means that the run is in progress. As with the
+        sentinal files, the path is checked directly rather than listing the run directory.
+
+        Args:
+            watchdir: `str`. The path to a watch directory.
+            cache: `dict`. The scan cache records of the watch directory, as returned by
+                `sruns_monitor.sqlite_utils.Db.get_scan_cache`.
 
         Returns:
-            `list`. Each element is the path to a run directory.
+            `tuple` of the sorted `list` of the paths of the run directories with a sentinal file,
+            the sorted `list` of the paths of those that are in progress, the `list` of scan cache
+            records to update, the `list` of the paths of the scan cache records to delete, and the
+            number of seconds that the scan took.
         """
+        start = time.monotonic()
+        now = time.time()
         run_paths = []
-        for path in self.watchdirs:
-            for run_name in os.listdir(path):
-                run_path = os.path.join(path,run_name)
-                if not os.path.isdir(run_path):
+        in_progress = []
+        updated = []
+        present = set()
+        with os.scandir(watchdir) as it:
+            for entry in it:
+                try:
+                    if not entry.is_dir():
+                        continue
+                    # The inode comes with the directory entry; the modification time needs a stat.
+                    inode = entry.inode()
+                    mtime_ns = entry.stat().st_mtime_ns
+                except FileNotFoundError:
                     continue
-                if set(os.listdir(run_path)).intersection(self.SENTINAL_FILES):
+                run_path = entry.path
+                present.add(run_path)
+                rec = cache.get(run_path)
+                if rec and rec[Db.SCAN_CACHE_INODE] == inode and rec[Db.SCAN_CACHE_MTIME_NS] == mtime_ns \
+                        and (rec[Db.SCAN_CACHE_READY] or now - rec[Db.SCAN_CACHE_CHECKED_AT] < self.recheck_sec):
+                    ready = bool(rec[Db.SCAN_CACHE_READY])
+                    running = bool(rec[Db.SCAN_CACHE_IN_PROGRESS])
+                else:
+                    ready = self.has_sentinal_file(run_path)
+                    running = not ready and self.incremental_archiving and \
+                        os.path.exists(os.path.join(run_path, "RunInfo.xml"))
+                    updated.append({
+                        Db.SCAN_CACHE_PATH: run_path,
+                        Db.SCAN_CACHE_WATCHDIR: watchdir,
+                        Db.SCAN_CACHE_INODE: inode,
+                        Db.SCAN_CACHE_MTIME_NS: mtime_ns,
+                        Db.SCAN_CACHE_READY: int(ready),
+                        Db.SCAN_CACHE_CHECKED_AT: now,
+                        Db.SCAN_CACHE_IN_PROGRESS: int(running)
+                    })
+                if ready:
                     # This is a completed run directory
                     run_paths.append(run_path)
-        return run_paths
+                elif running:
+                    in_progress.append(run_path)
+        deleted = [i for i in cache if i not in present]
+        return sorted(run_paths), sorted(in_progress), updated, deleted, time.monotonic() - start
+
+    def increment_running(self, run_name):
+        """
+        Returns:
+            `boolean`. True if a child process is archiving an increment of the given run.
+        """
+        child = self.process_table.get(run_name)
+        return bool(child and child.kind == process_table.KIND_INCREMENT)
+
+    def process_in_progress_rundirs(self, runs):
+        """
+        For each sequencing run that is in progress, starts a child process that archives the cycle
+        directories that the sequencer has finished with, unless such a child process is already
+        running for the run, or the run already has a record in the local database, i.e. because it
+        completed. See `task_archive_increment`.
+
+        Increments are started within the same limits as workflow stages, and count as tar stages;
+        see `stage_has_slot`. Since this is called after the queued stages of completed runs were
+        started, those go first. In-progress runs that there's no slot for are checked again on
+        the next cycle.
+
+        Args:
+            runs: `list` where each element is the path to a run directory.
+        """
+        running = self.stages_running()
+        for run in runs:
+            run_name = os.path.basename(run)
+            if self.increment_running(run_name) or self.sqlite_conn.get_run(run_name):
+                continue
+            if not self.stage_has_slot(process_table.KIND_INCREMENT, running):
+                self.logger.info("No free slot to check in-progress rundirs for cycles to archive; running stages: {}.".format(
+                    dict(running)))
+                break
+            if not self.hold_lease(run_name):
+                continue
+            self.logger.info("Checking in-progress rundir {} for cycles to archive".format(run_name))
+            p = Process(target=self.task_archive_increment, args=(self.state, run))
+            p.start()
+            self.process_table.add(run_name=run_name, kind=process_table.KIND_INCREMENT, process=p)
+            running[process_table.KIND_INCREMENT] += 1
 
     def process_rundirs(self, runs):
         """
@@ -424,23 +1594,35 @@ class Monitor:
         """
         for run in runs:
             run_name = os.path.basename(run)
+            if not self.hold_lease(run_name):
+                continue
             self.logger.info("Processing rundir {}".format(run_name))
-            run_status = self.sqlite_conn.get_run_status(run_name)
+            run_status = self.sqlite_conn.get_run_status(run_name, running_pids=self.process_table)
             if run_status == Db.RUN_STATUS_NEW:
+                if self.increment_running(run_name):
+                    self.logger.info("Waiting on increment of run {} to finish before processing it".format(run_name))
+                    continue
                 self.process_new_run(run)
             elif run_status == Db.RUN_STATUS_COMPLETE:
                 self.process_completed_run(run_name)
+                self.complete_lease(run_name)
             elif run_status == Db.RUN_STATUS_RUNNING:
-                # Check if it has been running for too long.
-                rec = self.sqlite_conn.get_run(run_name)
-                pid = rec[Db.TASKS_PID]
-                if self.kill_childprocess_if_running_to_long(pid):
+                # Check if it has been running for too long. The process is looked up by run
+                # rather than by the process ID in the run's record, since a worker process of
+                # `self.worker_pool` runs the stages of other runs too.
+                child = self.process_table.get(run_name)
+                pid = child.process.pid if child else 0
+                if child and self.kill_childprocess_if_running_to_long(pid):
                     msg = "Child process {} for run {} killed for running too long.".format(pid, run_name)
                     self.logger.info(msg)
                     # Send email notification
                     self.send_mail(subject="Run {} killed".format(run_name), body=msg)
             elif run_status == Db.RUN_STATUS_NOT_RUNNING:
                 self.run_workflow(run_name)
+            elif run_status == Db.RUN_STATUS_QUEUED:
+                stage = self.sqlite_conn.get_run(run_name)[Db.TASKS_STAGE]
+                self.logger.info("Run {} is queued for the {} stage".format(run_name, stage))
+        self.admit_queued_runs()
 
 
     def send_mail(self, subject, body):
@@ -453,12 +1635,26 @@ class Monitor:
                 it will be prefixed with `self.monitor_Name` plus a colon and a space. 
             body: `str`. The email body w/o any markup.
 
+        In event-loop mode, the email is sent from `self.mail_executor` and this method returns
+        right away.
+
         Returns: `None`. 
         """
         subject = self.monitor_name + ": " + subject
         mail_params = self.get_mail_params()
         if not mail_params:
             return
+        if self.mail_executor and os.getpid() == self.main_pid:
+            future = self.mail_executor.submit(self._send_mail, subject, body, mail_params)
+            future.add_done_callback(self._log_mail_error)
+            return
+        self._send_mail(subject=subject, body=body, mail_params=mail_params)
+
+    def _log_mail_error(self, future):
+        if future.exception():
+            self.logger.error("Failed to send mail: {}".format(future.exception()))
+
+    def _send_mail(self, subject, body, mail_params):
         from_addr = mail_params["from"]
         host = mail_params["host"]
         tos = mail_params["tos"]
@@ -469,23 +1665,124 @@ class Monitor:
             """.format(subject, body))
         utils.send_mail(from_addr=from_addr, to_addrs=tos, subject=subject, body=body, host=host)
 
+    def finish_worker_job(self, pid, exit_code):
+        """
+        Records that a worker process of `self.worker_pool` finished its workflow stage. The exit
+        code is recorded in SQLite by `reap_children`, as for a stage that ran in its own process.
+
+        The worker's process ID is cleared from the run's SQLite record, since the worker lives on
+        and takes other jobs. Otherwise, the run would look like it's running once the worker runs
+        another run's stage, and would never be restarted if its stage failed.
+
+        Args:
+            pid: `int`. The process ID of the worker.
+            exit_code: `int`. 0 if the stage succeeded, 1 if it raised an Exception.
+        """
+        child = self.process_table.children.get(pid)
+        self.worker_pool.job_done(pid)
+        self.process_table.finish(pid, exit_code)
+        if not child:
+            return
+        rec = self.sqlite_conn.get_run(child.run_name)
+        if rec and rec[Db.TASKS_PID] == pid:
+            self.sqlite_conn.update_run(name=child.run_name, payload={Db.TASKS_PID: 0})
+
+    def reap_children(self):
+        """
+        Reaps the child processes that exited, in case a SIGCHLD was missed, and records the exit
+        code of each workflow stage that exited in its SQLite record. With `self.worker_pool`, also
+        collects the stages that the workers finished, and replaces the workers that died.
+
+        Returns:
+            `int`. The number of workflow stages that exited since the last call.
+        """
+        if self.worker_pool:
+            result = self.worker_pool.get_result()
+            while result:
+                self.finish_worker_job(*result)
+                result = self.worker_pool.get_result()
+        self.process_table.reap()
+        if self.worker_pool:
+            # Replaces the workers that died, i.e. that were killed for running too long.
+            self.worker_pool.maintain()
+        finished = 0
+        for child, exit_code in self.process_table.pop_exited():
+            msg = "The {} process of run {} (process ID {}) exited with code {}.".format(
+                child.kind, child.run_name, child.process.pid, exit_code)
+            if exit_code:
+                self.logger.warning(msg)
+            else:
+                self.logger.info(msg)
+            if child.kind == process_table.KIND_INCREMENT:
+                continue
+            finished += 1
+            self.sqlite_conn.update_run(name=child.run_name, payload={Db.TASKS_EXIT_CODE: exit_code})
+        return finished
+
+    def process_cycle(self):
+        """
+        Renews the leases of the runs that this monitor holds, if any, then scans the watch directories
+        and processes the runs found; see `process_rundirs` and `process_in_progress_rundirs`.
+        """
+        self.renew_leases()
+        finished_rundirs, in_progress_rundirs = self.scan()
+        self.process_rundirs(runs=finished_rundirs)
+        if self.incremental_archiving:
+            self.process_in_progress_rundirs(runs=in_progress_rundirs)
+
+    def report_child_error(self, child_process_msg):
+        """
+        Logs and sends an email notification about a message that a child process put in
+        `self.state` before it died.
+
+        Args:
+            child_process_msg: `tuple` of the run name, the process ID and the Exception.
+        """
+        run_name = child_process_msg[0]
+        pid = child_process_msg[1]
+        err_msg = child_process_msg[2]
+        msg = "Run {} with process ID {} exited with message '{}'.".format(run_name, pid, err_msg)
+        self.logger.error(msg)
+        self.logger.info("Sending email notification")
+        self.send_mail(subject="Error for run {}".format(run_name), body=msg)
+
+    def sweep_completed_runs(self):
+        """
+        Removes the run directories in `self.completed_runs_dir` that are older than
+        `self.sweep_age_sec`.
+        """
+        deleted_dirs = utils.clean_completed_runs(basedir=self.completed_runs_dir, limit=self.sweep_age_sec)
+        if deleted_dirs:
+            for d_path in deleted_dirs:
+                self.logger.info("Deleted directory {}".format(d_path)) 
+
+    def report_main_exception(self, e):
+        """
+        Logs and sends an email notification about an Exception in the main process. The email is
+        sent right away, even in event-loop mode, since the main process is about to exit.
+        """
+        self.mail_executor = None
+        tb = e.__traceback__
+        tb_msg = pformat(traceback.extract_tb(tb).format())
+        msg = "Main process Exception: {} {}".format(e, tb_msg)
+        self.logger.error(msg)
+        self.send_mail(subject="Error", body=msg)
+
     def start(self):
+        if self.worker_pool:
+            # Before the main process creates any clients of its own, which the workers would
+            # inherit.
+            self.worker_pool.maintain()
+        if self.event_loop:
+            asyncio.run(self.run_event_loop())
+            return
         cycle_num = 0
         try:
             while True:
                 cycle_num += 1
                 self.logger.info("Cycle {}".format(cycle_num))
-                # Remove any zombie processes
-                # Curious why or how this works? See book Programming Python, 4th ed. section
-                # "Killing the zombies: Don't fear the reaper!".
-                try:
-                    os.waitpid(0, os.WNOHANG)
-                    # The 0 argument above means to check for any completed child process, not one with a
-                    # specific pid.
-                except ChildProcessError:
-                    pass # No child processes
-                finished_rundirs = self.scan()
-                self.process_rundirs(runs=finished_rundirs)
+                self.reap_children()
+                self.process_cycle()
                 # Now check the shared queue object to see if any child process ran into some trouble
                 # and recorded its dying last words:
                 child_process_msg = None
@@ -494,25 +1791,122 @@ class Monitor:
                 except queue.Empty:
                     pass
                 if child_process_msg:
-                    run_name = child_process_msg[0]
-                    pid = child_process_msg[1]
-                    err_msg = child_process_msg[2]
-                    msg = "Run {} with process ID {} exited with message '{}'.".format(run_name, pid, err_msg)
-                    self.logger.error(msg)
-                    self.logger.info("Sending email notification")
-                    self.send_mail(subject="Error for run {}".format(run_name), body=msg)
-                deleted_dirs = utils.clean_completed_runs(basedir=self.completed_runs_dir, limit=self.sweep_age_sec)
-                if deleted_dirs:
-                    for d_path in deleted_dirs:
-                        self.logger.info("Deleted directory {}".format(d_path)) 
+                    self.report_child_error(child_process_msg)
+                self.sweep_completed_runs()
                 time.sleep(self.cycle_pause_sec)
         except Exception as e:
-            tb = e.__traceback__
-            tb_msg = pformat(traceback.extract_tb(tb).format())
-            msg = "Main process Exception: {} {}".format(e, tb_msg)
-            self.logger.error(msg)
-            self.send_mail(subject="Error", body=msg)
+            self.report_main_exception(e)
+            raise
+
+    async def run_event_loop(self):
+        """
+        The event-loop mode of `start`. Rather than doing everything in turn once per cycle, the
+        following run independently of each other:
+
+            * Scanning and processing the watch directories (`process_cycle`), every
+              `self.cycle_pause_sec` seconds, and also right away when a workflow stage finishes, a
+              child process reports an error, or `self.run_watcher` has inotify events.
+            * Reaping the child processes that exited (`reap_children`), on SIGCHLD, and when a
+              worker process of `self.worker_pool` finishes a stage.
+            * Waiting on error messages from child processes in `self.state`.
+            * Sweeping the completed runs directory, every `self.cycle_pause_sec` seconds.
+            * Sending emails, on their own thread.
+
+        All of the work that uses the local database, including starting child processes and
+        updating Firestore, is done on a single control thread, one step at a time, so that the event
+        loop itself never blocks. That way, the upload stage of a run starts as soon as its tar stage
+        exits, rather than on the next cycle.
+        """
+        loop = asyncio.get_running_loop()
+        self.mail_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mail")
+        # Child processes are started from the control thread, so it mustn't be a ThreadPoolExecutor
+        # thread; see `sruns_monitor.utils.DaemonThreadExecutor`.
+        control_executor = utils.DaemonThreadExecutor(name="control")
+        io_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="io")
+        wakeup = asyncio.Event()
+
+        def control(fn, *args):
+            return loop.run_in_executor(control_executor, fn, *args)
+
+        watcher_fd = self.run_watcher.fileno() if self.run_watcher else None
+
+        def on_watcher_event():
+            # The events are read by the next scan. Until then, stop watching the file descriptor so
+            # that this isn't called over and over.
+            loop.remove_reader(watcher_fd)
+            wakeup.set()
+
+        async def scan_loop():
+            cycle_num = 0
+            while True:
+                cycle_num += 1
+                self.logger.info("Cycle {}".format(cycle_num))
+                wakeup.clear()
+                await control(self.process_cycle)
+                if watcher_fd is not None:
+                    loop.add_reader(watcher_fd, on_watcher_event)
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=self.cycle_pause_sec)
+                except asyncio.TimeoutError:
+                    pass
+
+        # SIGCHLD is handled on the event loop rather than by `_on_sigchld`, so that the process
+        # table is only ever used by the control thread. The loop waits for it for at most
+        # `self.cycle_pause_sec` before reaping anyway.
+        sigchld = asyncio.Event()
+        loop.add_signal_handler(signal.SIGCHLD, sigchld.set)
+
+        async def reap_loop():
+            while True:
+                try:
+                    await asyncio.wait_for(sigchld.wait(), timeout=self.cycle_pause_sec)
+                except asyncio.TimeoutError:
+                    pass
+                sigchld.clear()
+                if await control(self.reap_children):
+                    # A workflow stage exited, so its slot is free.
+                    wakeup.set()
+
+        async def worker_loop():
+            # Worker processes don't exit when they finish a stage, so there's no SIGCHLD for it.
+            while True:
+                result = await loop.run_in_executor(io_executor, self.worker_pool.get_result,
+                                                    self.REAP_INTERVAL_SEC)
+                if result:
+                    await control(self.finish_worker_job, *result)
+                    sigchld.set()
+
+        def get_child_error():
+            try:
+                return self.state.get(timeout=self.REAP_INTERVAL_SEC)
+            except queue.Empty:
+                return None
+
+        async def error_loop():
+            while True:
+                child_process_msg = await loop.run_in_executor(io_executor, get_child_error)
+                if child_process_msg:
+                    self.report_child_error(child_process_msg)
+                    wakeup.set()
+
+        async def sweep_loop():
+            while True:
+                await loop.run_in_executor(io_executor, self.sweep_completed_runs)
+                await asyncio.sleep(self.cycle_pause_sec)
+
+        self.logger.info("Starting in event-loop mode.")
+        try:
+            loops = [scan_loop(), reap_loop(), error_loop(), sweep_loop()]
+            if self.worker_pool:
+                loops.append(worker_loop())
+            await asyncio.gather(*loops)
+        except Exception as e:
+            self.report_main_exception(e)
             raise
+        finally:
+            loop.remove_signal_handler(signal.SIGCHLD)
+            for executor in (control_executor, io_executor):
+                executor.shutdown(wait=False, cancel_futures=True)
 
 
 ### Example
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+"""
+An in-memory table of the child processes that the monitor started. The monitor reaps its children
+as soon as they exit, when it gets a SIGCHLD, and keeps track of which are still running. Whether a
+workflow is running is then a dictionary lookup rather than a query to the OS, and a process ID that
+was recycled by an unrelated process after the workflow exited can't make the workflow look like
+it's still running.
+"""
+
+import collections
+import time
+
+
+#: The kind of a child process that archives an increment of a run that's still in progress.
+KIND_INCREMENT = "increment"
+
+#: A child process in a `ProcessTable`. `kind` is one of the `sruns_monitor.sqlite_utils.Db.STAGE_*`
+#: values, or `KIND_INCREMENT`. `started_at` is in seconds since the epoch.
+ChildProcess = collections.namedtuple("ChildProcess", ["run_name", "kind", "process", "started_at"])
+
+
+class ProcessTable:
+    """
+    Keeps track of the running child processes of the monitor, by process ID. A run has at most one
+    child process at a time.
+
+    `reap` is meant to be called from a SIGCHLD handler, which runs in-between any two statements of
+    the main thread, so a `ProcessTable` doesn't use locks.
+    """
+
+    def __init__(self):
+        #: Maps the process ID of each running child process to its `ChildProcess`.
+        self.children = {}
+        #: (`ChildProcess`, exit code) tuples of the child processes that exited, until they're
+        #: collected with `pop_exited`.
+        self.exited = []
+
+    def __contains__(self, pid):
+        return pid in self.children
+
+    def __len__(self):
+        return len(self.children)
+
+    def add(self, run_name, kind, process):
+        """
+        Args:
+            run_name: `str`. The name of the run that the child process works on.
+            kind: `str`. What the child process does; see `ChildProcess`.
+            process: `multiprocessing.Process`. The child process, already started.
+
+        Returns:
+            `ChildProcess`.
+        """
+        child = ChildProcess(run_name=run_name, kind=kind, process=process, started_at=time.time())
+        self.children[process.pid] = child
+        return child
+
+    def get(self, run_name):
+        """
+        Returns:
+            `ChildProcess` of the given run that's running, or None if there isn't one.
+        """
+        for child in list(self.children.values()):
+            if child.run_name == run_name:
+                return child
+        return None
+
+    def count_kinds(self):
+        """
+        Returns:
+            `collections.Counter`. Maps each kind of child process to how many are running.
+        """
+        return collections.Counter(child.kind for child in list(self.children.values()))
+
+    def reap(self):
+        """
+        Reaps all of the child processes that exited, and moves them from `self.children` to
+        `self.exited`.
+
+        Returns:
+            `int`. The number of child processes reaped.
+        """
+        reaped = 0
+        for pid, child in list(self.children.items()):
+            # is_alive() waits for the process without blocking, and sets its exitcode once it has
+            # exited. The exit code is negative if the process was killed by a signal.
+            if child.process.is_alive():
+                continue
+            # A reap that interrupted this one may have gotten to the process first.
+            if self.children.pop(pid, None):
+                self.exited.append((child, child.process.exitcode))
+                reaped += 1
+        return reaped
+
+    def finish(self, pid, exit_code):
+        """
+        Records that the job of a child process that keeps running after it, i.e. a worker of a
+        `sruns_monitor.worker_pool.WorkerPool`, finished, as if the process had exited.
+
+        Args:
+            pid: `int`. The process ID of the child process.
+            exit_code: `int`. The job's exit code.
+        """
+        child = self.children.pop(pid, None)
+        if child:
+            self.exited.append((child, exit_code))
+
+    def pop_exited(self):
+        """
+        Returns:
+            `list` of (`ChildProcess`, exit code) tuples of the child processes that exited since the
+            last call.
+        """
+        exited, self.exited = self.exited, []
+        return exited
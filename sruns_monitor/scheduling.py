@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""
+Policies for the order in which runs that are queued for a workflow slot are admitted; see
+`sruns_monitor.monitor.Monitor.admit_queued_runs`.
+"""
+
+import os
+
+from sruns_monitor.sqlite_utils import Db
+
+
+#: Scheduling policy name for admitting runs in the order in which their sentinal files appeared.
+POLICY_FIFO = "fifo"
+
+#: Scheduling policy name for admitting the smallest runs first, so that a small run doesn't wait
+#: for a large run that was queued before it.
+POLICY_SHORTEST_FIRST = "shortest_first"
+
+#: Scheduling policy name for admitting runs from the watch directories with the highest priority
+#: first, and in the order in which their sentinal files appeared within the same priority.
+POLICY_WATCHDIR_PRIORITY = "watchdir_priority"
+
+#: All scheduling policy names.
+POLICIES = [POLICY_FIFO, POLICY_SHORTEST_FIRST, POLICY_WATCHDIR_PRIORITY]
+
+
+def get_ready_time(rec):
+    """
+    Args:
+        rec: `dict`. A run record as returned by `sruns_monitor.sqlite_utils.Db.get_run`.
+
+    Returns:
+        `float`. When the run was ready to be processed, in seconds since the epoch. This is when
+        its sentinal file appeared, if known, or else when it was queued.
+    """
+    return rec[Db.TASKS_READY_AT] or rec[Db.TASKS_QUEUED_AT]
+
+
+def order_runs(records, policy=POLICY_FIFO, watchdir_priorities=None):
+    """
+    Sorts queued runs in the order in which they should be admitted.
+
+    Args:
+        records: `list` of run records as returned by `sruns_monitor.sqlite_utils.Db.get_run`.
+        policy: `str`. One of the `POLICY_*` values.
+        watchdir_priorities: `dict`. For `POLICY_WATCHDIR_PRIORITY`, maps watch directory paths to
+            priorities. Runs in watch directories that aren't present have a priority of 0.
+
+    Returns:
+        `list` of the names of the runs, in the order in which they should be admitted.
+
+    Raises:
+        `ValueError`: `policy` isn't a known policy name.
+    """
+    if policy == POLICY_FIFO:
+        key = lambda rec: (get_ready_time(rec),)
+    elif policy == POLICY_SHORTEST_FIRST:
+        # A run whose size couldn't be computed is ordered as if its run directory were empty.
+        key = lambda rec: (rec[Db.TASKS_RUNDIR_SIZE] or 0, get_ready_time(rec))
+    elif policy == POLICY_WATCHDIR_PRIORITY:
+        priorities = {os.path.normpath(k): v for k, v in (watchdir_priorities or {}).items()}
+        def key(rec):
+            watchdir = os.path.dirname(os.path.normpath(rec[Db.TASKS_RUNDIR_PATH]))
+            return (-priorities.get(watchdir, 0), get_ready_time(rec))
+    else:
+        raise ValueError("Unknown scheduling policy '{}'.".format(policy))
+    return [rec[Db.TASKS_NAME] for rec in sorted(records, key=key)]
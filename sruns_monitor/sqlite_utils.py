@@ -38,7 +38,117 @@ class Db:
     TASKS_GCP_TARFILE = "gcp_tarfile"
     #: 'tasks' table attribute name that stores the path to the run directory.
     TASKS_RUNDIR_PATH = "rundir_path"
-    
+    #: 'tasks' table attribute name that stores the number of members written to the tarfile as of
+    #: the tar task's last checkpoint.
+    TASKS_TAR_MEMBERS = "tar_members"
+    #: 'tasks' table attribute name that stores the byte offset in the tarfile just after the last
+    #: complete member as of the tar task's last checkpoint.
+    TASKS_TAR_OFFSET = "tar_offset"
+    #: 'tasks' table attribute name that stores the URI of the resumable upload session of the
+    #: tarfile, so that an interrupted upload task can pick up where it left off.
+    TASKS_UPLOAD_SESSION = "upload_session"
+    #: 'tasks' table attribute name that stores the number of bytes of the tarfile that GCP Storage
+    #: confirmed as of the upload task's last checkpoint.
+    TASKS_UPLOAD_OFFSET = "upload_offset"
+    #: 'tasks' table attribute name that stores the base64-encoded CRC32C checksum of the tarfile,
+    #: computed as the tarfile was written. This is the encoding that GCP Storage uses in object
+    #: metadata.
+    TASKS_CRC32C = "crc32c"
+    #: 'tasks' table attribute name that stores the base64-encoded MD5 hash of the tarfile, computed
+    #: as the tarfile was written.
+    TASKS_MD5 = "md5"
+    #: 'tasks' table attribute name that stores the time, in seconds since the epoch, at which the
+    #: run was queued to wait for a free slot in a workflow stage, or 0 if it isn't queued.
+    TASKS_QUEUED_AT = "queued_at"
+    #: 'tasks' table attribute name that stores the size in bytes of the run directory, as added up
+    #: when the run was queued with the shortest first scheduling policy, or NULL until it's known.
+    #: An empty run directory has a size of 0.
+    TASKS_RUNDIR_SIZE = "rundir_size"
+    #: 'tasks' table attribute name that stores the time, in seconds since the epoch, at which the
+    #: run's sentinal file appeared, or 0 if unknown.
+    TASKS_READY_AT = "ready_at"
+    #: 'tasks' table attribute name that stores how long, in seconds, the run last waited in the
+    #: queue for a workflow slot.
+    TASKS_QUEUE_WAIT_SEC = "queue_wait_sec"
+    #: 'tasks' table attribute name that stores the workflow stage that the run is queued for or
+    #: was last started in, one of the STAGE_* constants defined in this class.
+    TASKS_STAGE = "stage"
+    #: 'tasks' table attribute name that stores the exit code of the child process that last ran a
+    #: workflow stage of the run, recorded when the monitor reaped it. It's negative if the process
+    #: was killed by a signal, and NULL until a stage has exited.
+    TASKS_EXIT_CODE = "exit_code"
+    #: Attributes that were added to the 'tasks' table after its initial release, along with their
+    #: SQL type definitions. These are added to existing databases when a `Db` is instantiated.
+    TASKS_ADDED_COLUMNS = [
+        (TASKS_TAR_MEMBERS, "integer DEFAULT 0"),
+        (TASKS_TAR_OFFSET, "integer DEFAULT 0"),
+        (TASKS_UPLOAD_SESSION, "text DEFAULT ''"),
+        (TASKS_UPLOAD_OFFSET, "integer DEFAULT 0"),
+        (TASKS_CRC32C, "text DEFAULT ''"),
+        (TASKS_MD5, "text DEFAULT ''"),
+        (TASKS_QUEUED_AT, "real DEFAULT 0"),
+        (TASKS_RUNDIR_SIZE, "integer"),
+        (TASKS_READY_AT, "real DEFAULT 0"),
+        (TASKS_QUEUE_WAIT_SEC, "real DEFAULT 0"),
+        (TASKS_STAGE, "text DEFAULT ''"),
+        (TASKS_EXIT_CODE, "integer")
+    ]
+
+    #: The name of the table that stores the shards of a sequencing run that was tarred in sharded
+    #: mode. There is a record per shard.
+    SHARDS_TABLE_NAME = "shards"
+    #: 'shards' table attribute name that stores the name of the sequencing run the shard belongs to.
+    SHARDS_RUN_NAME = "run_name"
+    #: 'shards' table attribute name that stores the name of the shard, i.e. L001.
+    SHARDS_NAME = "shard"
+    #: 'shards' table attribute name that stores the path to the shard's tarfile.
+    SHARDS_TARFILE = "tarfile"
+    #: 'shards' table attribute name that stores the path to the shard's tarfile in a GCP Storage bucket.
+    SHARDS_GCP_TARFILE = "gcp_tarfile"
+    #: 'shards' table attribute name that stores, for a shard that was archived incrementally while
+    #: the run was in progress, a JSON list of the paths (relative to the run directory) in the shard.
+    SHARDS_MEMBERS = "members"
+    #: 'shards' table attribute name that stores the base64-encoded CRC32C checksum of the shard's
+    #: tarfile.
+    SHARDS_CRC32C = "crc32c"
+    #: 'shards' table attribute name that stores the base64-encoded MD5 hash of the shard's tarfile.
+    SHARDS_MD5 = "md5"
+    #: Attributes that were added to the 'shards' table after its initial release, along with their
+    #: SQL type definitions. These are added to existing databases when a `Db` is instantiated.
+    SHARDS_ADDED_COLUMNS = [
+        (SHARDS_CRC32C, "text DEFAULT ''"),
+        (SHARDS_MD5, "text DEFAULT ''")
+    ]
+
+    #: The name of the table that caches what the last scan found in each run directory, so that a
+    #: run directory is only looked at again once it changed. There is a record per run directory.
+    SCAN_CACHE_TABLE_NAME = "scan_cache"
+    #: 'scan_cache' table attribute name that stores the path to the run directory.
+    SCAN_CACHE_PATH = "path"
+    #: 'scan_cache' table attribute name that stores the path to the watch directory that the run
+    #: directory is in.
+    SCAN_CACHE_WATCHDIR = "watchdir"
+    #: 'scan_cache' table attribute name that stores the inode number of the run directory.
+    SCAN_CACHE_INODE = "inode"
+    #: 'scan_cache' table attribute name that stores the modification time of the run directory in
+    #: nanoseconds, as of when it was last checked.
+    SCAN_CACHE_MTIME_NS = "mtime_ns"
+    #: 'scan_cache' table attribute name that stores 1 if the run directory had a sentinal file when
+    #: it was last checked, or 0 if not.
+    SCAN_CACHE_READY = "ready"
+    #: 'scan_cache' table attribute name that stores when the run directory was last checked, in
+    #: seconds since the epoch.
+    SCAN_CACHE_CHECKED_AT = "checked_at"
+    #: 'scan_cache' table attribute name that stores 1 if the run directory had a RunInfo.xml file
+    #: but no sentinal file when it was last checked, meaning that the run is in progress, or 0 if
+    #: not.
+    SCAN_CACHE_IN_PROGRESS = "in_progress"
+
+    #: Columns that were added to the 'scan_cache' table after it was first released, as (name,
+    #: definition) tuples. See `add_missing_columns`.
+    SCAN_CACHE_ADDED_COLUMNS = [
+        (SCAN_CACHE_IN_PROGRESS, "integer DEFAULT 0")
+    ]
 
     # Constants to define the status of a record.
     #: Status value for a new sequencing run.                                                       
@@ -54,6 +164,9 @@ class Db:
     RUN_STATUS_TARRING_COMPLETE = "tarring_complete"                                                
     #: Status value for a sequencing run that is in the uploading task                              
     RUN_STATUS_UPLOADING = "uploading"                                                              
+    #: Status value for a sequencing run that is being tarred straight into GCP Storage (streaming
+    #: mode).
+    RUN_STATUS_STREAMING = "streaming"
     #: Status value for a sequencing run whose uploading task just completed                        
     RUN_STATUS_UPLOADING_COMPLETE = "uploading_complete"                                            
     #: Status value for a sequencing run that has completed the workflow.                           
@@ -62,17 +175,30 @@ class Db:
     #: workflow is no longer running. For example, the tarfile task ran but the upload to GCP       
     #: task didn't because maybe it failed for some reason.                                         
     RUN_STATUS_NOT_RUNNING = "not_running" 
+    #: Status value for a sequencing run that is waiting for a free slot in the workflow stage that
+    #: it's queued for, after which that stage is started.
+    RUN_STATUS_QUEUED = "queued"
+    # Constants to define the stages of the workflow. Each stage runs in its own child process.
+    #: Stage value for tarring a run directory to a local tarfile.
+    STAGE_TAR = "tar"
+    #: Stage value for uploading a run's local tarfile(s).
+    STAGE_UPLOAD = "upload"
+    #: Stage value for tarring a run directory straight into GCP Storage (streaming mode), which
+    #: counts as both a tar and an upload.
+    STAGE_STREAM = "stream"
     #: A database lock for write access.
     DB_LOCK = multiprocessing.Lock()
 
     logger = logging.getLogger(__name__)
 
-    def __init__(self, dbname, verbose=True):
+    def __init__(self, dbname, verbose=True, check_same_thread=True):
         """
         Args:
             dbname: `str`. Name of the local database file. If it doesn't end with a .db exention,
                 one will be added. 
             verbose: `boolean`. True enables verbose logging. 
+            check_same_thread: `boolean`. False allows the connection to be used by a thread other
+                than the one that created it, as long as only one thread uses it at a time.
         """
         #: If True, then verbose logging is enabled.
         self.verbose = verbose
@@ -83,7 +209,7 @@ class Db:
         #: A `sqlite3.Connection` instance.  The specified database file is created if it doesn't 
         #: yet exist. See entry level details here:
         #: http://www.sqlitetutorial.net/sqlite-python/creating-database/
-        self.conn = sqlite3.connect(database=dbname, timeout=5) # sec timeout is also the default
+        self.conn = sqlite3.connect(database=dbname, timeout=5, check_same_thread=check_same_thread) # sec timeout is also the default
         create_table_sql = """
             CREATE TABLE IF NOT EXISTS {table} (
                 {name} text PRIMARY KEY,
@@ -97,22 +223,81 @@ class Db:
                        tarfile=self.TASKS_TARFILE,
                        gcp_tarfile=self.TASKS_GCP_TARFILE,
                        rundir_path=self.TASKS_RUNDIR_PATH)
+        create_shards_table_sql = """
+            CREATE TABLE IF NOT EXISTS {table} (
+                {run_name} text,
+                {shard} text,
+                {tarfile} text,
+                {gcp_tarfile} text,
+                {members} text,
+                PRIMARY KEY ({run_name}, {shard}));
+            """.format(table=self.SHARDS_TABLE_NAME,
+                       run_name=self.SHARDS_RUN_NAME,
+                       shard=self.SHARDS_NAME,
+                       tarfile=self.SHARDS_TARFILE,
+                       gcp_tarfile=self.SHARDS_GCP_TARFILE,
+                       members=self.SHARDS_MEMBERS)
+        create_scan_cache_table_sql = """
+            CREATE TABLE IF NOT EXISTS {table} (
+                {path} text PRIMARY KEY,
+                {watchdir} text,
+                {inode} integer,
+                {mtime_ns} integer,
+                {ready} integer,
+                {checked_at} real);
+            """.format(table=self.SCAN_CACHE_TABLE_NAME,
+                       path=self.SCAN_CACHE_PATH,
+                       watchdir=self.SCAN_CACHE_WATCHDIR,
+                       inode=self.SCAN_CACHE_INODE,
+                       mtime_ns=self.SCAN_CACHE_MTIME_NS,
+                       ready=self.SCAN_CACHE_READY,
+                       checked_at=self.SCAN_CACHE_CHECKED_AT)
         with self.DB_LOCK:
             with self.conn as conn:
                 conn.execute(create_table_sql)
+                conn.execute(create_shards_table_sql)
+                conn.execute(create_scan_cache_table_sql)
+        self.add_missing_columns(table=self.TASKS_TABLE_NAME, columns=self.TASKS_ADDED_COLUMNS)
+        self.add_missing_columns(table=self.SHARDS_TABLE_NAME, columns=self.SHARDS_ADDED_COLUMNS)
+        self.add_missing_columns(table=self.SCAN_CACHE_TABLE_NAME, columns=self.SCAN_CACHE_ADDED_COLUMNS)
+
+    def add_missing_columns(self, table, columns):
+        """
+        Adds any of the given columns that the table doesn't have yet. This brings databases that
+        were created by an earlier version of this package up to date.
+
+        Args:
+            table: `str`. The name of the table.
+            columns: `list` of (name, definition) two-item tuples, where definition is the column's
+                SQL type definition, i.e. 'integer DEFAULT 0'.
+        """
+        existing = [i[1] for i in self.conn.execute("PRAGMA table_info({});".format(table))]
+        for name, definition in columns:
+            if name in existing:
+                continue
+            sql = "ALTER TABLE {table} ADD COLUMN {name} {definition};".format(
+                table=table, name=name, definition=definition)
+            self.log(msg=sql, verbose=True)
+            with self.DB_LOCK:
+                with self.conn as conn:
+                    conn.execute(sql)
 
     def log(self, msg, verbose=False):
         if verbose and not self.verbose:
             return
         self.logger.debug(msg)
 
-    def get_run_status(self, name):
+    def get_run_status(self, name, running_pids=None):
         """
         Determines the state of the workflow for a given run based on the run record in the
         database.
 
         Args:
             name: `str`. The name of a sequencing run.
+            running_pids: Container of the process IDs of the workflows that are running, i.e. a
+                `sruns_monitor.process_table.ProcessTable`. If given, whether the run's workflow is
+                running is looked up there rather than by asking the OS whether a process with
+                that ID exists, which can't tell a recycled process ID from the workflow's.
 
         Returns:
             `str`. One of the RUN_STATUS_* constants defined in this class. 
@@ -124,17 +309,20 @@ class Db:
         elif rec[self.TASKS_TARFILE] and rec[self.TASKS_GCP_TARFILE]:
             return self.RUN_STATUS_COMPLETE
         pid = rec[self.TASKS_PID]
+        not_running = self.RUN_STATUS_QUEUED if rec[self.TASKS_QUEUED_AT] else self.RUN_STATUS_NOT_RUNNING
         if not pid:
-            return self.RUN_STATUS_NOT_RUNNING
+            return not_running
+        if running_pids is not None:
+            return self.RUN_STATUS_RUNNING if pid in running_pids else not_running
         # Check if running
         try:
             process = utils.get_process(pid)
             if process:
                 return self.RUN_STATUS_RUNNING
             else:
-                return self.RUN_STATUS_NOT_RUNNING
+                return not_running
         except psutil.NoSuchProcess:
-            return self.RUN_STATUS_NOT_RUNNING
+            return not_running
 
     def insert_run(self, rundir_path, pid=0, tarfile="", gcp_tarfile=""):
         """
@@ -195,12 +383,24 @@ class Db:
             `tuple`: A record whose name attribute has the supplied name exists. 
             `None`: No such record exists.
         """
-        sql = "SELECT {name},{pid},{tarfile},{gcp_tarfile},{rundir_path} FROM {table} WHERE {name}='{input_name}';".format(
+        sql = "SELECT {name},{pid},{tarfile},{gcp_tarfile},{rundir_path},{tar_members},{tar_offset},{upload_session},{upload_offset},{crc32c},{md5},{queued_at},{rundir_size},{ready_at},{queue_wait_sec},{stage},{exit_code} FROM {table} WHERE {name}='{input_name}';".format(
             name=self.TASKS_NAME, 
             pid=self.TASKS_PID,
             tarfile=self.TASKS_TARFILE, 
             gcp_tarfile=self.TASKS_GCP_TARFILE, 
             rundir_path=self.TASKS_RUNDIR_PATH,
+            tar_members=self.TASKS_TAR_MEMBERS,
+            tar_offset=self.TASKS_TAR_OFFSET,
+            upload_session=self.TASKS_UPLOAD_SESSION,
+            upload_offset=self.TASKS_UPLOAD_OFFSET,
+            crc32c=self.TASKS_CRC32C,
+            md5=self.TASKS_MD5,
+            queued_at=self.TASKS_QUEUED_AT,
+            rundir_size=self.TASKS_RUNDIR_SIZE,
+            ready_at=self.TASKS_READY_AT,
+            queue_wait_sec=self.TASKS_QUEUE_WAIT_SEC,
+            stage=self.TASKS_STAGE,
+            exit_code=self.TASKS_EXIT_CODE,
             table=self.TASKS_TABLE_NAME,
             input_name=name)
 
@@ -213,9 +413,35 @@ class Db:
             self.TASKS_PID: res[1],
             self.TASKS_TARFILE: res[2],
             self.TASKS_GCP_TARFILE: res[3],
-            self.TASKS_RUNDIR_PATH: res[4]
+            self.TASKS_RUNDIR_PATH: res[4],
+            self.TASKS_TAR_MEMBERS: res[5],
+            self.TASKS_TAR_OFFSET: res[6],
+            self.TASKS_UPLOAD_SESSION: res[7],
+            self.TASKS_UPLOAD_OFFSET: res[8],
+            self.TASKS_CRC32C: res[9],
+            self.TASKS_MD5: res[10],
+            self.TASKS_QUEUED_AT: res[11],
+            self.TASKS_RUNDIR_SIZE: res[12],
+            self.TASKS_READY_AT: res[13],
+            self.TASKS_QUEUE_WAIT_SEC: res[14],
+            self.TASKS_STAGE: res[15],
+            self.TASKS_EXIT_CODE: res[16]
         }
 
+    def get_queued_runs(self):
+        """
+        Returns:
+            `list` of the names of the runs that are queued for a workflow stage, in the order that
+            they were queued. See `sruns_monitor.scheduling.order_runs` for the order in which
+            they are admitted.
+        """
+        sql = "SELECT {name} FROM {table} WHERE {queued_at} > 0 ORDER BY {queued_at};".format(
+            name=self.TASKS_NAME,
+            queued_at=self.TASKS_QUEUED_AT,
+            table=self.TASKS_TABLE_NAME)
+        self.log(msg=sql, verbose=True)
+        return [i[0] for i in self.conn.execute(sql).fetchall()]
+
     def delete_run(self, name):
         sql = "DELETE FROM {table} WHERE {name}='{input_name}';".format(
             table=self.TASKS_TABLE_NAME,
@@ -223,10 +449,168 @@ class Db:
             input_name=name)
         self.log(msg=sql, verbose=True)
 
+        shards_sql = "DELETE FROM {table} WHERE {run_name}='{input_name}';".format(
+            table=self.SHARDS_TABLE_NAME,
+            run_name=self.SHARDS_RUN_NAME,
+            input_name=name)
+        self.log(msg=shards_sql, verbose=True)
+
+        with self.DB_LOCK:
+            with self.conn as conn:
+                conn.execute(sql)
+                conn.execute(shards_sql)
+
+    def insert_shard(self, run_name, shard, tarfile="", gcp_tarfile="", members=""):
+        """
+        Creates a new shard record in the shards table, or replaces the existing one.
+
+        Args:
+            run_name: `str`. The name of the sequencing run that the shard belongs to.
+            shard: `str`. The name of the shard.
+            tarfile: `str`. The name of the shard's tarfile. Doesn't make sense to set until the
+                shard has been tarred.
+            gcp_tarfile: `str`. Blob name for the shard's tarfile that is in GCP storage.
+            members: `str`. For a shard that is archived incrementally, a JSON list of the paths
+                in the shard.
+
+        Returns: None
+        """
+        sql = """
+              INSERT OR REPLACE INTO {table}({run_name_attr},{shard_attr},{tarfile_attr},{gcp_tarfile_attr},{members_attr})
+              VALUES('{run_name}','{shard}','{tarfile}','{gcp_tarfile}','{members}');
+              """.format(
+                  table=self.SHARDS_TABLE_NAME,
+                  run_name_attr=self.SHARDS_RUN_NAME,
+                  shard_attr=self.SHARDS_NAME,
+                  tarfile_attr=self.SHARDS_TARFILE,
+                  gcp_tarfile_attr=self.SHARDS_GCP_TARFILE,
+                  members_attr=self.SHARDS_MEMBERS,
+                  run_name=run_name,
+                  shard=shard,
+                  tarfile=tarfile,
+                  gcp_tarfile=gcp_tarfile,
+                  members=members)
+        self.log(msg=sql, verbose=True)
         with self.DB_LOCK:
             with self.conn as conn:
                 conn.execute(sql)
 
+    def update_shard(self, run_name, shard, payload):
+        update_str = ""
+        for attr in payload:
+            val = payload[attr]
+            update_str += "{key}='{val}',".format(key=attr, val=val)
+        update_str = update_str.rstrip(",")
+        sql = "UPDATE {table} SET {updates} WHERE {run_name_attr}='{run_name}' AND {shard_attr}='{shard}';".format(
+            table=self.SHARDS_TABLE_NAME,
+            updates=update_str,
+            run_name_attr=self.SHARDS_RUN_NAME,
+            run_name=run_name,
+            shard_attr=self.SHARDS_NAME,
+            shard=shard)
+        self.log(msg=sql, verbose=True)
+        with self.DB_LOCK:
+            with self.conn as conn:
+                conn.execute(sql)
+
+    def delete_shard(self, run_name, shard):
+        sql = "DELETE FROM {table} WHERE {run_name_attr}='{run_name}' AND {shard_attr}='{shard}';".format(
+            table=self.SHARDS_TABLE_NAME,
+            run_name_attr=self.SHARDS_RUN_NAME,
+            run_name=run_name,
+            shard_attr=self.SHARDS_NAME,
+            shard=shard)
+        self.log(msg=sql, verbose=True)
+        with self.DB_LOCK:
+            with self.conn as conn:
+                conn.execute(sql)
+
+    def get_shards(self, run_name):
+        """
+        Returns:
+            `list` of `dict`s, one per shard record of the given sequencing run, ordered by shard
+            name. Empty if the run wasn't tarred in sharded mode.
+        """
+        sql = "SELECT {run_name},{shard},{tarfile},{gcp_tarfile},{members},{crc32c},{md5} FROM {table} WHERE {run_name}='{input_name}' ORDER BY {shard};".format(
+            run_name=self.SHARDS_RUN_NAME,
+            shard=self.SHARDS_NAME,
+            tarfile=self.SHARDS_TARFILE,
+            gcp_tarfile=self.SHARDS_GCP_TARFILE,
+            members=self.SHARDS_MEMBERS,
+            crc32c=self.SHARDS_CRC32C,
+            md5=self.SHARDS_MD5,
+            table=self.SHARDS_TABLE_NAME,
+            input_name=run_name)
+        self.log(msg=sql, verbose=True)
+        shards = []
+        for res in self.conn.execute(sql).fetchall():
+            shards.append({
+                self.SHARDS_RUN_NAME: res[0],
+                self.SHARDS_NAME: res[1],
+                self.SHARDS_TARFILE: res[2],
+                self.SHARDS_GCP_TARFILE: res[3],
+                self.SHARDS_MEMBERS: res[4],
+                self.SHARDS_CRC32C: res[5],
+                self.SHARDS_MD5: res[6]
+            })
+        return shards
+
+    def get_scan_cache(self, watchdir):
+        """
+        Returns:
+            `dict` that maps the path of each run directory in the given watch directory that has a
+            scan cache record to the record, as a `dict`.
+        """
+        sql = "SELECT {path},{watchdir},{inode},{mtime_ns},{ready},{checked_at},{in_progress} FROM {table} WHERE {watchdir}=?;".format(
+            path=self.SCAN_CACHE_PATH,
+            watchdir=self.SCAN_CACHE_WATCHDIR,
+            inode=self.SCAN_CACHE_INODE,
+            mtime_ns=self.SCAN_CACHE_MTIME_NS,
+            ready=self.SCAN_CACHE_READY,
+            checked_at=self.SCAN_CACHE_CHECKED_AT,
+            in_progress=self.SCAN_CACHE_IN_PROGRESS,
+            table=self.SCAN_CACHE_TABLE_NAME)
+        cache = {}
+        for res in self.conn.execute(sql, (watchdir,)).fetchall():
+            cache[res[0]] = {
+                self.SCAN_CACHE_PATH: res[0],
+                self.SCAN_CACHE_WATCHDIR: res[1],
+                self.SCAN_CACHE_INODE: res[2],
+                self.SCAN_CACHE_MTIME_NS: res[3],
+                self.SCAN_CACHE_READY: res[4],
+                self.SCAN_CACHE_CHECKED_AT: res[5],
+                self.SCAN_CACHE_IN_PROGRESS: res[6]
+            }
+        return cache
+
+    def update_scan_cache(self, records, deleted_paths=()):
+        """
+        Creates or replaces scan cache records, and deletes those of run directories that are gone,
+        in a single transaction. Values are bound as parameters rather than formatted into the SQL,
+        since a scan can change many records at once.
+
+        Args:
+            records: `list` of `dict`s with the SCAN_CACHE_* attributes of this class as keys.
+            deleted_paths: `list` of the paths of run directories whose records are to be deleted.
+        """
+        if not records and not deleted_paths:
+            return
+        columns = [self.SCAN_CACHE_PATH, self.SCAN_CACHE_WATCHDIR, self.SCAN_CACHE_INODE,
+                   self.SCAN_CACHE_MTIME_NS, self.SCAN_CACHE_READY, self.SCAN_CACHE_CHECKED_AT,
+                   self.SCAN_CACHE_IN_PROGRESS]
+        insert_sql = "INSERT OR REPLACE INTO {table}({columns}) VALUES({params});".format(
+            table=self.SCAN_CACHE_TABLE_NAME,
+            columns=",".join(columns),
+            params=",".join("?" * len(columns)))
+        delete_sql = "DELETE FROM {table} WHERE {path}=?;".format(
+            table=self.SCAN_CACHE_TABLE_NAME,
+            path=self.SCAN_CACHE_PATH)
+        self.log(msg="Updating {} and deleting {} scan cache records.".format(len(records), len(deleted_paths)), verbose=True)
+        with self.DB_LOCK:
+            with self.conn as conn:
+                conn.executemany(insert_sql, [[rec[i] for i in columns] for rec in records])
+                conn.executemany(delete_sql, [(i,) for i in deleted_paths])
+
     def get_tables(self):
         sql = "SELECT name FROM sqlite_master where type='table';"
         res = self.conn.execute(sql)
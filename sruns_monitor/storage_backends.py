@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+
+"""
+Storage backends that the monitor uploads tarred runs to. The upload path in `sruns_monitor.utils`
+and the helpers in `sruns_monitor.gcstorage_utils` only use the operations of the `StorageBackend`
+interface, so besides `GCSBackend`, which stores objects in a GCP Storage bucket, they also work
+with `LocalBackend`, which stores objects as files in a local directory. The latter makes it
+possible to run and benchmark the whole workflow offline.
+
+Functions that accept a bucket also accept a `google.cloud.storage.bucket.Bucket` instance, which
+is wrapped in a `GCSBackend` by `as_backend`.
+"""
+
+import base64
+import collections
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+
+import google_crc32c
+import requests
+
+from sruns_monitor import utils
+
+
+logger = logging.getLogger(__name__)
+
+#: Storage backend name for GCP Storage.
+BACKEND_GCS = "gcs"
+
+#: Storage backend name for a local directory.
+BACKEND_LOCAL = "local"
+
+#: The metadata of a stored object. `crc32c` and `md5_hash` are base64-encoded as in GCP Storage
+#: object metadata; `md5_hash` may be None, i.e. for a composite object in GCP Storage. `generation` identifies the version
+#: of the object.
+ObjectInfo = collections.namedtuple("ObjectInfo", ["size", "crc32c", "md5_hash", "generation"])
+
+
+class StorageBackend:
+    """
+    The operations that a storage backend provides. Objects are identified by name, i.e.
+    'basedir/run_name/run_name.tar'. All byte ranges are given as a start offset and an exclusive
+    end offset.
+    """
+
+    #: The name of the bucket, which prefixes object locations as in 'bucket_name/object_name'.
+    name = None
+
+    def stat(self, object_name):
+        """
+        Returns:
+            `ObjectInfo`, or None if the object doesn't exist.
+        """
+        raise NotImplementedError
+
+    def upload_from_file(self, object_name, fileobj, size):
+        """
+        Creates an object from the next `size` bytes read from `fileobj`.
+        """
+        raise NotImplementedError
+
+    def download_to_filename(self, object_name, filename):
+        """
+        Downloads a whole object to a local file.
+        """
+        raise NotImplementedError
+
+    def read_range(self, object_name, start=0, end=None, generation=None):
+        """
+        Reads the bytes of an object from `start` up to `end`, or to the end of the object if `end`
+        is None. If `generation` is given, that version of the object is read.
+
+        Returns:
+            `bytes`.
+        """
+        raise NotImplementedError
+
+    def open_writer(self, object_name, chunk_size):
+        """
+        Opens a writable file-like object that streams data into a new object, holding at most
+        about `chunk_size` bytes in memory. The object is only created once the writer is closed.
+        A writer that isn't to be closed must be aborted with `abort_writer`.
+        """
+        raise NotImplementedError
+
+    def abort_writer(self, writer):
+        """
+        Abandons a writer returned by `open_writer`, so that no object is created.
+        """
+        raise NotImplementedError
+
+    def compose(self, object_name, source_names):
+        """
+        Creates (or replaces) an object from the concatenation of existing objects, which may
+        include the object itself.
+        """
+        raise NotImplementedError
+
+    def delete(self, object_names):
+        """
+        Deletes objects, ignoring any that don't exist.
+        """
+        raise NotImplementedError
+
+    def create_resumable_upload(self, object_name, size):
+        """
+        Starts a resumable upload of an object of `size` bytes.
+
+        Returns:
+            `str`. The session, which can be persisted and passed to `query_resumable_upload` and
+            `upload_chunk` from another process.
+        """
+        raise NotImplementedError
+
+    def query_resumable_upload(self, session, size):
+        """
+        Returns:
+            `int`: The number of bytes committed in the resumable upload session.
+            `None`: The session no longer exists.
+        """
+        raise NotImplementedError
+
+    def upload_chunk(self, session, data, offset, size):
+        """
+        Sends the bytes of the upload from `offset` onwards in a resumable upload session. The
+        object is created once all `size` bytes are committed.
+
+        Returns:
+            `int`. The number of bytes committed, which may be fewer than were sent.
+        """
+        raise NotImplementedError
+
+
+class GCSBackend(StorageBackend):
+    """
+    Stores objects in a GCP Storage bucket.
+    """
+
+    def __init__(self, bucket):
+        """
+        Args:
+            bucket: `google.cloud.storage.bucket.Bucket` instance.
+        """
+        #: The `google.cloud.storage.bucket.Bucket` instance.
+        self.bucket = bucket
+        self.name = bucket.name
+
+    def stat(self, object_name):
+        blob = self.bucket.get_blob(object_name)
+        if blob is None:
+            return None
+        return ObjectInfo(size=blob.size, crc32c=blob.crc32c, md5_hash=blob.md5_hash, generation=blob.generation)
+
+    def upload_from_file(self, object_name, fileobj, size):
+        self.bucket.blob(object_name).upload_from_file(fileobj, size=size)
+
+    def download_to_filename(self, object_name, filename):
+        self.bucket.blob(object_name).download_to_filename(filename)
+
+    def read_range(self, object_name, start=0, end=None, generation=None):
+        blob = self.bucket.blob(object_name, generation=generation)
+        # The end of a ranged read is inclusive. Checksums can't be validated on part of an object.
+        return blob.download_as_bytes(start=start, end=end - 1 if end is not None else None, checksum=None)
+
+    def open_writer(self, object_name, chunk_size):
+        # ignore_flush is required since a flush on a resumable upload stream is not supported.
+        return self.bucket.blob(object_name).open("wb", chunk_size=chunk_size, ignore_flush=True)
+
+    def abort_writer(self, writer):
+        # Cancels the resumable upload session. Otherwise, the writer would be closed when it's
+        # garbage collected, which would create the object from the data written so far.
+        writer.terminate()
+
+    def compose(self, object_name, source_names):
+        self.bucket.blob(object_name).compose([self.bucket.blob(i) for i in source_names])
+
+    def delete(self, object_names):
+        self.bucket.delete_blobs([self.bucket.blob(i) for i in object_names], on_error=lambda blob: None)
+
+    def create_resumable_upload(self, object_name, size):
+        return self.bucket.blob(object_name).create_resumable_upload_session(size=size)
+
+    def query_resumable_upload(self, session, size):
+        return utils.query_resumable_upload(session_url=session, size=size)
+
+    def upload_chunk(self, session, data, offset, size):
+        end = offset + len(data) - 1
+        headers = {"Content-Range": "bytes {}-{}/{}".format(offset, end, size)}
+        response = requests.put(session, headers=headers, data=data, timeout=utils.UPLOAD_REQUEST_TIMEOUT)
+        if response.status_code in (200, 201):
+            return size
+        if response.status_code == 308:
+            return utils.get_committed_offset(response.headers.get("Range"))
+        response.raise_for_status()
+        raise utils.unexpected_status_error(response)
+
+
+class LocalBackend(StorageBackend):
+    """
+    Stores objects as files beneath a local directory, at their object name. Objects are always
+    created by renaming a complete temporary file into place, so that a partially written object is
+    never visible, as in GCP Storage. Resumable upload sessions are partial files in the '.uploads'
+    subdirectory. An object's checksums are computed once, as it's created, and kept in a JSON file
+    at its name in the '.checksums' subdirectory, which `stat` reads.
+    """
+
+    #: The name of the subdirectory that holds temporary files and partial uploads.
+    UPLOADS_DIR = ".uploads"
+
+    #: The name of the subdirectory that holds the `ObjectInfo` of each object.
+    CHECKSUMS_DIR = ".checksums"
+
+    def __init__(self, root, name=None):
+        """
+        Args:
+            root: `str`. The directory to store objects in. It's created if need be.
+            name: `str`. The name of the bucket, which prefixes object locations. Defaults to the
+                name of `root`.
+        """
+        #: The directory that objects are stored in.
+        self.root = root
+        self.name = name or os.path.basename(os.path.normpath(root))
+        os.makedirs(os.path.join(self.root, self.UPLOADS_DIR), exist_ok=True)
+
+    def get_path(self, object_name):
+        """
+        Returns:
+            `str`. The path of the file that holds the object.
+        """
+        return os.path.join(self.root, object_name.lstrip("/"))
+
+    def _get_temp_file(self):
+        fd, path = tempfile.mkstemp(dir=os.path.join(self.root, self.UPLOADS_DIR))
+        return os.fdopen(fd, "wb"), path
+
+    def _get_checksums_path(self, object_name):
+        return os.path.join(self.root, self.CHECKSUMS_DIR, object_name.lstrip("/") + ".json")
+
+    def _compute_info(self, path):
+        crc32c = google_crc32c.Checksum()
+        md5 = hashlib.md5()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(utils.STREAM_CHUNK_SIZE), b""):
+                crc32c.update(chunk)
+                md5.update(chunk)
+        st = os.stat(path)
+        return ObjectInfo(
+            size=st.st_size,
+            crc32c=base64.b64encode(crc32c.digest()).decode("ascii"),
+            md5_hash=base64.b64encode(md5.digest()).decode("ascii"),
+            generation=st.st_mtime_ns)
+
+    def _write_info(self, object_name, info):
+        path = self._get_checksums_path(object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fh, temp_path = self._get_temp_file()
+        with fh:
+            fh.write(json.dumps(info._asdict()).encode("utf-8"))
+        os.replace(temp_path, path)
+
+    def _commit(self, temp_path, object_name):
+        path = self.get_path(object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The rename keeps the modification time, which is the generation.
+        info = self._compute_info(temp_path)
+        os.replace(temp_path, path)
+        self._write_info(object_name, info)
+
+    def stat(self, object_name):
+        path = self.get_path(object_name)
+        if not os.path.isfile(path):
+            return None
+        st = os.stat(path)
+        try:
+            with open(self._get_checksums_path(object_name)) as fh:
+                info = ObjectInfo(**json.load(fh))
+            if info.size == st.st_size and info.generation == st.st_mtime_ns:
+                return info
+        except (OSError, ValueError, TypeError):
+            pass
+        # The object was stored before its checksums were kept, or was changed in place.
+        info = self._compute_info(path)
+        self._write_info(object_name, info)
+        return info
+
+    def upload_from_file(self, object_name, fileobj, size):
+        fh, temp_path = self._get_temp_file()
+        with fh:
+            remaining = size
+            while remaining:
+                chunk = fileobj.read(min(remaining, utils.STREAM_CHUNK_SIZE))
+                if not chunk:
+                    break
+                fh.write(chunk)
+                remaining -= len(chunk)
+        self._commit(temp_path, object_name)
+
+    def download_to_filename(self, object_name, filename):
+        shutil.copyfile(self.get_path(object_name), filename)
+
+    def read_range(self, object_name, start=0, end=None, generation=None):
+        # Objects are replaced rather than modified in place, so there is only ever one generation.
+        with open(self.get_path(object_name), "rb") as fh:
+            fh.seek(start)
+            if end is None:
+                return fh.read()
+            return fh.read(end - start)
+
+    def open_writer(self, object_name, chunk_size):
+        fh, temp_path = self._get_temp_file()
+        return _LocalWriter(fh, temp_path=temp_path, commit=lambda: self._commit(temp_path, object_name))
+
+    def abort_writer(self, writer):
+        writer.abort()
+
+    def compose(self, object_name, source_names):
+        fh, temp_path = self._get_temp_file()
+        with fh:
+            for source in source_names:
+                with open(self.get_path(source), "rb") as src:
+                    shutil.copyfileobj(src, fh)
+        self._commit(temp_path, object_name)
+
+    def delete(self, object_names):
+        for object_name in object_names:
+            for path in (self.get_path(object_name), self._get_checksums_path(object_name)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def create_resumable_upload(self, object_name, size):
+        session = "{}/{}".format(uuid.uuid4().hex, object_name.lstrip("/"))
+        open(self._get_session_path(session), "wb").close()
+        return session
+
+    def _get_session_path(self, session):
+        return os.path.join(self.root, self.UPLOADS_DIR, session.split("/", 1)[0])
+
+    def query_resumable_upload(self, session, size):
+        path = self._get_session_path(session)
+        if not os.path.exists(path):
+            return None
+        return os.path.getsize(path)
+
+    def upload_chunk(self, session, data, offset, size):
+        path = self._get_session_path(session)
+        with open(path, "r+b") as fh:
+            fh.truncate(offset)
+            fh.seek(offset)
+            fh.write(data)
+        committed = offset + len(data)
+        if committed == size:
+            self._commit(path, session.split("/", 1)[1])
+        return committed
+
+
+class _LocalWriter:
+    """
+    The writer returned by `LocalBackend.open_writer`. Closing it moves the file into place, and
+    aborting it removes the file.
+    """
+
+    def __init__(self, fh, temp_path, commit):
+        self.fh = fh
+        self.temp_path = temp_path
+        self.commit = commit
+
+    def write(self, data):
+        return self.fh.write(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.fh.closed:
+            return
+        self.fh.close()
+        self.commit()
+
+    def abort(self):
+        if self.fh.closed:
+            return
+        self.fh.close()
+        os.remove(self.temp_path)
+
+
+def as_backend(bucket):
+    """
+    Args:
+        bucket: A `StorageBackend`, or a `google.cloud.storage.bucket.Bucket` instance.
+
+    Returns:
+        `StorageBackend`. `bucket` itself, or a `GCSBackend` that wraps it.
+    """
+    if isinstance(bucket, StorageBackend):
+        return bucket
+    return GCSBackend(bucket)
+
+
+def get_backend(backend, bucket_name, local_dir=None):
+    """
+    Creates a storage backend by name.
+
+    Args:
+        backend: `str`. One of `BACKEND_GCS` or `BACKEND_LOCAL`.
+        bucket_name: `str`. The name of the bucket.
+        local_dir: `str`. For `BACKEND_LOCAL`, the directory in which the bucket is a subdirectory.
+
+    Returns:
+        `StorageBackend`.
+
+    Raises:
+        `ValueError`: `backend` isn't a known backend name, or `local_dir` is missing for
+            `BACKEND_LOCAL`.
+    """
+    if backend == BACKEND_LOCAL:
+        if not local_dir:
+            raise ValueError("The local storage backend requires a local directory.")
+        return LocalBackend(root=os.path.join(local_dir, bucket_name), name=bucket_name)
+    if backend == BACKEND_GCS:
+        # Imported here so that the local backend works without GCP credentials or libraries.
+        from google.cloud import storage
+        return GCSBackend(storage.Client().get_bucket(bucket_name))
+    raise ValueError("Unknown storage backend '{}'.".format(backend))
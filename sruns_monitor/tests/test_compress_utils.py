@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###
+# Nathaniel Watson
+# nathanielwatson@stanfordhealthcare.org
+###
+
+"""
+Tests functions in the ``sruns_monitor.compress_utils`` module.
+"""
+
+import gzip
+import io
+import json
+import os
+import tarfile
+import threading
+import unittest
+
+from sruns_monitor.tests import WATCH_DIRS, TMP_DIR
+from sruns_monitor import compress_utils
+from sruns_monitor import utils
+
+
+class TestParallelCompressor(unittest.TestCase):
+    """
+    Tests the ``sruns_monitor.compress_utils.ParallelCompressor`` class.
+    """
+
+    def test_gzip_roundtrip(self):
+        """
+        Tests that data written across several blocks decompresses, as a multi-member gzip stream,
+        to the original data in the original order.
+        """
+        data = os.urandom(1000) * 50
+        fileobj = io.BytesIO()
+        compressor = compress_utils.ParallelCompressor(fileobj=fileobj, workers=3, block_size=4096)
+        for i in range(0, len(data), 3000):
+            compressor.write(data[i:i + 3000])
+        compressor.close()
+        self.assertEqual(gzip.decompress(fileobj.getvalue()), data)
+
+    def test_byte_counts(self):
+        """
+        Tests that the compressor keeps count of the bytes in and the bytes out.
+        """
+        fileobj = io.BytesIO()
+        compressor = compress_utils.ParallelCompressor(fileobj=fileobj, workers=2, block_size=100)
+        compressor.write(b"a" * 1000)
+        compressor.close()
+        self.assertEqual((compressor.bytes_in, compressor.bytes_out), (1000, len(fileobj.getvalue())))
+
+    def test_unsupported_format(self):
+        """
+        Tests that an unknown compression format raises a `ValueError`.
+        """
+        with self.assertRaises(ValueError):
+            compress_utils.ParallelCompressor(fileobj=io.BytesIO(), fmt="bzip2")
+
+    def test_tar_compressed(self):
+        """
+        Tests that `utils.tar()` with compression enabled creates a tarball that `tarfile` can read
+        as a regular .tar.gz file.
+        """
+        test_rundir = os.path.join(WATCH_DIRS[0], "CompletedRun1")
+        output_file = os.path.join(TMP_DIR, "CompletedRun1.tar.gz")
+        utils.tar(input_dir=test_rundir, tarball_name=output_file, compress=True, compress_workers=2)
+        with tarfile.open(output_file, "r:gz") as t:
+            file_list = t.getnames()
+        os.remove(output_file)
+        self.assertEqual(file_list, ["CompletedRun1", "CompletedRun1/CopyComplete.txt"])
+
+    def test_tar_error(self):
+        """
+        Tests that when adding a member fails part way through `utils.tar()`, the error is raised
+        and the compressor's workers are shut down.
+        """
+        input_dir = os.path.join(TMP_DIR, "FailingRun")
+        os.makedirs(input_dir)
+        with open(os.path.join(input_dir, "big"), "wb") as fh:
+            fh.write(os.urandom(compress_utils.BLOCK_SIZE + 1000))
+        output_file = os.path.join(TMP_DIR, "FailingRun.tar.gz")
+        threads = set(threading.enumerate())
+        try:
+            with self.assertRaises(FileNotFoundError):
+                utils.tar(input_dir=input_dir, tarball_name=output_file, compress=True, compress_workers=2,
+                          include=["big", "missing"], prefetch=0)
+            self.assertEqual(set(threading.enumerate()) - threads, set())
+        finally:
+            os.remove(output_file)
+            os.remove(os.path.join(input_dir, "big"))
+            os.rmdir(input_dir)
+
+    def test_abort(self):
+        """
+        Tests that aborting a compressor doesn't write out the blocks that are pending, and that
+        closing it afterwards does nothing.
+        """
+        fileobj = io.BytesIO()
+        compressor = compress_utils.ParallelCompressor(fileobj=fileobj, workers=4, block_size=100)
+        compressor.write(b"a" * 500)
+        compressor.abort()
+        compressor.close()
+        self.assertTrue(compressor.closed)
+        self.assertEqual(fileobj.getvalue(), b"")
+
+    def test_block_offsets(self):
+        """
+        Tests that decompressing the blocks from one of the compressor's block offsets onwards gives
+        the uncompressed data from the start of that block onwards.
+        """
+        data = os.urandom(1000) * 10
+        fileobj = io.BytesIO()
+        compressor = compress_utils.ParallelCompressor(fileobj=fileobj, workers=2, block_size=1024)
+        compressor.write(data)
+        compressor.close()
+        compressed = fileobj.getvalue()[compressor.block_offsets[3]:]
+        self.assertEqual(compress_utils.decompress_blocks(compress_utils.FORMAT_GZIP, compressed), data[3 * 1024:])
+
+    def test_tar_index_compressed(self):
+        """
+        Tests that each member of a tarball that was compressed in several blocks can be read from
+        the byte range given by its tar member index.
+        """
+        fileobj = io.BytesIO()
+        compressor = compress_utils.ParallelCompressor(fileobj=fileobj, workers=2, block_size=1024)
+        files = {"a": os.urandom(3000), "b": os.urandom(10), "c": os.urandom(5000)}
+        with utils.IndexingTarFile.open(fileobj=compressor, mode="w|") as tb:
+            for name, content in files.items():
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.size = len(content)
+                tb.addfile(tarinfo, io.BytesIO(content))
+        compressor.close()
+        index_file = os.path.join(TMP_DIR, "compressed.tar.gz.index.json")
+        utils.write_tar_index(index_file=index_file, members=tb.index, compressor=compressor)
+        with open(index_file) as fh:
+            index = json.load(fh)
+        os.remove(index_file)
+        tarball = fileobj.getvalue()
+        for name in files:
+            start, end = utils.get_tar_span(index, [name])
+            self.assertEqual(utils.read_tar_members(index, tarball[start:end], [name]), {name: files[name]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###
+# Nathaniel Watson
+# nathanielwatson@stanfordhealthcare.org
+###
+
+"""
+Tests the ``sruns_monitor.lease_utils.SQLiteLeaseStore`` class.
+"""
+
+import os
+import time
+import unittest
+
+from sruns_monitor.tests import TMP_DIR
+from sruns_monitor import lease_utils
+
+
+DBNAME = os.path.join(TMP_DIR, "leases.db")
+
+
+class TestSQLiteLeaseStore(unittest.TestCase):
+    """
+    Tests the ``sruns_monitor.lease_utils.SQLiteLeaseStore`` class, with a store for each of two
+    nodes that share the same database.
+    """
+
+    def setUp(self):
+        self.node1 = lease_utils.SQLiteLeaseStore(DBNAME)
+        self.node2 = lease_utils.SQLiteLeaseStore(DBNAME)
+
+    def tearDown(self):
+        self.node1.conn.close()
+        self.node2.conn.close()
+        os.remove(DBNAME)
+
+    def test_acquire(self):
+        """
+        Tests that a node takes the lease of a new run, and that another node then can't.
+        """
+        lease, previous = self.node1.acquire("Run1", owner="node1", ttl_sec=60)
+        self.assertEqual(lease.owner, "node1")
+        self.assertIsNone(previous)
+        lease, previous = self.node2.acquire("Run1", owner="node2", ttl_sec=60)
+        self.assertEqual(lease.owner, "node1")
+        self.assertEqual(previous.owner, "node1")
+        self.assertEqual(self.node2.get("Run1"), self.node1.get("Run1"))
+
+    def test_takeover(self):
+        """
+        Tests that another node takes over a lease that expired, and that the node that held it
+        finds out when it tries to renew it.
+        """
+        self.node1.acquire("Run1", owner="node1", ttl_sec=0.1)
+        self.node1.acquire("Run2", owner="node1", ttl_sec=60)
+        time.sleep(0.2)
+        lease, previous = self.node2.acquire("Run1", owner="node2", ttl_sec=60)
+        self.assertEqual(lease.owner, "node2")
+        self.assertEqual(previous.owner, "node1")
+        self.assertEqual(self.node1.renew(["Run1", "Run2"], owner="node1", ttl_sec=60), set(["Run2"]))
+
+    def test_renew(self):
+        """
+        Tests that a renewed lease doesn't expire.
+        """
+        self.node1.acquire("Run1", owner="node1", ttl_sec=0.2)
+        time.sleep(0.1)
+        self.node1.renew(["Run1"], owner="node1", ttl_sec=60)
+        time.sleep(0.2)
+        lease, previous = self.node2.acquire("Run1", owner="node2", ttl_sec=60)
+        self.assertEqual(lease.owner, "node1")
+
+    def test_complete(self):
+        """
+        Tests that a lease that's done stays with its owner after it expired, and isn't released.
+        """
+        self.node1.acquire("Run1", owner="node1", ttl_sec=0.1)
+        self.node1.complete("Run1", owner="node1")
+        time.sleep(0.2)
+        self.node1.release(["Run1"], owner="node1")
+        lease, previous = self.node2.acquire("Run1", owner="node2", ttl_sec=60)
+        self.assertEqual(lease.owner, "node1")
+        self.assertTrue(lease.done)
+        self.assertEqual(self.node1.renew(["Run1"], owner="node1", ttl_sec=60), set(["Run1"]))
+
+    def test_release(self):
+        """
+        Tests that another node can take a lease right after it's released.
+        """
+        self.node1.acquire("Run1", owner="node1", ttl_sec=60)
+        self.node2.release(["Run1"], owner="node2")
+        self.assertEqual(self.node2.acquire("Run1", owner="node2", ttl_sec=60)[0].owner, "node1")
+        self.node1.release(["Run1"], owner="node1")
+        self.assertIsNone(self.node1.get("Run1"))
+        self.assertEqual(self.node2.acquire("Run1", owner="node2", ttl_sec=60)[0].owner, "node2")
+
+
+if __name__ == "__main__":
+    unittest.main()
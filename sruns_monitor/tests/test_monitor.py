@@ -0,0 +1,641 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###
+# Nathaniel Watson
+# nathanielwatson@stanfordhealthcare.org
+###
+
+"""
+Tests the ``sruns_monitor.monitor.Monitor`` class on the local storage backend, without Firestore.
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import threading
+import time
+import unittest
+
+from sruns_monitor.tests import TMP_DIR
+from sruns_monitor.monitor import Monitor
+from sruns_monitor.sqlite_utils import Db
+
+
+MONITOR_DIR = os.path.join(TMP_DIR, "Monitor")
+
+
+class MonitorTestCase(unittest.TestCase):
+    """
+    Creates a ``sruns_monitor.monitor.Monitor`` with a watch directory, a completed runs directory,
+    a SQLite database and a local storage directory in ``MONITOR_DIR``. Subclasses can add
+    configuration parameters in ``CONF``, and more monitors with ``make_monitor``.
+    """
+
+    CONF = {}
+
+    def setUp(self):
+        self.watchdir = os.path.join(MONITOR_DIR, "watch")
+        os.makedirs(self.watchdir)
+        # The tar stage writes the tarfile in the current directory.
+        self.cwd = os.getcwd()
+        os.chdir(MONITOR_DIR)
+        self.sleepers = []
+        # The monitor installs its own signal handlers, which are restored in tearDown.
+        self.handlers = {i: signal.getsignal(i) for i in (signal.SIGINT, signal.SIGTERM, signal.SIGCHLD)}
+        self.monitors = []
+        self.monitor = self.make_monitor("test", self.CONF)
+
+    def tearDown(self):
+        for monitor in self.monitors:
+            for child in list(monitor.process_table.children.values()):
+                child.process.kill()
+                child.process.join()
+            monitor.sqlite_conn.conn.close()
+        for process in self.sleepers:
+            if process.is_alive():
+                process.kill()
+                process.join()
+        for signum, handler in self.handlers.items():
+            signal.signal(signum, handler)
+        os.chdir(self.cwd)
+        shutil.rmtree(MONITOR_DIR)
+
+    def make_monitor(self, name, conf):
+        """
+        Creates a monitor that has its own SQLite database but shares the watch directory, the
+        completed runs directory and the local storage directory with the others.
+        """
+        monitor_conf = {
+            "name": name,
+            "watchdirs": [self.watchdir],
+            "completed_runs_dir": os.path.join(MONITOR_DIR, "completed"),
+            "sqlite_db": os.path.join(MONITOR_DIR, name + ".db"),
+            "gcp_bucket_name": "bucket",
+            "storage_backend": "local",
+            "local_storage_dir": os.path.join(MONITOR_DIR, "storage")
+        }
+        monitor_conf.update(conf)
+        conf_file = os.path.join(MONITOR_DIR, name + ".json")
+        with open(conf_file, "w") as fh:
+            json.dump(monitor_conf, fh)
+        monitor = Monitor(conf_file=conf_file)
+        monitor.send_mail = lambda subject, body: None
+        self.monitors.append(monitor)
+        return monitor
+
+    def make_rundir(self, name):
+        path = os.path.join(self.watchdir, name)
+        os.makedirs(os.path.join(path, "Data"))
+        with open(os.path.join(path, "Data", "reads.txt"), "w") as fh:
+            fh.write(name * 1000)
+        open(os.path.join(path, "CopyComplete.txt"), "w").close()
+        return path
+
+    def start_sleeper(self):
+        """
+        Starts a process that stands in for a workflow stage or a worker process, and that's killed
+        in tearDown.
+        """
+        process = multiprocessing.Process(target=time.sleep, args=(60,))
+        process.start()
+        self.sleepers.append(process)
+        return process
+
+    def start_stage(self, run_name, stage):
+        """
+        Adds a stage, or an increment, that's running for a run that has no record.
+        """
+        process = self.start_sleeper()
+        self.monitor.process_table.add(run_name=run_name, kind=stage, process=process)
+        return process
+
+    def add_fake_workers(self, monitor, count):
+        """
+        Adds processes to the worker pool of a monitor that stand in for worker processes and never
+        run their jobs, so that a test sees which stages are started without running them.
+
+        Returns:
+            `multiprocessing.connection.Connection`. The receiving end of the job pipe that the fake
+            workers share, on which the jobs arrive as (run name, stage) tuples.
+        """
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        for i in range(count):
+            worker = self.start_sleeper()
+            monitor.worker_pool.workers[worker.pid] = worker
+            monitor.worker_pool.job_pipes[worker.pid] = sender
+            monitor.worker_pool.idle.add(worker.pid)
+        return receiver
+
+
+class TestWorkerJobs(MonitorTestCase):
+    """
+    Tests that a worker process of ``sruns_monitor.monitor.Monitor.worker_pool`` that finished the
+    stage of one run isn't mistaken for that run's workflow once it runs another run's stage.
+    """
+
+    CONF = {"worker_processes": 1}
+
+    def setUp(self):
+        super().setUp()
+        # Stands in for the worker, so that the test controls its jobs. The pool doesn't start any.
+        self.monitor.worker_pool.size = 0
+        self.worker = multiprocessing.Process(target=time.sleep, args=(60,))
+        self.worker.start()
+        for name in ("Run1", "Run2"):
+            self.monitor.sqlite_conn.insert_run(rundir_path=self.make_rundir(name))
+
+    def start_job(self, run_name):
+        self.monitor.process_table.add(run_name=run_name, kind=Db.STAGE_TAR, process=self.worker)
+        self.monitor.sqlite_conn.update_run(name=run_name, payload={Db.TASKS_PID: self.worker.pid})
+
+    def get_status(self, run_name):
+        return self.monitor.sqlite_conn.get_run_status(run_name,
+                                                       running_pids=self.monitor.process_table)
+
+    def test_failed_job_not_running(self):
+        """
+        Tests that a run whose stage failed in a worker isn't running, and records the exit code,
+        while the same worker runs the stage of another run.
+        """
+        self.start_job("Run1")
+        self.assertEqual(self.get_status("Run1"), Db.RUN_STATUS_RUNNING)
+        self.monitor.finish_worker_job(self.worker.pid, 1)
+        self.start_job("Run2")
+        self.assertEqual(self.monitor.reap_children(), 1)
+        self.assertEqual(self.monitor.sqlite_conn.get_run("Run1")[Db.TASKS_PID], 0)
+        self.assertEqual(self.monitor.sqlite_conn.get_run("Run1")[Db.TASKS_EXIT_CODE], 1)
+        self.assertEqual(self.get_status("Run1"), Db.RUN_STATUS_NOT_RUNNING)
+        self.assertEqual(self.get_status("Run2"), Db.RUN_STATUS_RUNNING)
+
+    def test_kill_by_run(self):
+        """
+        Tests that a run that ran too long in a worker doesn't get the worker killed once the worker
+        runs another run's stage.
+        """
+        self.monitor.process_runtime_limit_sec = 1
+        self.start_job("Run1")
+        self.monitor.finish_worker_job(self.worker.pid, 0)
+        self.monitor.reap_children()
+        self.start_job("Run2")
+        time.sleep(1.1)
+        self.monitor.process_rundirs([os.path.join(self.watchdir, "Run1")])
+        self.assertTrue(self.worker.is_alive())
+
+
+class TestStagePipeline(MonitorTestCase):
+    """
+    Tests that the workflow of a run goes through its stages one after another, that each stage
+    starts only within the limits on concurrent stages, and that a run picks up at the stage that
+    it's at after a restart.
+    """
+
+    CONF = {"worker_processes": 2, "max_concurrent_tars": 1, "max_concurrent_uploads": 1}
+
+    def setUp(self):
+        super().setUp()
+        self.monitor.worker_pool.size = 0
+        self.jobs = self.add_fake_workers(self.monitor, 2)
+
+    def get_jobs(self):
+        jobs = set()
+        while self.jobs.poll(1):
+            jobs.add(self.jobs.recv())
+        return jobs
+
+    def queue(self, run_name, stage):
+        self.monitor.sqlite_conn.insert_run(rundir_path=self.make_rundir(run_name))
+        payload = {Db.TASKS_STAGE: stage, Db.TASKS_QUEUED_AT: time.time()}
+        if stage == Db.STAGE_UPLOAD:
+            payload[Db.TASKS_TARFILE] = run_name + ".tar"
+        self.monitor.sqlite_conn.update_run(name=run_name, payload=payload)
+
+    def run_stage(self, monitor, run_name, stage):
+        """
+        Runs a stage the way that the worker that it was submitted to would, and then reports it
+        finished.
+        """
+        worker_pid = monitor.process_table.get(run_name).process.pid
+        monitor.run_stage(state=monitor.state, run_name=run_name, stage=stage, sqlite_conn=monitor.sqlite_conn)
+        monitor.finish_worker_job(worker_pid, 0)
+        monitor.reap_children()
+
+    def test_tar_queues_upload(self):
+        """
+        Tests that the tar stage queues the run for the upload stage once it's done, and that the run
+        is complete once that's done too.
+        """
+        self.monitor.sqlite_conn.insert_run(rundir_path=self.make_rundir("Run1"))
+        self.monitor.run_workflow("Run1")
+        self.monitor.admit_queued_runs()
+        self.assertEqual(self.get_jobs(), set([("Run1", Db.STAGE_TAR)]))
+        self.run_stage(self.monitor, "Run1", Db.STAGE_TAR)
+        rec = self.monitor.sqlite_conn.get_run("Run1")
+        self.assertEqual(rec[Db.TASKS_STAGE], Db.STAGE_UPLOAD)
+        self.assertTrue(os.path.exists(rec[Db.TASKS_TARFILE]))
+        self.assertEqual(self.monitor.sqlite_conn.get_run_status("Run1", running_pids=self.monitor.process_table),
+                         Db.RUN_STATUS_QUEUED)
+        self.monitor.admit_queued_runs()
+        self.assertEqual(self.get_jobs(), set([("Run1", Db.STAGE_UPLOAD)]))
+        self.run_stage(self.monitor, "Run1", Db.STAGE_UPLOAD)
+        self.assertEqual(self.monitor.sqlite_conn.get_run_status("Run1", running_pids=self.monitor.process_table),
+                         Db.RUN_STATUS_COMPLETE)
+        gcp_tarfile = self.monitor.sqlite_conn.get_run("Run1")[Db.TASKS_GCP_TARFILE]
+        self.assertEqual(self.monitor.get_storage_backend().stat(gcp_tarfile.split("/", 1)[1]).crc32c,
+                         rec[Db.TASKS_CRC32C])
+
+    def test_stream_counts_as_both(self):
+        """
+        Tests that a running streaming stage takes both the only tar slot and the only upload slot.
+        """
+        stream = self.start_stage("Run0", Db.STAGE_STREAM)
+        self.queue("Run1", Db.STAGE_TAR)
+        self.queue("Run2", Db.STAGE_UPLOAD)
+        self.monitor.admit_queued_runs()
+        self.assertEqual(self.get_jobs(), set())
+        stream.kill()
+        stream.join()
+        self.monitor.reap_children()
+        self.monitor.admit_queued_runs()
+        self.assertEqual(self.get_jobs(), set([("Run1", Db.STAGE_TAR), ("Run2", Db.STAGE_UPLOAD)]))
+
+    def test_blocked_stage(self):
+        """
+        Tests that a run whose stage has no free slot doesn't hold up a run queued behind it for
+        another stage.
+        """
+        self.start_stage("Run0", Db.STAGE_TAR)
+        self.queue("Run1", Db.STAGE_TAR)
+        self.queue("Run2", Db.STAGE_UPLOAD)
+        self.monitor.admit_queued_runs()
+        self.assertEqual(self.get_jobs(), set([("Run2", Db.STAGE_UPLOAD)]))
+        self.assertEqual(self.monitor.sqlite_conn.get_run_status("Run1", running_pids=self.monitor.process_table),
+                         Db.RUN_STATUS_QUEUED)
+
+    def test_resume_after_restart(self):
+        """
+        Tests that a run whose upload stage was running when the monitor stopped is queued for the
+        upload stage again once the monitor restarts, rather than being tarred again.
+        """
+        run_path = self.make_rundir("Run1")
+        self.monitor.sqlite_conn.insert_run(rundir_path=run_path)
+        self.monitor.run_workflow("Run1")
+        self.monitor.admit_queued_runs()
+        self.run_stage(self.monitor, "Run1", Db.STAGE_TAR)
+        self.monitor.admit_queued_runs()
+        self.assertEqual(self.get_jobs(), set([("Run1", Db.STAGE_TAR), ("Run1", Db.STAGE_UPLOAD)]))
+        tarfile = self.monitor.sqlite_conn.get_run("Run1")[Db.TASKS_TARFILE]
+        self.monitor.sqlite_conn.conn.close()
+        restarted = self.make_monitor("test", self.CONF)
+        restarted.worker_pool.size = 0
+        self.jobs = self.add_fake_workers(restarted, 1)
+        self.assertEqual(restarted.sqlite_conn.get_run_status("Run1", running_pids=restarted.process_table),
+                         Db.RUN_STATUS_NOT_RUNNING)
+        restarted.process_rundirs([run_path])
+        self.assertEqual(self.get_jobs(), set([("Run1", Db.STAGE_UPLOAD)]))
+        self.assertEqual(restarted.sqlite_conn.get_run("Run1")[Db.TASKS_TARFILE], tarfile)
+
+
+class TestIncrements(MonitorTestCase):
+    """
+    Tests that runs in progress are found by the same scan as finished runs, without listing their
+    run directories, and that their increments are started within the limits on concurrent stages.
+    """
+
+    CONF = {"incremental_archiving": True, "max_concurrent_tars": 1}
+
+    def setUp(self):
+        super().setUp()
+        self.complete_path = self.make_rundir("Run0")
+        self.run_paths = [self.make_in_progress_rundir(i) for i in ("Run1", "Run2")]
+
+    def make_in_progress_rundir(self, name):
+        path = self.make_rundir(name)
+        os.remove(os.path.join(path, "CopyComplete.txt"))
+        open(os.path.join(path, "RunInfo.xml"), "w").close()
+        return path
+
+    def test_scan_in_progress(self):
+        """
+        Tests that only the run directories with a RunInfo.xml file and without a sentinal file are
+        in progress, also when they're found in the scan cache, and that no increment is started
+        for a run that has a record.
+        """
+        open(os.path.join(self.complete_path, "RunInfo.xml"), "w").close()
+        os.makedirs(os.path.join(self.watchdir, "Other"))
+        self.assertEqual(self.monitor.scan(), ([self.complete_path], self.run_paths))
+        found, in_progress, updated, deleted, latency = self.monitor.scan_watchdir(
+            self.watchdir, self.monitor.sqlite_conn.get_scan_cache(self.watchdir))
+        self.assertEqual((in_progress, updated), (self.run_paths, []))
+        self.monitor.sqlite_conn.insert_run(rundir_path=self.run_paths[0])
+        self.monitor.process_in_progress_rundirs(self.run_paths)
+        self.assertFalse(self.monitor.increment_running("Run1"))
+        self.assertTrue(self.monitor.increment_running("Run2"))
+
+    def test_hung_watchdir(self):
+        """
+        Tests that a watch directory whose scan hangs doesn't hold up the cycle, and that the
+        increments of the runs in progress in the other watch directories are still started.
+        """
+        hung_watchdir = os.path.join(MONITOR_DIR, "hung")
+        os.makedirs(hung_watchdir)
+        self.monitor.watchdirs.append(hung_watchdir)
+        self.monitor.scan_timeout_sec = 1
+        hang = threading.Event()
+        scan_watchdir = self.monitor.scan_watchdir
+
+        def hanging_scan_watchdir(watchdir, cache):
+            if watchdir == hung_watchdir:
+                hang.wait()
+            return scan_watchdir(watchdir, cache)
+        self.monitor.scan_watchdir = hanging_scan_watchdir
+        try:
+            start = time.time()
+            self.monitor.process_cycle()
+            self.assertLess(time.time() - start, 5)
+        finally:
+            hang.set()
+        self.assertEqual(self.monitor.degraded_watchdirs, set([hung_watchdir]))
+        self.assertTrue(self.monitor.increment_running("Run1"))
+
+    def test_increment_slots(self):
+        """
+        Tests that an increment waits for a free tar slot, and that a tar stage waits for a running
+        increment.
+        """
+        tar = self.start_stage("Run0", Db.STAGE_TAR)
+        self.monitor.process_in_progress_rundirs(self.run_paths)
+        self.assertEqual(self.monitor.stages_running(), {Db.STAGE_TAR: 1})
+        tar.kill()
+        tar.join()
+        self.monitor.reap_children()
+        self.monitor.process_in_progress_rundirs(self.run_paths)
+        self.assertTrue(self.monitor.increment_running("Run1"))
+        self.assertFalse(self.monitor.increment_running("Run2"))
+        self.assertFalse(self.monitor.stage_has_slot(Db.STAGE_TAR, self.monitor.stages_running()))
+        self.assertTrue(self.monitor.stage_has_slot(Db.STAGE_UPLOAD, self.monitor.stages_running()))
+
+
+class TestLeases(MonitorTestCase):
+    """
+    Tests that two monitors that watch the same directory split the runs between them with leases,
+    and that one takes over the runs of the other once their leases expire.
+    """
+
+    CONF = {
+        "lease_store": "sqlite",
+        "lease_db": os.path.join(MONITOR_DIR, "leases.db"),
+        "node_name": "node1",
+        "sentinal_file_age_minutes": 0
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.other = self.make_monitor("other", dict(self.CONF, node_name="node2"))
+        self.run_path = self.make_rundir("Run1")
+
+    def test_other_node_skips(self):
+        """
+        Tests that a run whose lease another node holds isn't processed.
+        """
+        self.assertTrue(self.monitor.hold_lease("Run1"))
+        self.other.process_rundirs([self.run_path])
+        self.assertFalse(self.other.sqlite_conn.get_run("Run1"))
+        self.assertEqual(self.other.leases, set())
+
+    def test_takeover(self):
+        """
+        Tests that another node takes over a run whose lease expired, and that the node that held it
+        stops the run's child process on its next heartbeat.
+        """
+        self.monitor.lease_ttl_sec = 0.1
+        self.assertTrue(self.monitor.hold_lease("Run1"))
+        child = multiprocessing.Process(target=time.sleep, args=(60,))
+        child.start()
+        self.monitor.process_table.add(run_name="Run1", kind=Db.STAGE_TAR, process=child)
+        time.sleep(0.2)
+        self.assertTrue(self.other.hold_lease("Run1"))
+        self.monitor.renew_leases()
+        child.join(timeout=10)
+        self.assertEqual(child.exitcode, -signal.SIGKILL)
+        self.assertEqual(self.monitor.leases, set())
+        self.assertFalse(self.monitor.hold_lease("Run1"))
+
+    def test_complete(self):
+        """
+        Tests that a run whose workflow is complete isn't taken over, even after its lease expired.
+        """
+        self.monitor.lease_ttl_sec = 0.1
+        self.assertTrue(self.monitor.hold_lease("Run1"))
+        self.monitor.complete_lease("Run1")
+        time.sleep(0.2)
+        self.assertFalse(self.other.hold_lease("Run1"))
+        self.assertTrue(self.monitor.hold_lease("Run1"))
+
+
+class TestRundirSizes(MonitorTestCase):
+    """
+    Tests that the size of a run directory is only added up for the shortest first scheduling
+    policy, and not on the thread that queues the run.
+    """
+
+    CONF = {"scheduling_policy": "shortest_first"}
+
+    def setUp(self):
+        super().setUp()
+        self.monitor.sqlite_conn.insert_run(rundir_path=self.make_rundir("Run1"))
+        self.monitor.run_workflow("Run1")
+
+    def test_size_pending(self):
+        """
+        Tests that a queued run isn't admitted until its size is known, and that the size is then
+        recorded.
+        """
+        self.assertIsNone(self.monitor.sqlite_conn.get_run("Run1")[Db.TASKS_RUNDIR_SIZE])
+        records = {"Run1": self.monitor.sqlite_conn.get_run("Run1")}
+        self.assertEqual(self.monitor.update_rundir_sizes(records), set(["Run1"]))
+        self.monitor.rundir_size_futures["Run1"].result(timeout=10)
+        self.assertEqual(self.monitor.update_rundir_sizes(records), set())
+        self.assertEqual(records["Run1"][Db.TASKS_RUNDIR_SIZE], 4000)
+        self.assertEqual(self.monitor.sqlite_conn.get_run("Run1")[Db.TASKS_RUNDIR_SIZE], 4000)
+        self.assertEqual(self.monitor.rundir_size_futures, {})
+
+    def test_fifo(self):
+        """
+        Tests that the size isn't added up for another scheduling policy.
+        """
+        self.monitor.scheduling_policy = "fifo"
+        self.monitor.admit_queued_runs()
+        self.assertEqual(self.monitor.rundir_size_futures, {})
+        self.assertIsNone(self.monitor.sqlite_conn.get_run("Run1")[Db.TASKS_RUNDIR_SIZE])
+
+    def test_empty_rundir(self):
+        """
+        Tests that the size of an empty run directory is recorded as 0, and that it's then known
+        rather than added up again on every call.
+        """
+        run_path = os.path.join(self.watchdir, "Run2")
+        os.makedirs(run_path)
+        self.monitor.sqlite_conn.insert_run(rundir_path=run_path)
+        records = {"Run2": self.monitor.sqlite_conn.get_run("Run2")}
+        self.assertEqual(self.monitor.update_rundir_sizes(records), set(["Run2"]))
+        self.monitor.rundir_size_futures["Run2"].result(timeout=10)
+        self.assertEqual(self.monitor.update_rundir_sizes(records), set())
+        self.assertEqual(self.monitor.sqlite_conn.get_run("Run2")[Db.TASKS_RUNDIR_SIZE], 0)
+        records = {"Run2": self.monitor.sqlite_conn.get_run("Run2")}
+        self.assertEqual(self.monitor.update_rundir_sizes(records), set())
+        self.assertEqual(self.monitor.rundir_size_futures, {})
+
+
+class TestScanCache(MonitorTestCase):
+    """
+    Tests that ``sruns_monitor.monitor.Monitor.scan`` only checks a run directory for a sentinal file
+    when its scan cache record is out of date.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.ready_path = self.make_rundir("Run1")
+        self.not_ready_path = self.make_rundir("Run2")
+        os.remove(os.path.join(self.not_ready_path, "CopyComplete.txt"))
+        self.assertEqual(self.monitor.scan(), ([self.ready_path], []))
+
+    def get_cache(self):
+        return self.monitor.sqlite_conn.get_scan_cache(self.watchdir)
+
+    def keep_mtime(self, path, fn):
+        """
+        Calls `fn`, and then sets the modification time of the directory at `path` back to what it
+        was, as it can look on a network filesystem.
+        """
+        st = os.stat(path)
+        fn()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    def test_cache_hit(self):
+        """
+        Tests that run directories whose inode and modification time are unchanged aren't checked
+        again, and that one whose modification time changed is.
+        """
+        found, in_progress, updated, deleted, latency = self.monitor.scan_watchdir(self.watchdir, self.get_cache())
+        self.assertEqual((found, in_progress, updated, deleted), ([self.ready_path], [], [], []))
+        # The sentinal file isn't looked for, so the run directory is still ready.
+        self.keep_mtime(self.ready_path, lambda: os.remove(os.path.join(self.ready_path, "CopyComplete.txt")))
+        self.assertEqual(self.monitor.scan(), ([self.ready_path], []))
+        mtime_ns = os.stat(self.ready_path).st_mtime_ns + 10**9
+        os.utime(self.ready_path, ns=(mtime_ns, mtime_ns))
+        self.assertEqual(self.monitor.scan(), ([], []))
+        self.assertEqual(self.get_cache()[self.ready_path][Db.SCAN_CACHE_READY], 0)
+
+    def test_recheck(self):
+        """
+        Tests that a run directory without a sentinal file is checked again once its record is older
+        than ``recheck_sec``, even if its modification time is unchanged.
+        """
+        self.monitor.recheck_sec = 0.5
+        self.keep_mtime(self.not_ready_path,
+                        lambda: open(os.path.join(self.not_ready_path, "CopyComplete.txt"), "w").close())
+        self.assertEqual(self.monitor.scan(), ([self.ready_path], []))
+        time.sleep(0.6)
+        self.assertEqual(self.monitor.scan(), ([self.ready_path, self.not_ready_path], []))
+        self.assertEqual(self.get_cache()[self.not_ready_path][Db.SCAN_CACHE_READY], 1)
+
+    def test_deleted(self):
+        """
+        Tests that the record of a run directory that's gone is deleted.
+        """
+        self.assertEqual(sorted(self.get_cache()), [self.ready_path, self.not_ready_path])
+        shutil.rmtree(self.not_ready_path)
+        self.assertEqual(self.monitor.scan(), ([self.ready_path], []))
+        self.assertEqual(list(self.get_cache()), [self.ready_path])
+
+
+class TestWatcherScan(MonitorTestCase):
+    """
+    Tests that with inotify, a watch directory that's scanned on every cycle, i.e. on NFS, is scanned
+    with a timeout.
+    """
+
+    CONF = {"inotify": True, "scan_timeout_sec": 1}
+
+    def setUp(self):
+        super().setUp()
+        self.run_path = self.make_rundir("Run1")
+        self.monitor.run_watcher.polled_watchdirs.add(self.watchdir)
+        self.hang = threading.Event()
+        scan_watchdir = self.monitor.scan_watchdir
+
+        def hanging_scan_watchdir(watchdir, cache):
+            self.hang.wait()
+            return scan_watchdir(watchdir, cache)
+        self.monitor.scan_watchdir = hanging_scan_watchdir
+
+    def tearDown(self):
+        self.hang.set()
+        self.monitor.run_watcher.close()
+        super().tearDown()
+
+    def test_degraded(self):
+        """
+        Tests that a hung scan of a polled watch directory is reported as degraded, and that the
+        watch directory recovers once the scan returns.
+        """
+        start = time.time()
+        self.assertEqual(self.monitor.scan(), ([], []))
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(self.monitor.degraded_watchdirs, set([self.watchdir]))
+        self.hang.set()
+        self.monitor.scan_futures[self.watchdir].result(timeout=10)
+        self.assertEqual(self.monitor.scan(), ([self.run_path], []))
+        self.assertEqual(self.monitor.degraded_watchdirs, set())
+
+
+class TestHungWatcher(MonitorTestCase):
+    """
+    Tests that with inotify and incremental archiving, a poll of the watcher that hangs doesn't
+    hold up the cycle, and that the runs of the watch directories it watches are skipped even
+    though their scans for runs in progress succeed.
+    """
+
+    CONF = {"inotify": True, "incremental_archiving": True, "scan_timeout_sec": 1}
+
+    def setUp(self):
+        super().setUp()
+        self.run_path = self.make_rundir("Run1")
+        self.in_progress_path = self.make_rundir("Run2")
+        os.remove(os.path.join(self.in_progress_path, "CopyComplete.txt"))
+        open(os.path.join(self.in_progress_path, "RunInfo.xml"), "w").close()
+        self.hang = threading.Event()
+        poll = self.monitor.run_watcher.poll
+
+        def hanging_poll(*args, **kwargs):
+            self.hang.wait()
+            return poll(*args, **kwargs)
+        self.monitor.run_watcher.poll = hanging_poll
+
+    def tearDown(self):
+        self.hang.set()
+        if self.monitor.watcher_future:
+            self.monitor.watcher_future.result(timeout=10)
+        self.monitor.run_watcher.close()
+        super().tearDown()
+
+    def test_degraded(self):
+        """
+        Tests that the watch directory stays degraded while the poll hangs, and that it recovers
+        once the poll returns.
+        """
+        start = time.time()
+        self.assertEqual(self.monitor.scan(), ([], []))
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(self.monitor.degraded_watchdirs, set([self.watchdir]))
+        self.hang.set()
+        self.monitor.watcher_future.result(timeout=10)
+        self.assertEqual(self.monitor.scan(), ([self.run_path], [self.in_progress_path]))
+        self.assertEqual(self.monitor.degraded_watchdirs, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###
+# Nathaniel Watson
+# nathanielwatson@stanfordhealthcare.org
+###
+
+"""
+Tests the ``sruns_monitor.process_table.ProcessTable`` class.
+"""
+
+import multiprocessing
+import os
+import signal
+import time
+import unittest
+
+from sruns_monitor import process_table
+from sruns_monitor.sqlite_utils import Db
+
+
+def exit_with(code):
+    os._exit(code)
+
+
+class TestProcessTable(unittest.TestCase):
+    """
+    Tests the ``sruns_monitor.process_table.ProcessTable`` class.
+    """
+
+    def setUp(self):
+        self.table = process_table.ProcessTable()
+
+    def start(self, run_name, kind, target, args=()):
+        p = multiprocessing.Process(target=target, args=args)
+        p.start()
+        self.table.add(run_name=run_name, kind=kind, process=p)
+        return p
+
+    def wait_for_reap(self, count, timeout=10):
+        reaped = 0
+        deadline = time.time() + timeout
+        while reaped < count and time.time() < deadline:
+            reaped += self.table.reap()
+            time.sleep(0.05)
+        return reaped
+
+    def test_lookups(self):
+        """
+        Tests that a running child process can be looked up by process ID and by run name, and is
+        counted by kind.
+        """
+        p = self.start("run1", Db.STAGE_TAR, time.sleep, (30,))
+        try:
+            self.assertIn(p.pid, self.table)
+            self.assertEqual(self.table.get("run1").process, p)
+            self.assertIsNone(self.table.get("run2"))
+            self.assertEqual(self.table.count_kinds(), {Db.STAGE_TAR: 1})
+            self.assertEqual(self.table.reap(), 0)
+        finally:
+            p.kill()
+            p.join()
+
+    def test_reap_exit_codes(self):
+        """
+        Tests that all child processes that exited are reaped, with their exit codes, and that those
+        killed by a signal have a negative exit code.
+        """
+        ok = self.start("run1", Db.STAGE_TAR, exit_with, (0,))
+        failed = self.start("run2", Db.STAGE_UPLOAD, exit_with, (3,))
+        killed = self.start("run3", process_table.KIND_INCREMENT, time.sleep, (30,))
+        killed.kill()
+        self.assertEqual(self.wait_for_reap(3), 3)
+        self.assertEqual(len(self.table), 0)
+        self.assertNotIn(ok.pid, self.table)
+        exit_codes = {child.run_name: code for child, code in self.table.pop_exited()}
+        self.assertEqual(exit_codes, {"run1": 0, "run2": 3, "run3": -signal.SIGKILL})
+        self.assertEqual(self.table.pop_exited(), [])
+
+    def test_finish(self):
+        """
+        Tests that a child process whose job finished is moved to the exited child processes with
+        the job's exit code, even though it keeps running.
+        """
+        p = self.start("run1", Db.STAGE_UPLOAD, time.sleep, (30,))
+        try:
+            self.table.finish(p.pid, 1)
+            self.assertNotIn(p.pid, self.table)
+            self.assertEqual(self.table.reap(), 0)
+            self.assertEqual([(child.run_name, code) for child, code in self.table.pop_exited()],
+                             [("run1", 1)])
+        finally:
+            p.kill()
+            p.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###
+# Nathaniel Watson
+# nathanielwatson@stanfordhealthcare.org
+###
+
+"""
+Tests the scheduling policies in the ``sruns_monitor.scheduling`` module.
+"""
+
+import unittest
+
+from sruns_monitor import scheduling
+from sruns_monitor.sqlite_utils import Db
+
+
+def make_record(name, rundir_path, size, ready_at, queued_at=100):
+    return {
+        Db.TASKS_NAME: name,
+        Db.TASKS_RUNDIR_PATH: rundir_path,
+        Db.TASKS_RUNDIR_SIZE: size,
+        Db.TASKS_READY_AT: ready_at,
+        Db.TASKS_QUEUED_AT: queued_at
+    }
+
+
+class TestOrderRuns(unittest.TestCase):
+    """
+    Tests the ``sruns_monitor.scheduling.order_runs`` function.
+    """
+
+    def setUp(self):
+        self.records = [
+            make_record("NovaSeqRun", "/seq/novaseq/NovaSeqRun", size=10**12, ready_at=10),
+            make_record("MiSeqRun", "/seq/miseq/MiSeqRun", size=3 * 10**9, ready_at=30),
+            make_record("NextSeqRun", "/seq/nextseq/NextSeqRun", size=10**11, ready_at=20)
+        ]
+
+    def test_fifo(self):
+        """
+        Tests that runs are ordered by when their sentinal file appeared.
+        """
+        order = scheduling.order_runs(self.records, policy=scheduling.POLICY_FIFO)
+        self.assertEqual(order, ["NovaSeqRun", "NextSeqRun", "MiSeqRun"])
+
+    def test_fifo_without_ready_time(self):
+        """
+        Tests that a run whose sentinal file time isn't known is ordered by when it was queued.
+        """
+        self.records.append(make_record("OldRun", "/seq/miseq/OldRun", size=0, ready_at=0, queued_at=15))
+        order = scheduling.order_runs(self.records, policy=scheduling.POLICY_FIFO)
+        self.assertEqual(order, ["NovaSeqRun", "OldRun", "NextSeqRun", "MiSeqRun"])
+
+    def test_shortest_first(self):
+        """
+        Tests that the smallest runs are ordered first.
+        """
+        order = scheduling.order_runs(self.records, policy=scheduling.POLICY_SHORTEST_FIRST)
+        self.assertEqual(order, ["MiSeqRun", "NextSeqRun", "NovaSeqRun"])
+
+    def test_shortest_first_unknown_size(self):
+        """
+        Tests that a run whose size couldn't be computed is ordered as if its run directory were
+        empty.
+        """
+        self.records.append(make_record("UnknownRun", "/seq/miseq/UnknownRun", size=None, ready_at=40))
+        order = scheduling.order_runs(self.records, policy=scheduling.POLICY_SHORTEST_FIRST)
+        self.assertEqual(order, ["UnknownRun", "MiSeqRun", "NextSeqRun", "NovaSeqRun"])
+
+    def test_watchdir_priority(self):
+        """
+        Tests that runs in watch directories with a higher priority are ordered first, that other
+        watch directories have a priority of 0, and that runs with the same priority are ordered by
+        when their sentinal file appeared.
+        """
+        priorities = {"/seq/miseq/": 5, "/seq/novaseq": -1}
+        order = scheduling.order_runs(self.records, policy=scheduling.POLICY_WATCHDIR_PRIORITY,
+                                      watchdir_priorities=priorities)
+        self.assertEqual(order, ["MiSeqRun", "NextSeqRun", "NovaSeqRun"])
+
+    def test_unknown_policy(self):
+        """
+        Tests that an unknown policy raises a ValueError.
+        """
+        with self.assertRaises(ValueError):
+            scheduling.order_runs(self.records, policy="random")
+
+
+if __name__ == "__main__":
+    unittest.main()
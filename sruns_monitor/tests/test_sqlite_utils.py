@@ -11,9 +11,11 @@
 Tests functions in the ``sruns_monitor.sqlite_utils`` module.
 """
 
+import concurrent.futures
 import hashlib
 import json
 import os
+import time
 import unittest
 
 from sruns_monitor.tests import TMP_DIR
@@ -92,6 +94,29 @@ class TestStatus(unittest.TestCase):
         status = self.db.get_run_status(run_name)
         self.assertEqual(status, Db.RUN_STATUS_RUNNING)
 
+    def test_status_running_pids(self):
+        """
+        When the process IDs of the running workflows are given, `Db.get_run_status` should look the
+        record's PID value up there, and return `Db.RUN_STATUS_NOT_RUNNING` for a process that
+        exists but isn't one of them.
+        """
+        run_name = "testrun"
+        self.db.insert_run(rundir_path=run_name, tarfile="run.tar.gz", gcp_tarfile="", pid=os.getpid())
+        self.assertEqual(self.db.get_run_status(run_name, running_pids=set()), Db.RUN_STATUS_NOT_RUNNING)
+        status = self.db.get_run_status(run_name, running_pids=set([os.getpid()]))
+        self.assertEqual(status, Db.RUN_STATUS_RUNNING)
+
+    def test_status_queued(self):
+        """
+        When a record is queued for a workflow slot and its workflow isn't running,
+        `Db.get_run_status` should return the status `Db.RUN_STATUS_QUEUED`.
+        """
+        run_name = "testrun"
+        self.db.insert_run(rundir_path=run_name, pid=1010101010)
+        self.db.update_run(name=run_name, payload={Db.TASKS_QUEUED_AT: time.time()})
+        status = self.db.get_run_status(run_name)
+        self.assertEqual(status, Db.RUN_STATUS_QUEUED)
+
 
 
 class TestDb(unittest.TestCase):
@@ -139,7 +164,19 @@ class TestDb(unittest.TestCase):
             Db.TASKS_PID: 0,
             Db.TASKS_TARFILE: '',
             Db.TASKS_GCP_TARFILE: '',
-            Db.TASKS_RUNDIR_PATH: self.RUN_PATH
+            Db.TASKS_RUNDIR_PATH: self.RUN_PATH,
+            Db.TASKS_TAR_MEMBERS: 0,
+            Db.TASKS_TAR_OFFSET: 0,
+            Db.TASKS_UPLOAD_SESSION: '',
+            Db.TASKS_UPLOAD_OFFSET: 0,
+            Db.TASKS_CRC32C: '',
+            Db.TASKS_MD5: '',
+            Db.TASKS_QUEUED_AT: 0,
+            Db.TASKS_RUNDIR_SIZE: None,
+            Db.TASKS_READY_AT: 0,
+            Db.TASKS_QUEUE_WAIT_SEC: 0,
+            Db.TASKS_STAGE: '',
+            Db.TASKS_EXIT_CODE: None
         }
         self.assertTrue(rec == expected)
 
@@ -156,7 +193,19 @@ class TestDb(unittest.TestCase):
             Db.TASKS_PID: pid,
             Db.TASKS_TARFILE: '',
             Db.TASKS_GCP_TARFILE: '',
-            Db.TASKS_RUNDIR_PATH: self.RUN_PATH
+            Db.TASKS_RUNDIR_PATH: self.RUN_PATH,
+            Db.TASKS_TAR_MEMBERS: 0,
+            Db.TASKS_TAR_OFFSET: 0,
+            Db.TASKS_UPLOAD_SESSION: '',
+            Db.TASKS_UPLOAD_OFFSET: 0,
+            Db.TASKS_CRC32C: '',
+            Db.TASKS_MD5: '',
+            Db.TASKS_QUEUED_AT: 0,
+            Db.TASKS_RUNDIR_SIZE: None,
+            Db.TASKS_READY_AT: 0,
+            Db.TASKS_QUEUE_WAIT_SEC: 0,
+            Db.TASKS_STAGE: '',
+            Db.TASKS_EXIT_CODE: None
         }
         self.assertTrue(rec == expected)
 
@@ -175,7 +224,19 @@ class TestDb(unittest.TestCase):
             Db.TASKS_PID: pid,
             Db.TASKS_TARFILE: tarfile,
             Db.TASKS_GCP_TARFILE: '',
-            Db.TASKS_RUNDIR_PATH: self.RUN_PATH
+            Db.TASKS_RUNDIR_PATH: self.RUN_PATH,
+            Db.TASKS_TAR_MEMBERS: 0,
+            Db.TASKS_TAR_OFFSET: 0,
+            Db.TASKS_UPLOAD_SESSION: '',
+            Db.TASKS_UPLOAD_OFFSET: 0,
+            Db.TASKS_CRC32C: '',
+            Db.TASKS_MD5: '',
+            Db.TASKS_QUEUED_AT: 0,
+            Db.TASKS_RUNDIR_SIZE: None,
+            Db.TASKS_READY_AT: 0,
+            Db.TASKS_QUEUE_WAIT_SEC: 0,
+            Db.TASKS_STAGE: '',
+            Db.TASKS_EXIT_CODE: None
         }
         self.assertTrue(rec == expected)
 
@@ -195,10 +256,148 @@ class TestDb(unittest.TestCase):
             Db.TASKS_PID: pid,
             Db.TASKS_TARFILE: tarfile,
             Db.TASKS_GCP_TARFILE: gcp_tarfile,
-            Db.TASKS_RUNDIR_PATH: self.RUN_PATH
+            Db.TASKS_RUNDIR_PATH: self.RUN_PATH,
+            Db.TASKS_TAR_MEMBERS: 0,
+            Db.TASKS_TAR_OFFSET: 0,
+            Db.TASKS_UPLOAD_SESSION: '',
+            Db.TASKS_UPLOAD_OFFSET: 0,
+            Db.TASKS_CRC32C: '',
+            Db.TASKS_MD5: '',
+            Db.TASKS_QUEUED_AT: 0,
+            Db.TASKS_RUNDIR_SIZE: None,
+            Db.TASKS_READY_AT: 0,
+            Db.TASKS_QUEUE_WAIT_SEC: 0,
+            Db.TASKS_STAGE: '',
+            Db.TASKS_EXIT_CODE: None
         }
         self.assertTrue(rec == expected)
 
+    def test_update_run_attrs_tar_checkpoint(self):
+        """
+        Tests `sqlite_utls.Db.update_run` for success when updating an existing record to checkpoint
+        the tar task's progress.
+        """
+        self.db.insert_run(rundir_path=self.RUN_PATH)
+        self.db.update_run(name=self.RUN_NAME, payload={Db.TASKS_TAR_MEMBERS: 12, Db.TASKS_TAR_OFFSET: 20480})
+        rec = self.db.get_run(self.RUN_NAME)
+        self.assertEqual((rec[Db.TASKS_TAR_MEMBERS], rec[Db.TASKS_TAR_OFFSET]), (12, 20480))
+
+    def test_add_missing_columns(self):
+        """
+        Tests that instantiating `sruns_monitor.Db` on a database whose tasks table predates the
+        checkpoint attributes adds those attributes.
+        """
+        self.db.conn.execute("DROP TABLE {};".format(Db.TASKS_TABLE_NAME))
+        self.db.conn.execute("CREATE TABLE {} (name text PRIMARY KEY, pid integer, tarfile text, gcp_tarfile text, rundir_path);".format(Db.TASKS_TABLE_NAME))
+        self.db.conn.commit()
+        self.db.conn.close()
+        self.db = Db(self.dbfile)
+        self.db.insert_run(rundir_path=self.RUN_PATH)
+        rec = self.db.get_run(self.RUN_NAME)
+        self.assertEqual(rec[Db.TASKS_TAR_OFFSET], 0)
+
+    def test_get_queued_runs(self):
+        """
+        Tests that `sqlite_utils.Db.get_queued_runs` returns the queued runs in the order that they
+        were queued.
+        """
+        for name, queued_at in [("run1", 20), ("run2", 0), ("run3", 10)]:
+            self.db.insert_run(rundir_path=os.path.join(self.WATCH_DIR, name))
+            self.db.update_run(name=name, payload={Db.TASKS_QUEUED_AT: queued_at})
+        self.assertEqual(self.db.get_queued_runs(), ["run3", "run1"])
+
+    def test_other_thread(self):
+        """
+        Tests that a connection created with check_same_thread set to False can be used by another
+        thread than the one that created it, as in the event-loop mode of the monitor.
+        """
+        self.db.conn.close()
+        self.db = Db(self.dbfile, check_same_thread=False)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(self.db.insert_run, rundir_path=self.RUN_PATH).result()
+        self.assertEqual(self.db.get_run(self.RUN_NAME)[Db.TASKS_NAME], self.RUN_NAME)
+
+    def test_update_scan_cache(self):
+        """
+        Tests that `sqlite_utils.Db.update_scan_cache` creates, replaces and deletes scan cache
+        records, and that `sqlite_utils.Db.get_scan_cache` returns those of the given watch directory.
+        """
+        def make_rec(path, watchdir=self.WATCH_DIR, ready=0):
+            return {
+                Db.SCAN_CACHE_PATH: path,
+                Db.SCAN_CACHE_WATCHDIR: watchdir,
+                Db.SCAN_CACHE_INODE: 12,
+                Db.SCAN_CACHE_MTIME_NS: 1500000000000000000,
+                Db.SCAN_CACHE_READY: ready,
+                Db.SCAN_CACHE_CHECKED_AT: 1500000000.5,
+                Db.SCAN_CACHE_IN_PROGRESS: 0
+            }
+        other_path = os.path.join(self.WATCH_DIR, "second_run")
+        self.db.update_scan_cache(records=[make_rec(self.RUN_PATH), make_rec(other_path),
+                                           make_rec("watchdir2/run", watchdir="watchdir2")])
+        ready_rec = make_rec(self.RUN_PATH, ready=1)
+        self.db.update_scan_cache(records=[ready_rec], deleted_paths=[other_path])
+        self.assertEqual(self.db.get_scan_cache(self.WATCH_DIR), {self.RUN_PATH: ready_rec})
+
+    def test_shards_table_exists(self):
+        """
+        Tests that the database contains the table specified by the class variable
+        `Db.SHARDS_TABLE_NAME`.
+        """
+        tables = self.db.get_tables()
+        self.assertTrue(Db.SHARDS_TABLE_NAME in tables)
+
+    def test_update_shard_attr_tarfile(self):
+        """
+        Tests `sqlite_utls.Db.update_shard` for success when updating an existing shard record to
+        add a value for the local tarfile path.
+        """
+        self.db.insert_shard(run_name=self.RUN_NAME, shard="L001")
+        self.db.insert_shard(run_name=self.RUN_NAME, shard="rest")
+        tarfile = self.RUN_NAME + ".L001.tar"
+        self.db.update_shard(run_name=self.RUN_NAME, shard="L001", payload={Db.SHARDS_TARFILE: tarfile})
+        shards = self.db.get_shards(self.RUN_NAME)
+        expected = [
+            {
+                Db.SHARDS_RUN_NAME: self.RUN_NAME,
+                Db.SHARDS_NAME: "L001",
+                Db.SHARDS_TARFILE: tarfile,
+                Db.SHARDS_GCP_TARFILE: '',
+                Db.SHARDS_MEMBERS: '',
+                Db.SHARDS_CRC32C: '',
+                Db.SHARDS_MD5: ''
+            },
+            {
+                Db.SHARDS_RUN_NAME: self.RUN_NAME,
+                Db.SHARDS_NAME: "rest",
+                Db.SHARDS_TARFILE: '',
+                Db.SHARDS_GCP_TARFILE: '',
+                Db.SHARDS_MEMBERS: '',
+                Db.SHARDS_CRC32C: '',
+                Db.SHARDS_MD5: ''
+            }
+        ]
+        self.assertEqual(shards, expected)
+
+    def test_insert_shard_attr_members(self):
+        """
+        Tests `sqlite_utls.Db.insert_shard` for success when creating a shard record for an increment,
+        with the members attribute set.
+        """
+        members = '["Data/Intensities/BaseCalls/L001/C1.1"]'
+        self.db.insert_shard(run_name=self.RUN_NAME, shard="inc001", members=members)
+        shard = self.db.get_shards(self.RUN_NAME)[0]
+        self.assertEqual(shard[Db.SHARDS_MEMBERS], members)
+
+    def test_delete_run_deletes_shards(self):
+        """
+        Tests that `sqlite_utls.Db.delete_run` also removes the run's shard records.
+        """
+        self.db.insert_run(rundir_path=self.RUN_PATH)
+        self.db.insert_shard(run_name=self.RUN_NAME, shard="L001")
+        self.db.delete_run(self.RUN_NAME)
+        self.assertEqual(self.db.get_shards(self.RUN_NAME), [])
+
 
 if __name__ == "__main__":
     unittest.main()
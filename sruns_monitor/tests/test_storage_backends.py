@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###
+# Nathaniel Watson
+# nathanielwatson@stanfordhealthcare.org
+###
+
+"""
+Tests the ``sruns_monitor.storage_backends.LocalBackend`` class, and uploads to and downloads from
+it through the functions in the ``sruns_monitor.utils`` and ``sruns_monitor.gcstorage_utils``
+modules, as well as the handling of unexpected statuses in the resumable uploads of the
+``sruns_monitor.storage_backends.GCSBackend`` class, against a local HTTP server.
+"""
+
+import gc
+import http.server
+import json
+import os
+import shutil
+import tarfile
+import threading
+import time
+import unittest
+
+from google.cloud import storage
+import requests
+
+from sruns_monitor.tests import WATCH_DIRS, TMP_DIR
+from sruns_monitor import exceptions as srm_exceptions
+from sruns_monitor import gcstorage_utils
+from sruns_monitor import storage_backends
+from sruns_monitor import utils
+
+
+class SlowStartBackend(storage_backends.LocalBackend):
+    """
+    Records the byte ranges that are read, and delays the reads of the first `slow_reads` ranges so
+    that later ranges complete before them. The first byte of the range at `corrupt_offset`, if set,
+    is changed as it's read.
+    """
+
+    def __init__(self, root, slow_reads=0, corrupt_offset=None):
+        super().__init__(root)
+        self.slow_reads = slow_reads
+        self.corrupt_offset = corrupt_offset
+        #: (start, end, generation) tuples of the ranges read, in the order that they completed.
+        self.reads = []
+
+    def read_range(self, object_name, start=0, end=None, generation=None):
+        if start < self.slow_reads * (end - start):
+            time.sleep(0.2)
+        data = super().read_range(object_name, start=start, end=end, generation=generation)
+        if start == self.corrupt_offset:
+            data = bytes([data[0] ^ 0xff]) + data[1:]
+        self.reads.append((start, end, generation))
+        return data
+
+
+class TestLocalBackend(unittest.TestCase):
+    """
+    Tests the ``sruns_monitor.storage_backends.LocalBackend`` class.
+    """
+
+    def setUp(self):
+        self.root = os.path.join(TMP_DIR, "LocalBucket")
+        self.backend = storage_backends.LocalBackend(self.root)
+        self.source_file = os.path.join(TMP_DIR, "local_backend_source")
+        with open(self.source_file, "wb") as fh:
+            fh.write(os.urandom(100000))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        os.remove(self.source_file)
+
+    def read_source(self):
+        with open(self.source_file, "rb") as fh:
+            return fh.read()
+
+    def test_stat_missing(self):
+        """
+        Tests that stat'ing an object that doesn't exist returns None.
+        """
+        self.assertIsNone(self.backend.stat("missing"))
+
+    def test_stat_checksums(self):
+        """
+        Tests that an object's checksums match those of the file it was uploaded from.
+        """
+        utils.upload_to_gcp(bucket=self.backend, blob_name="run/run.tar", source_file=self.source_file)
+        info = self.backend.stat("run/run.tar")
+        self.assertEqual(info.size, 100000)
+        self.assertEqual(info.crc32c, utils.get_file_crc32c(self.source_file))
+        self.assertTrue(utils.blob_matches_file(bucket=self.backend, blob_name="run/run.tar",
+                                                source_file=self.source_file))
+
+    def test_stat_sidecar(self):
+        """
+        Tests that stat returns the checksums that were kept when the object was created, without
+        reading the object, unless the object was changed in place since.
+        """
+        utils.upload_to_gcp(bucket=self.backend, blob_name="run/run.tar", source_file=self.source_file)
+        info = self.backend.stat("run/run.tar")
+        path = self.backend.get_path("run/run.tar")
+        with open(path, "r+b") as fh:
+            fh.write(b"changed")
+        # Same size and modification time, so the kept checksums are returned.
+        os.utime(path, ns=(info.generation, info.generation))
+        self.assertEqual(self.backend.stat("run/run.tar"), info)
+        os.utime(path, ns=(info.generation + 10**9, info.generation + 10**9))
+        changed = self.backend.stat("run/run.tar")
+        self.assertNotEqual(changed.crc32c, info.crc32c)
+        self.assertEqual(changed.generation, info.generation + 10**9)
+
+    def test_read_range(self):
+        """
+        Tests that a ranged read returns the bytes from the start offset up to the exclusive end
+        offset, or to the end of the object.
+        """
+        utils.upload_to_gcp(bucket=self.backend, blob_name="obj", source_file=self.source_file)
+        data = self.read_source()
+        self.assertEqual(self.backend.read_range("obj", start=10, end=20), data[10:20])
+        self.assertEqual(self.backend.read_range("obj", start=99990), data[99990:])
+
+    def test_resumable_upload(self):
+        """
+        Tests that a resumable upload that is interrupted part way through continues from the
+        offset committed in the session, and that the object only appears once it's complete.
+        """
+        checkpoints = []
+        def checkpoint(session_url, offset):
+            checkpoints.append((session_url, offset))
+            if offset == 2 * 32768:
+                raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            utils.resumable_upload_to_gcp(bucket=self.backend, blob_name="obj", source_file=self.source_file,
+                                          checkpoint=checkpoint, chunk_size=32768)
+        self.assertIsNone(self.backend.stat("obj"))
+        session_url = checkpoints[-1][0]
+        self.assertEqual(self.backend.query_resumable_upload(session_url, size=100000), 2 * 32768)
+        checkpoints.clear()
+        utils.resumable_upload_to_gcp(bucket=self.backend, blob_name="obj", source_file=self.source_file,
+                                      session_url=session_url, checkpoint=checkpoint, chunk_size=32768)
+        self.assertEqual(checkpoints[0][1], 3 * 32768)
+        self.assertEqual(self.backend.read_range("obj"), self.read_source())
+
+    def test_composite_upload(self):
+        """
+        Tests that a parallel composite upload with more parts than a single compose accepts creates
+        the whole object, and that the part objects are removed.
+        """
+        utils.composite_upload_to_gcp(bucket=self.backend, blob_name="obj", source_file=self.source_file,
+                                      part_size=1000, workers=4)
+        self.assertEqual(self.backend.read_range("obj"), self.read_source())
+        self.assertEqual(sorted(os.listdir(self.root)), [storage_backends.LocalBackend.CHECKSUMS_DIR,
+                                                         storage_backends.LocalBackend.UPLOADS_DIR, "obj"])
+        self.assertEqual(os.listdir(os.path.join(self.root, storage_backends.LocalBackend.CHECKSUMS_DIR)),
+                         ["obj.json"])
+
+    def test_stream_tar(self):
+        """
+        Tests that a directory streamed into an object is a tarball with the checksums returned.
+        """
+        checksums = utils.stream_tar_to_gcp(input_dir=WATCH_DIRS[1], bucket=self.backend, blob_name="run.tar")
+        utils.verify_blob_checksums(bucket=self.backend, blob_name="run.tar", crc32c=checksums["crc32c"],
+                                    md5=checksums["md5"])
+        with tarfile.open(self.backend.get_path("run.tar")) as tf:
+            self.assertIn(os.path.basename(WATCH_DIRS[1]), tf.getnames())
+
+    def test_stream_tar_failure(self):
+        """
+        Tests that no object is created if the tar stream fails part way through.
+        """
+        def failing_tar(fileobj, **kwargs):
+            fileobj.write(b"partial tarball")
+            raise OSError("Read error")
+        real_tar = utils.tar
+        utils.tar = failing_tar
+        try:
+            with self.assertRaises(OSError):
+                utils.stream_tar_to_gcp(input_dir=WATCH_DIRS[1], bucket=self.backend, blob_name="run.tar")
+        finally:
+            utils.tar = real_tar
+        gc.collect()
+        self.assertIsNone(self.backend.stat("run.tar"))
+        self.assertEqual(os.listdir(os.path.join(self.root, storage_backends.LocalBackend.UPLOADS_DIR)), [])
+
+    def test_sliced_download(self):
+        """
+        Tests that a sliced download writes the whole object.
+        """
+        utils.upload_to_gcp(bucket=self.backend, blob_name="obj", source_file=self.source_file)
+        download_dir = os.path.join(TMP_DIR, "LocalDownload")
+        filename = gcstorage_utils.download(bucket=self.backend, object_path="obj", download_dir=download_dir,
+                                            slice_size=7000, workers=3)
+        with open(filename, "rb") as fh:
+            self.assertEqual(fh.read(), self.read_source())
+        shutil.rmtree(download_dir)
+
+
+class CountingBackend(storage_backends.LocalBackend):
+    """
+    Records the names of the objects that are uploaded from files, and the most uploads that were
+    in progress at the same time. Each upload takes at least 0.05 seconds.
+    """
+
+    def __init__(self, root, name=None):
+        super().__init__(root, name=name)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        #: The names of the objects uploaded, in the order that they completed.
+        self.uploads = []
+
+    def upload_from_file(self, object_name, fileobj, size):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        try:
+            super().upload_from_file(object_name, fileobj, size)
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.uploads.append(object_name)
+
+
+class TestUploadFolder(unittest.TestCase):
+    """
+    Tests the ``sruns_monitor.gcstorage_utils.upload_folder`` function against a
+    ``sruns_monitor.storage_backends.LocalBackend``, and its sync manifest.
+    """
+
+    def setUp(self):
+        self.root = os.path.join(TMP_DIR, "LocalBucket")
+        self.backend = CountingBackend(self.root)
+        self.folder = os.path.join(TMP_DIR, "Folder")
+        self.relpaths = []
+        for i in range(12):
+            relpath = os.path.join("dir{}".format(i % 3), "file{}.txt".format(i))
+            self.write(relpath, "file {}".format(i))
+            self.relpaths.append(relpath)
+        self.manifest_file = os.path.join(self.folder, gcstorage_utils.UPLOAD_MANIFEST_NAME)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        shutil.rmtree(self.folder)
+
+    def write(self, relpath, text):
+        path = os.path.join(self.folder, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fh:
+            fh.write(text)
+        return path
+
+    def upload(self, backend=None, bucket_path="runs"):
+        return gcstorage_utils.upload_folder(bucket=backend or self.backend, folder=self.folder,
+                                             bucket_path=bucket_path, workers=4)
+
+    def read_manifest(self):
+        with open(self.manifest_file) as fh:
+            return json.load(fh)
+
+    def test_concurrent_upload(self):
+        """
+        Tests that all of the files, but not the manifest, are uploaded at their relative paths, with
+        several uploads in progress at a time.
+        """
+        self.assertEqual(sorted(self.upload()), sorted(self.relpaths))
+        self.assertGreater(self.backend.max_active, 1)
+        self.assertLessEqual(self.backend.max_active, 4)
+        self.assertEqual(sorted(self.backend.uploads),
+                         sorted("runs/Folder/" + i.replace(os.sep, "/") for i in self.relpaths))
+        self.assertEqual(self.backend.read_range("runs/Folder/dir1/file4.txt"), b"file 4")
+        self.assertEqual(sorted(self.read_manifest()["files"]), sorted(self.relpaths))
+
+    def test_unchanged_skipped(self):
+        """
+        Tests that a file whose size and modification time are unchanged is skipped without being
+        read, even if its content changed, and that a new file is uploaded.
+        """
+        self.upload()
+        path = os.path.join(self.folder, self.relpaths[0])
+        st = os.stat(path)
+        with open(path, "w") as fh:
+            fh.write("FILE 0")
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.write("new.txt", "new")
+        self.assertEqual(self.upload(), ["new.txt"])
+        self.assertEqual(self.backend.read_range("runs/Folder/" + self.relpaths[0].replace(os.sep, "/")),
+                         b"file 0")
+
+    def test_touched_skipped(self):
+        """
+        Tests that a file that was only touched is skipped since its CRC32C checksum is unchanged,
+        and that its new modification time is recorded, while a changed file is uploaded.
+        """
+        self.upload()
+        touched = os.path.join(self.folder, self.relpaths[0])
+        mtime = os.stat(touched).st_mtime + 10
+        os.utime(touched, (mtime, mtime))
+        self.write(self.relpaths[1], "file one")
+        self.assertEqual(self.upload(), [self.relpaths[1]])
+        self.assertEqual(self.read_manifest()["files"][self.relpaths[0]]["mtime"], mtime)
+
+    def test_location_change(self):
+        """
+        Tests that the manifest doesn't apply once the bucket path or the bucket changes, so that
+        everything is uploaded again.
+        """
+        self.upload()
+        self.assertEqual(sorted(self.upload(bucket_path="other")), sorted(self.relpaths))
+        self.assertEqual(self.read_manifest()["bucket_path"], "other/Folder")
+        other = CountingBackend(self.root, name="other_bucket")
+        self.assertEqual(sorted(self.upload(backend=other, bucket_path="other")), sorted(self.relpaths))
+        self.assertEqual(self.read_manifest()["bucket"], "other_bucket")
+        self.assertEqual(self.upload(backend=other, bucket_path="other"), [])
+
+    def test_deleted_dropped(self):
+        """
+        Tests that the manifest entry of a file that was removed from the folder is dropped.
+        """
+        self.upload()
+        os.remove(os.path.join(self.folder, self.relpaths[0]))
+        self.assertEqual(self.upload(), [])
+        self.assertEqual(sorted(self.read_manifest()["files"]), sorted(self.relpaths[1:]))
+
+
+class TestSlicedDownload(unittest.TestCase):
+    """
+    Tests the ``sruns_monitor.gcstorage_utils.sliced_download`` function against a
+    ``sruns_monitor.storage_backends.LocalBackend``.
+    """
+
+    def setUp(self):
+        self.root = os.path.join(TMP_DIR, "LocalBucket")
+        self.source_file = os.path.join(TMP_DIR, "local_backend_source")
+        with open(self.source_file, "wb") as fh:
+            fh.write(os.urandom(100000))
+        self.filename = os.path.join(TMP_DIR, "sliced_download")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        os.remove(self.source_file)
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def upload(self, backend):
+        utils.upload_to_gcp(bucket=backend, blob_name="obj", source_file=self.source_file)
+        return backend.stat("obj")
+
+    def test_reassembly(self):
+        """
+        Tests that an object downloaded in many slices, of which the first one completes after later
+        ones, is reassembled in order, and that every slice is read from the same generation.
+        """
+        backend = SlowStartBackend(self.root, slow_reads=1)
+        info = self.upload(backend)
+        gcstorage_utils.sliced_download(bucket=backend, object_path="obj", filename=self.filename,
+                                        slice_size=1000, workers=4)
+        with open(self.filename, "rb") as fh, open(self.source_file, "rb") as src:
+            self.assertEqual(fh.read(), src.read())
+        self.assertEqual(len(backend.reads), 100)
+        self.assertNotEqual(backend.reads[0][0], 0)
+        self.assertEqual(sorted(i[:2] for i in backend.reads),
+                         [(offset, offset + length) for offset, length in utils.get_byte_ranges(size=100000, part_size=1000)])
+        self.assertEqual(set(i[2] for i in backend.reads), set([info.generation]))
+
+    def test_checksum_mismatch(self):
+        """
+        Tests that ``sruns_monitor.exceptions.ChecksumMismatch`` is raised if a slice doesn't have
+        the object's data, and that the partial file is removed.
+        """
+        backend = SlowStartBackend(self.root, corrupt_offset=5000)
+        self.upload(backend)
+        with self.assertRaises(srm_exceptions.ChecksumMismatch):
+            gcstorage_utils.sliced_download(bucket=backend, object_path="obj", filename=self.filename,
+                                            slice_size=1000, workers=4)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_empty_object(self):
+        """
+        Tests that a zero-byte object is downloaded to an empty file, without preallocating it.
+        """
+        open(self.source_file, "wb").close()
+        backend = SlowStartBackend(self.root)
+        info = self.upload(backend)
+        self.assertEqual(info.size, 0)
+        gcstorage_utils.sliced_download(bucket=backend, object_path="obj", filename=self.filename,
+                                        slice_size=1000, workers=4)
+        self.assertEqual(os.path.getsize(self.filename), 0)
+        self.assertEqual(backend.reads, [])
+
+
+class NoContentHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Responds to every PUT request with a 204 status, which isn't an error, but isn't a status that
+    GCP Storage responds to requests of a resumable upload session with either.
+    """
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestUnexpectedStatus(unittest.TestCase):
+    """
+    Tests that the requests of a resumable upload session that ``sruns_monitor.storage_backends.GCSBackend``
+    makes raise an error for a status they don't expect, rather than returning no offset.
+    """
+
+    def setUp(self):
+        self.server = http.server.HTTPServer(("127.0.0.1", 0), NoContentHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.session_url = "http://127.0.0.1:{}/upload".format(self.server.server_port)
+        self.backend = storage_backends.GCSBackend(storage.Bucket(client=None, name="bucket"))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_upload_chunk(self):
+        """
+        Tests that sending a chunk raises ``requests.HTTPError`` for a 204 status.
+        """
+        with self.assertRaisesRegex(requests.HTTPError, "Unexpected status 204"):
+            self.backend.upload_chunk(self.session_url, b"data", offset=0, size=4)
+
+    def test_query_resumable_upload(self):
+        """
+        Tests that querying a session raises ``requests.HTTPError`` for a 204 status, rather than
+        reporting that the session expired.
+        """
+        with self.assertRaisesRegex(requests.HTTPError, "Unexpected status 204"):
+            self.backend.query_resumable_upload(self.session_url, size=4)
+
+
+if __name__ == "__main__":
+    unittest.main()
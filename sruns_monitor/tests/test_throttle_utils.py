@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###
+# Nathaniel Watson
+# nathanielwatson@stanfordhealthcare.org
+###
+
+"""
+Tests functions in the ``sruns_monitor.throttle_utils`` module.
+"""
+
+import datetime
+import multiprocessing
+import time
+import unittest
+
+from sruns_monitor import throttle_utils
+
+
+class TestTokenBucket(unittest.TestCase):
+    """
+    Tests the ``sruns_monitor.throttle_utils.TokenBucket`` class.
+    """
+
+    def test_get_rate_schedule(self):
+        """
+        Tests that a time-of-day window overrides the default rate while it applies.
+        """
+        bucket = throttle_utils.TokenBucket(rate=100, schedule=[(8 * 60, 18 * 60, 10)])
+        self.assertEqual(bucket.get_rate(datetime.datetime(2020, 1, 1, 12, 0)), 10)
+        self.assertEqual(bucket.get_rate(datetime.datetime(2020, 1, 1, 18, 0)), 100)
+
+    def test_get_rate_schedule_midnight(self):
+        """
+        Tests that a time-of-day window whose end is before its start spans midnight.
+        """
+        bucket = throttle_utils.TokenBucket(schedule=[(22 * 60, 6 * 60, 10)])
+        self.assertEqual(bucket.get_rate(datetime.datetime(2020, 1, 1, 23, 0)), 10)
+        self.assertEqual(bucket.get_rate(datetime.datetime(2020, 1, 1, 5, 59)), 10)
+        self.assertEqual(bucket.get_rate(datetime.datetime(2020, 1, 1, 12, 0)), None)
+
+    def test_consume_unlimited(self):
+        """
+        Tests that consuming from a bucket without a rate limit doesn't wait.
+        """
+        self.assertEqual(throttle_utils.TokenBucket().consume(10 ** 9), 0)
+
+    def test_consume_shared_across_processes(self):
+        """
+        Tests that processes forked from the one that created a bucket draw from the same bucket,
+        such that their combined rate is kept within the limit.
+        """
+        rate = 100000
+        bucket = throttle_utils.TokenBucket(rate=rate)
+        ctx = multiprocessing.get_context("fork")
+        processes = [ctx.Process(target=bucket.consume, args=(rate // 10,)) for i in range(3)]
+        start = time.time()
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        # The bucket starts out empty, so 0.3 seconds' worth of tokens take 0.3 seconds.
+        self.assertGreaterEqual(time.time() - start, 0.29)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,6 +12,7 @@ Tests functions in the ``sruns_monitor.utils`` module.
 """
 
 import hashlib
+import io
 import json
 import multiprocessing
 import os
@@ -19,6 +20,7 @@ import psutil
 import shutil
 import tarfile
 import time
+import types
 import unittest
 
 from sruns_monitor.tests import WATCH_DIRS, TMP_DIR
@@ -55,6 +57,338 @@ class TestUtils(unittest.TestCase):
         os.remove(output_file)
         self.assertEqual(file_list, expected_file_list)
 
+    def test_tar_fileobj(self):
+        """
+        Tests that `utils.tar()`, when given a file object, writes a tar stream to it that
+        contains all of the files in the run directory.
+        """
+        fileobj = io.BytesIO()
+        utils.tar(input_dir=self.test_rundir, tarball_name=None, fileobj=fileobj)
+        fileobj.seek(0)
+        t = tarfile.open(fileobj=fileobj)
+        file_list = t.getnames()
+        expected_file_list = [
+            "CompletedRun1",
+            "CompletedRun1/CopyComplete.txt"
+        ]
+        self.assertEqual(file_list, expected_file_list)
+
+    def test_tar_resumable_identical(self):
+        """
+        Tests that `utils.tar_resumable()` creates a tarball that is byte-identical to the one
+        `utils.tar()` creates.
+        """
+        tarball1 = os.path.join(TMP_DIR, "tar.tar")
+        tarball2 = os.path.join(TMP_DIR, "tar_resumable.tar")
+        utils.tar(input_dir=WATCH_DIRS[1], tarball_name=tarball1)
+        utils.tar_resumable(input_dir=WATCH_DIRS[1], tarball_name=tarball2)
+        with open(tarball1, "rb") as fh1, open(tarball2, "rb") as fh2:
+            identical = fh1.read() == fh2.read()
+        os.remove(tarball1)
+        os.remove(tarball2)
+        self.assertTrue(identical)
+
+    def test_tar_resumable_resume(self):
+        """
+        Tests that resuming `utils.tar_resumable()` from a checkpoint, after garbage was written
+        past the checkpoint's offset, creates the same tarball as an uninterrupted run.
+        """
+        tarball1 = os.path.join(TMP_DIR, "tar.tar")
+        tarball2 = os.path.join(TMP_DIR, "tar_resumable.tar")
+        utils.tar(input_dir=WATCH_DIRS[1], tarball_name=tarball1)
+        checkpoints = []
+        checkpoint = lambda members, offset: checkpoints.append((members, offset))
+        utils.tar_resumable(input_dir=WATCH_DIRS[1], tarball_name=tarball2, checkpoint=checkpoint, checkpoint_bytes=1)
+        members, offset = checkpoints[2]
+        # Simulate an interruption part way through the next member.
+        with open(tarball2, "r+b") as fh:
+            fh.truncate(offset)
+            fh.seek(offset)
+            fh.write(b"partial member")
+        utils.tar_resumable(input_dir=WATCH_DIRS[1], tarball_name=tarball2, members=members, offset=offset)
+        with open(tarball1, "rb") as fh1, open(tarball2, "rb") as fh2:
+            identical = fh1.read() == fh2.read()
+        os.remove(tarball1)
+        os.remove(tarball2)
+        self.assertTrue(identical)
+
+    def test_tar_checksums(self):
+        """
+        Tests that the checksums returned by `utils.tar()` for a compressed tarball match those
+        computed on the file afterwards.
+        """
+        tarball = os.path.join(TMP_DIR, "tar_checksums.tar.gz")
+        checksums = utils.tar(input_dir=WATCH_DIRS[1], tarball_name=tarball, compress=True)
+        writer = utils.ChecksumWriter(io.BytesIO())
+        with open(tarball, "rb") as fh:
+            writer.write(fh.read())
+        os.remove(tarball)
+        self.assertEqual(checksums, writer.checksums())
+
+    def test_tar_resumable_checksums(self):
+        """
+        Tests that the checksums returned by a resumed `utils.tar_resumable()` cover the whole
+        tarball, including the part written before the checkpoint, and match those of `utils.tar()`.
+        """
+        tarball1 = os.path.join(TMP_DIR, "tar.tar")
+        tarball2 = os.path.join(TMP_DIR, "tar_resumable.tar")
+        checksums = utils.tar(input_dir=WATCH_DIRS[1], tarball_name=tarball1)
+        checkpoints = []
+        checkpoint = lambda members, offset: checkpoints.append((members, offset))
+        utils.tar_resumable(input_dir=WATCH_DIRS[1], tarball_name=tarball2, checkpoint=checkpoint, checkpoint_bytes=1)
+        members, offset = checkpoints[2]
+        resumed_checksums = utils.tar_resumable(input_dir=WATCH_DIRS[1], tarball_name=tarball2, members=members, offset=offset)
+        os.remove(tarball1)
+        os.remove(tarball2)
+        self.assertEqual(checksums, resumed_checksums)
+
+    def test_tar_prefetch_identical(self):
+        """
+        Tests that `utils.tar()` creates the same tar stream as `tarfile.TarFile.add`, with and
+        without reading ahead, for a directory with a hard link, a symbolic link and files larger
+        than the read size, and with paths included and excluded.
+        """
+        rundir = os.path.join(TMP_DIR, "PrefetchRun")
+        os.makedirs(os.path.join(rundir, "Data", "L001"))
+        os.makedirs(os.path.join(rundir, "Logs"))
+        for i in range(40):
+            with open(os.path.join(rundir, "Data", "L001", "s_{}.bcl".format(i)), "wb") as fh:
+                fh.write(os.urandom(i * 1000))
+        with open(os.path.join(rundir, "Data", "big.bin"), "wb") as fh:
+            fh.write(os.urandom(3 * utils.TAR_READ_SIZE + 5))
+        os.link(os.path.join(rundir, "Data", "big.bin"), os.path.join(rundir, "Data", "big_link.bin"))
+        os.symlink("Data", os.path.join(rundir, "DataLink"))
+        with open(os.path.join(rundir, "Logs", "log.txt"), "wb") as fh:
+            fh.write(b"log")
+        for include, exclude in [(None, None), (["Data"], ["Data/L001"])]:
+            expected = io.BytesIO()
+            with tarfile.open(fileobj=expected, mode="w|") as tb:
+                names = [""] if include is None else include
+                exclude_names = [os.path.join("PrefetchRun", i) for i in exclude or []]
+                for name in names:
+                    tb.add(os.path.join(rundir, name), arcname=os.path.join("PrefetchRun", name).rstrip("/"),
+                           filter=lambda tarinfo: None if tarinfo.name in exclude_names else tarinfo)
+            for prefetch in [0, 4]:
+                fileobj = io.BytesIO()
+                utils.tar(input_dir=rundir, tarball_name=None, fileobj=fileobj, include=include,
+                          exclude=exclude, prefetch=prefetch)
+                self.assertEqual(fileobj.getvalue(), expected.getvalue())
+        shutil.rmtree(rundir)
+
+    def test_tar_prefetcher_close(self):
+        """
+        Tests that `utils.TarPrefetcher` closes the files it read ahead that weren't consumed.
+        """
+        rundir = os.path.join(WATCH_DIRS[1], "TEST_RUN_DIR")
+        entries = list(utils.iter_tar_paths(rundir, "TEST_RUN_DIR"))
+        with utils.TarPrefetcher(entries, files=2) as prefetcher:
+            path, arcname, fh = next(iter(prefetcher))
+            self.assertEqual((path, arcname, fh), (rundir, "TEST_RUN_DIR", None))
+            pending = [future.result() for path, arcname, future in prefetcher.pending]
+        opened = [i for i in pending if i]
+        self.assertTrue(opened)
+        self.assertTrue(all([i.closed for i in opened]))
+
+    def test_get_file_crc32c(self):
+        """
+        Tests that `utils.get_file_crc32c()` gives the same checksum as a `utils.ChecksumWriter`.
+        """
+        filename = os.path.join(WATCH_DIRS[1], "TEST_RUN_DIR", "BaseCalls", "data.txt")
+        writer = utils.ChecksumWriter(io.BytesIO())
+        with open(filename, "rb") as fh:
+            writer.write(fh.read())
+        self.assertEqual(utils.get_file_crc32c(filename), writer.checksums()["crc32c"])
+
+    def test_blob_matches_file(self):
+        """
+        Tests that `utils.blob_matches_file()` compares an object's size and CRC32C checksum from its
+        metadata with those of the local file.
+        """
+        filename = os.path.join(WATCH_DIRS[1], "TEST_RUN_DIR", "BaseCalls", "data.txt")
+        blob = types.SimpleNamespace(size=os.path.getsize(filename), crc32c=utils.get_file_crc32c(filename),
+                                     md5_hash=None, generation=1)
+        bucket = types.SimpleNamespace(name="bucket", get_blob=lambda blob_name: blob)
+        missing_bucket = types.SimpleNamespace(name="bucket", get_blob=lambda blob_name: None)
+        self.assertTrue(utils.blob_matches_file(bucket=bucket, blob_name="data.txt", source_file=filename))
+        self.assertFalse(utils.blob_matches_file(bucket=bucket, blob_name="data.txt", source_file=filename,
+                                                 crc32c="AAAAAA=="))
+        self.assertFalse(utils.blob_matches_file(bucket=missing_bucket, blob_name="data.txt", source_file=filename))
+
+    def test_tar_index(self):
+        """
+        Tests that the tar member index written by `utils.tar()` gives the location of each regular
+        file's data in the tarball.
+        """
+        tarball = os.path.join(TMP_DIR, "tar_index.tar")
+        index_file = tarball + utils.TAR_INDEX_SUFFIX
+        utils.tar(input_dir=WATCH_DIRS[1], tarball_name=tarball, index_file=index_file)
+        with open(index_file) as fh:
+            index = json.load(fh)
+        with tarfile.open(tarball) as t:
+            expected = {}
+            for tarinfo in t.getmembers():
+                if tarinfo.isreg():
+                    expected[tarinfo.name] = t.extractfile(tarinfo).read()
+        with open(tarball, "rb") as fh:
+            data = fh.read()
+        os.remove(tarball)
+        os.remove(index_file)
+        start, end = utils.get_tar_span(index, list(expected))
+        self.assertEqual(utils.read_tar_members(index, data[start:end], list(expected)), expected)
+
+    def test_tar_resumable_index(self):
+        """
+        Tests that a resumed `utils.tar_resumable()` writes the same tar member index as `utils.tar()`,
+        including the members that were written before the checkpoint.
+        """
+        tarball1 = os.path.join(TMP_DIR, "tar.tar")
+        tarball2 = os.path.join(TMP_DIR, "tar_resumable.tar")
+        index_file1 = tarball1 + utils.TAR_INDEX_SUFFIX
+        index_file2 = tarball2 + utils.TAR_INDEX_SUFFIX
+        utils.tar(input_dir=WATCH_DIRS[1], tarball_name=tarball1, index_file=index_file1)
+        checkpoints = []
+        checkpoint = lambda members, offset: checkpoints.append((members, offset))
+        utils.tar_resumable(input_dir=WATCH_DIRS[1], tarball_name=tarball2, checkpoint=checkpoint, checkpoint_bytes=1)
+        members, offset = checkpoints[2]
+        utils.tar_resumable(input_dir=WATCH_DIRS[1], tarball_name=tarball2, members=members, offset=offset,
+                            index_file=index_file2)
+        with open(index_file1) as fh1, open(index_file2) as fh2:
+            index1 = json.load(fh1)
+            index2 = json.load(fh2)
+        for i in [tarball1, tarball2, index_file1, index_file2]:
+            os.remove(i)
+        self.assertEqual(index1, index2)
+
+    def test_select_tar_members(self):
+        """
+        Tests that `utils.select_tar_members()` selects the named members and the members beneath
+        the named directories, but not members whose names merely start with the same characters.
+        """
+        index = {"compression": None, "members": {
+            "Run/RunInfo.xml": [512, 10],
+            "Run/L001/a.bcl": [1536, 10],
+            "Run/L0010/b.bcl": [2560, 10],
+            "Run/L001/c.bcl": [1024, 10]
+        }}
+        names = utils.select_tar_members(index, ["Run/RunInfo.xml", "Run/L001"])
+        self.assertEqual(names, ["Run/RunInfo.xml", "Run/L001/c.bcl", "Run/L001/a.bcl"])
+
+    def test_group_tar_members(self):
+        """
+        Tests that `utils.group_tar_members()` groups members that are close together and starts a
+        new group at a large gap.
+        """
+        index = {"compression": None, "members": {
+            "a": [512, 100],
+            "b": [1024, 100],
+            "c": [10000, 100]
+        }}
+        groups = utils.group_tar_members(index, ["c", "a", "b"], max_gap=1000)
+        self.assertEqual(groups, [["a", "b"], ["c"]])
+
+    def test_partition_rundir_by_lane(self):
+        """
+        Tests that `utils.partition_rundir()` creates a shard per lane, plus a shard for the rest
+        of the run directory that excludes the lane directories.
+        """
+        rundir = os.path.join(TMP_DIR, "ShardRun")
+        for path in ["Data/Intensities/BaseCalls/L001", "Data/Intensities/BaseCalls/L002", "Data/Intensities/L001"]:
+            os.makedirs(os.path.join(rundir, path))
+        shards = utils.partition_rundir(input_dir=rundir, shard_by=utils.SHARD_BY_LANE)
+        shutil.rmtree(rundir)
+        expected = [
+            ("L001", ["Data/Intensities/BaseCalls/L001", "Data/Intensities/L001"], []),
+            ("L002", ["Data/Intensities/BaseCalls/L002"], []),
+            (utils.SHARD_REST, None, ["Data/Intensities/BaseCalls/L001", "Data/Intensities/L001", "Data/Intensities/BaseCalls/L002"])
+        ]
+        self.assertEqual(shards, expected)
+
+    def test_tar_shards_cover_rundir(self):
+        """
+        Tests that tarring each shard from `utils.partition_rundir()` with `utils.tar()` includes
+        each file of the run directory in exactly one shard.
+        """
+        rundir = os.path.join(TMP_DIR, "ShardRun")
+        for path in ["Data/Intensities/BaseCalls/L001", "InterOp"]:
+            os.makedirs(os.path.join(rundir, path))
+        for path in ["RunInfo.xml", "Data/Intensities/BaseCalls/L001/s_1.bcl", "InterOp/metrics.bin"]:
+            open(os.path.join(rundir, path), "w").close()
+        members = []
+        for shard_name, include, exclude in utils.partition_rundir(input_dir=rundir, shard_by=utils.SHARD_BY_TOP_LEVEL):
+            fileobj = io.BytesIO()
+            utils.tar(input_dir=rundir, tarball_name=shard_name, fileobj=fileobj, include=include, exclude=exclude)
+            fileobj.seek(0)
+            members.extend([i.name for i in tarfile.open(fileobj=fileobj) if i.isfile()])
+        shutil.rmtree(rundir)
+        expected = ["ShardRun/Data/Intensities/BaseCalls/L001/s_1.bcl", "ShardRun/InterOp/metrics.bin", "ShardRun/RunInfo.xml"]
+        self.assertEqual(sorted(members), expected)
+
+    def test_get_completed_cycle_dirs(self):
+        """
+        Tests that `utils.get_completed_cycle_dirs()` returns all but the latest cycle directory of
+        each lane, ordered by cycle number rather than by name.
+        """
+        rundir = os.path.join(TMP_DIR, "InProgressRun")
+        for path in ["L001/C1.1", "L001/C2.1", "L001/C10.1", "L002/C1.1"]:
+            os.makedirs(os.path.join(rundir, "Data", "Intensities", "BaseCalls", path))
+        cycle_dirs = utils.get_completed_cycle_dirs(input_dir=rundir, settle_seconds=0)
+        shutil.rmtree(rundir)
+        expected = [
+            "Data/Intensities/BaseCalls/L001/C1.1",
+            "Data/Intensities/BaseCalls/L001/C2.1"
+        ]
+        self.assertEqual(cycle_dirs, expected)
+
+    def test_get_completed_cycle_dirs_settle(self):
+        """
+        Tests that `utils.get_completed_cycle_dirs()` doesn't return cycle directories that were
+        modified more recently than the settle time.
+        """
+        rundir = os.path.join(TMP_DIR, "InProgressRun")
+        for path in ["L001/C1.1", "L001/C2.1"]:
+            os.makedirs(os.path.join(rundir, "Data", "Intensities", "BaseCalls", path))
+        cycle_dirs = utils.get_completed_cycle_dirs(input_dir=rundir, settle_seconds=60)
+        shutil.rmtree(rundir)
+        self.assertEqual(cycle_dirs, [])
+
+    def test_get_dir_size(self):
+        """
+        Tests that `utils.get_dir_size()` adds up the sizes of the files in nested directories, and
+        doesn't follow symlinks.
+        """
+        rundir = os.path.join(TMP_DIR, "SizedRun")
+        os.makedirs(os.path.join(rundir, "Data", "L001"))
+        with open(os.path.join(rundir, "RunInfo.xml"), "wb") as fh:
+            fh.write(b"x" * 100)
+        with open(os.path.join(rundir, "Data", "L001", "s_1.bcl"), "wb") as fh:
+            fh.write(b"x" * 5000)
+        os.symlink(os.path.join(rundir, "Data"), os.path.join(rundir, "DataLink"))
+        size = utils.get_dir_size(rundir)
+        shutil.rmtree(rundir)
+        self.assertEqual(size, 5100)
+
+    def test_get_committed_offset(self):
+        """
+        Tests that `utils.get_committed_offset()` returns the offset just after the last committed
+        byte in a resumable upload session's Range header.
+        """
+        self.assertEqual(utils.get_committed_offset("bytes=0-262143"), 262144)
+
+    def test_get_committed_offset_none(self):
+        """
+        Tests that `utils.get_committed_offset()` returns 0 when there isn't a Range header, which
+        means that no bytes have been committed.
+        """
+        self.assertEqual(utils.get_committed_offset(None), 0)
+
+    def test_get_byte_ranges(self):
+        """
+        Tests that `utils.get_byte_ranges()` covers the whole file with consecutive ranges, with a
+        shorter last range when the size isn't a multiple of the part size.
+        """
+        ranges = utils.get_byte_ranges(size=25, part_size=10)
+        self.assertEqual(ranges, [(0, 10), (10, 10), (20, 5)])
+
     def test_running_too_long(self):
         """
         Tests that the method `monitor.Monitor.running_too_long` returns True when a child task
@@ -85,6 +419,36 @@ class TestUtils(unittest.TestCase):
         time.sleep(1)
         self.assertFalse(utils.running_too_long(process=psutil.Process(p.pid), limit_seconds=5))
 
+    def test_run_in_daemon_thread(self):
+        """
+        Tests that `utils.run_in_daemon_thread()` returns a future for the function's return value,
+        or for the exception it raised.
+        """
+        self.assertEqual(utils.run_in_daemon_thread(max, 1, 2).result(timeout=5), 2)
+        future = utils.run_in_daemon_thread(os.listdir, os.path.join(TMP_DIR, "missing"))
+        self.assertIsInstance(future.exception(timeout=5), FileNotFoundError)
+
+    def test_daemon_thread_executor(self):
+        """
+        Tests that `utils.DaemonThreadExecutor` runs the calls submitted to it in order, and that a
+        child process forked from its thread exits with code 0.
+        """
+        def fork_child():
+            p = multiprocessing.Process(target=time.sleep, args=(0,))
+            p.start()
+            p.join()
+            return p.exitcode
+
+        executor = utils.DaemonThreadExecutor()
+        calls = []
+        futures = [executor.submit(calls.append, i) for i in range(5)]
+        self.assertEqual(executor.submit(fork_child).result(timeout=10), 0)
+        executor.shutdown()
+        self.assertEqual(calls, list(range(5)))
+        self.assertTrue(all(i.done() for i in futures))
+        with self.assertRaises(RuntimeError):
+            executor.submit(calls.append, 5)
+
     def test_delete_directory_if_too_old_1(self):
         """
         Creates a directory, waits 2 seconds, and tests that `utils.delete_directory_if_too_old`
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###
+# Nathaniel Watson
+# nathanielwatson@stanfordhealthcare.org
+###
+
+"""
+Tests the ``sruns_monitor.watch_utils.RunWatcher`` class.
+"""
+
+import os
+import shutil
+import unittest
+
+from sruns_monitor.tests import TMP_DIR
+from sruns_monitor import watch_utils
+
+
+SENTINAL_FILES = set(["CopyComplete.txt"])
+
+
+class TestRunWatcher(unittest.TestCase):
+    """
+    Tests the ``sruns_monitor.watch_utils.RunWatcher`` class, both with inotify and when scanning.
+    """
+
+    def setUp(self):
+        self.watchdir = os.path.join(TMP_DIR, "WatchedRuns")
+        os.makedirs(self.watchdir)
+        self.watchers = []
+
+    def tearDown(self):
+        for watcher in self.watchers:
+            watcher.close()
+        shutil.rmtree(self.watchdir)
+
+    def get_watcher(self, use_inotify=True):
+        watcher = watch_utils.RunWatcher(watchdirs=[self.watchdir], sentinal_files=SENTINAL_FILES,
+                                         use_inotify=use_inotify)
+        self.watchers.append(watcher)
+        return watcher
+
+    def make_run(self, run_name, finished=False):
+        run_path = os.path.join(self.watchdir, run_name)
+        os.makedirs(run_path)
+        if finished:
+            self.finish_run(run_path)
+        return run_path
+
+    def finish_run(self, run_path):
+        open(os.path.join(run_path, "CopyComplete.txt"), "w").close()
+
+    def test_existing_runs(self):
+        """
+        Tests that the runs that are already finished are found by the first poll.
+        """
+        finished = self.make_run("run1", finished=True)
+        self.make_run("run2")
+        watcher = self.get_watcher()
+        self.assertEqual(watcher.poll(), [finished])
+
+    def test_sentinal_file_event(self):
+        """
+        Tests that a run is found once its sentinal file appears, both in a run directory that was
+        there before the watcher started and in one that was created afterwards, without a
+        reconciliation scan in-between.
+        """
+        old_run = self.make_run("run1")
+        watcher = self.get_watcher()
+        if watcher.polled_watchdirs:
+            self.skipTest("inotify isn't available for {}".format(self.watchdir))
+        self.assertEqual(watcher.poll(), [])
+        new_run = self.make_run("run2")
+        self.assertEqual(watcher.poll(), [])
+        self.finish_run(old_run)
+        self.finish_run(new_run)
+        watcher.reconcile = None # Fails the test if a reconciliation scan is attempted.
+        self.assertEqual(watcher.poll(), [old_run, new_run])
+
+    def test_run_moved_away(self):
+        """
+        Tests that a finished run that is moved out of the watch directory, as happens once it's
+        processed, isn't returned anymore.
+        """
+        run_path = self.make_run("run1", finished=True)
+        watcher = self.get_watcher()
+        self.assertEqual(watcher.poll(), [run_path])
+        shutil.move(run_path, os.path.join(TMP_DIR, "MovedRun"))
+        shutil.rmtree(os.path.join(TMP_DIR, "MovedRun"))
+        self.assertEqual(watcher.poll(), [])
+
+    def test_scanning(self):
+        """
+        Tests that, without inotify, the watch directory is reconciled on every poll, and that run
+        directories that are known to be finished aren't listed again.
+        """
+        finished = self.make_run("run1", finished=True)
+        watcher = self.get_watcher(use_inotify=False)
+        self.assertEqual(watcher.polled_watchdirs, set([self.watchdir]))
+        self.assertEqual(watcher.poll(), [finished])
+        new_run = self.make_run("run2", finished=True)
+        listed = []
+        check_rundir = watcher.check_rundir
+        def spy(run_path, watch=False):
+            listed.append(run_path)
+            check_rundir(run_path, watch)
+        watcher.check_rundir = spy
+        self.assertEqual(watcher.poll(), [finished, new_run])
+        self.assertEqual(listed, [new_run])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###
+# Nathaniel Watson
+# nathanielwatson@stanfordhealthcare.org
+###
+
+"""
+Tests the ``sruns_monitor.worker_pool.WorkerPool`` class.
+"""
+
+import os
+import shutil
+import time
+import unittest
+
+from sruns_monitor.tests import TMP_DIR
+from sruns_monitor import worker_pool
+
+
+LOG_DIR = os.path.join(TMP_DIR, "WorkerPool")
+
+
+def init_worker():
+    open(os.path.join(LOG_DIR, "init.{}".format(os.getpid())), "w").close()
+
+
+def run_job(name, fail=False, sleep=0):
+    time.sleep(sleep)
+    with open(os.path.join(LOG_DIR, "job.{}".format(name)), "w") as fh:
+        fh.write(str(os.getpid()))
+    if fail:
+        raise ValueError(name)
+
+
+class TestWorkerPool(unittest.TestCase):
+    """
+    Tests the ``sruns_monitor.worker_pool.WorkerPool`` class.
+    """
+
+    def setUp(self):
+        os.makedirs(LOG_DIR)
+        self.pool = worker_pool.WorkerPool(size=2, initializer=init_worker, handler=run_job)
+        self.pool.maintain()
+
+    def tearDown(self):
+        self.pool.close()
+        for process in self.pool.workers.values():
+            process.join(timeout=10)
+        shutil.rmtree(LOG_DIR)
+
+    def get_result(self):
+        result = self.pool.get_result(timeout=10)
+        self.pool.job_done(result[0])
+        return result
+
+    def read_job_pid(self, name):
+        with open(os.path.join(LOG_DIR, "job.{}".format(name))) as fh:
+            return int(fh.read())
+
+    def test_jobs(self):
+        """
+        Tests that jobs run in the worker that they're submitted to, which is initialized only once,
+        and that a job that raises an Exception has an exit code of 1 without ending the worker.
+        """
+        pid = self.pool.get_idle_worker()
+        self.pool.submit(pid, "job1")
+        self.assertEqual(self.get_result(), (pid, 0))
+        self.pool.submit(pid, "job2", True)
+        self.assertEqual(self.get_result(), (pid, 1))
+        self.pool.submit(pid, "job3")
+        self.assertEqual(self.get_result(), (pid, 0))
+        self.assertEqual([self.read_job_pid(i) for i in ("job1", "job2", "job3")], [pid] * 3)
+        self.assertEqual(sorted(os.listdir(LOG_DIR)).count("init.{}".format(pid)), 1)
+        self.assertEqual(self.pool.idle, set(self.pool.workers))
+
+    def test_busy_workers(self):
+        """
+        Tests that a worker isn't idle while it runs a job, and that there is no idle worker once all
+        of them are busy.
+        """
+        first = self.pool.get_idle_worker()
+        self.pool.submit(first, "job1", False, 1)
+        second = self.pool.get_idle_worker()
+        self.assertNotEqual(first, second)
+        self.pool.submit(second, "job2", False, 1)
+        self.assertIsNone(self.pool.get_idle_worker())
+        self.assertEqual(set([self.get_result(), self.get_result()]), set([(first, 0), (second, 0)]))
+        self.assertEqual(self.pool.idle, set([first, second]))
+
+    def test_maintain(self):
+        """
+        Tests that a worker that dies is replaced.
+        """
+        pid = self.pool.get_idle_worker()
+        self.pool.workers[pid].kill()
+        self.pool.workers[pid].join()
+        self.assertEqual(self.pool.maintain(), [pid])
+        self.assertEqual(len(self.pool.workers), 2)
+        self.assertNotIn(pid, self.pool.workers)
+        self.assertEqual(self.pool.idle, set(self.pool.workers))
+
+
+if __name__ == "__main__":
+    unittest.main()
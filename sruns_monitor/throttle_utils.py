@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""
+A bandwidth governor that is shared by all of the monitor's child processes, so that runs that
+finish together don't saturate the network link and starve the sequencers' own copy traffic.
+
+The governor is a token bucket whose state lives in shared memory. It's installed in the main
+process with `install` before any child processes are forked, and each child process inherits it.
+Code that moves data, i.e. reads from the run directory while tarring or writes to GCP Storage while
+uploading, calls `throttle` with the number of bytes moved, which blocks for as long as needed to
+keep the combined rate of all processes within the limit. Since this relies on inheritance, child
+processes must be started with the 'fork' start method.
+"""
+
+import datetime
+import logging
+import multiprocessing
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+#: The number of seconds' worth of tokens that a bucket can accumulate while idle, which is how big
+#: a burst can be.
+BURST_SECONDS = 1
+
+#: How often, in seconds, each process logs its throughput.
+LOG_INTERVAL_SECONDS = 60
+
+# The governor installed by `install`, if any.
+_governor = None
+
+
+def parse_time_of_day(value):
+    """
+    Args:
+        value: `str`. A time of day formatted as 'HH:MM'.
+
+    Returns:
+        `int`. The number of minutes since midnight.
+    """
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter whose state is shared by all processes forked after it's created.
+
+    Tokens are bytes. Rather than waiting for enough tokens to accumulate, `consume` takes the tokens
+    right away and lets the bucket go into debt, then sleeps for as long as the debt takes to pay
+    off. Since each caller's debt includes that of the callers before it, concurrent callers are
+    served in the order that they arrived.
+    """
+
+    def __init__(self, rate=None, schedule=None):
+        """
+        Args:
+            rate: `int`. The rate limit in bytes per second. None means no limit.
+            schedule: `list` of (start, end, rate) three-item tuples, where start and end are times
+                of day in minutes since midnight. Between start and end, the given rate applies
+                instead of `rate`. A window whose end is before its start spans midnight. The first
+                window that applies wins.
+        """
+        self.rate = rate
+        self.schedule = schedule or []
+        self.lock = multiprocessing.Lock()
+        # Shared memory, so that all processes draw from the same bucket.
+        self.tokens = multiprocessing.Value("d", 0.0, lock=False)
+        self.last_refill = multiprocessing.Value("d", time.time(), lock=False)
+
+    def get_rate(self, now=None):
+        """
+        Args:
+            now: `datetime.datetime`. Defaults to the current local time.
+
+        Returns:
+            `int`. The rate limit in bytes per second that applies at `now`, or None if there is
+            no limit.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.schedule:
+            if start <= end:
+                if start <= minute < end:
+                    return rate
+            elif minute >= start or minute < end:
+                return rate
+        return self.rate
+
+    def consume(self, nbytes):
+        """
+        Takes `nbytes` tokens from the bucket, sleeping if need be so that the rate limit is kept.
+
+        Args:
+            nbytes: `int`. The number of bytes about to be, or just, moved.
+
+        Returns:
+            `float`. The number of seconds slept.
+        """
+        rate = self.get_rate()
+        if not rate:
+            return 0
+        with self.lock:
+            now = time.time()
+            tokens = self.tokens.value + (now - self.last_refill.value) * rate
+            tokens = min(tokens, rate * BURST_SECONDS) - nbytes
+            self.tokens.value = tokens
+            self.last_refill.value = now
+        if tokens >= 0:
+            return 0
+        wait = -tokens / rate
+        time.sleep(wait)
+        return wait
+
+
+class Governor:
+    """
+    Throttles data transfers against a global token bucket and, for runs from a watch directory that
+    has its own limit, against that watch directory's token bucket as well. Also keeps track of each
+    process's throughput and logs it every `LOG_INTERVAL_SECONDS`.
+    """
+
+    def __init__(self, rate=None, schedule=None, watchdir_rates=None):
+        """
+        Args:
+            rate: `int`. The global rate limit in bytes per second. None means no limit.
+            schedule: `list`. Time-of-day overrides of the global rate limit; see `TokenBucket`.
+            watchdir_rates: `dict`. Maps watch directory paths to a rate limit in bytes per second
+                for the runs in that directory.
+        """
+        #: The `TokenBucket` shared by all transfers.
+        self.bucket = TokenBucket(rate=rate, schedule=schedule)
+        #: Maps watch directory paths to their `TokenBucket`.
+        self.watchdir_buckets = {}
+        for path, watchdir_rate in (watchdir_rates or {}).items():
+            self.watchdir_buckets[os.path.normpath(path)] = TokenBucket(rate=watchdir_rate)
+        #: Describes what the current process is working on, i.e. a run name, in throughput logs.
+        self.label = None
+        #: The watch directory that the current process is working on.
+        self.watchdir = None
+        self._bytes = 0
+        self._window_start = time.time()
+
+    def set_context(self, label, watchdir=None):
+        """
+        Sets what the current process is working on. Called in a child process once it knows.
+
+        Args:
+            label: `str`. Identifies the process in throughput logs, i.e. a run name.
+            watchdir: `str`. The watch directory of the run, which selects its token bucket.
+        """
+        self.label = label
+        self.watchdir = os.path.normpath(watchdir) if watchdir else None
+        self._bytes = 0
+        self._window_start = time.time()
+
+    def throttle(self, nbytes):
+        """
+        Accounts for `nbytes` bytes moved by the current process, blocking as long as the limits
+        require.
+
+        Args:
+            nbytes: `int`. The number of bytes.
+        """
+        self.bucket.consume(nbytes)
+        watchdir_bucket = self.watchdir_buckets.get(self.watchdir)
+        if watchdir_bucket:
+            watchdir_bucket.consume(nbytes)
+        self._bytes += nbytes
+        elapsed = time.time() - self._window_start
+        if elapsed >= LOG_INTERVAL_SECONDS:
+            limit = self.bucket.get_rate()
+            logger.info("Throughput of process {} ({}): {:.1f} MB/s (global limit {}).".format(
+                os.getpid(), self.label, self._bytes / 1024 / 1024 / elapsed,
+                "{:.1f} MB/s".format(limit / 1024 / 1024) if limit else "none"))
+            self._bytes = 0
+            self._window_start = time.time()
+
+
+class ThrottledReader:
+    """
+    A wrapper around a readable file-like object that passes the size of each read to `throttle`.
+    Other attributes are those of the wrapped object.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        throttle(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+class ThrottledWriter:
+    """
+    A wrapper around a writable file-like object that passes the size of each write to `throttle`.
+    Other attributes are those of the wrapped object.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def write(self, data):
+        throttle(len(data))
+        return self.fileobj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+def install(governor):
+    """
+    Makes `governor` the one that `throttle` uses in this process and in any processes forked from
+    it afterwards.
+
+    Args:
+        governor: `Governor` instance, or None to remove it.
+    """
+    global _governor
+    _governor = governor
+
+
+def set_context(label, watchdir=None):
+    """
+    Calls `Governor.set_context` on the installed governor, if any.
+    """
+    if _governor:
+        _governor.set_context(label=label, watchdir=watchdir)
+
+
+def throttle(nbytes):
+    """
+    Calls `Governor.throttle` on the installed governor, if any. Returns right away otherwise.
+    """
+    if _governor:
+        _governor.throttle(nbytes)
@@ -1,17 +1,96 @@
 # -*- coding: utf-8 -*-
 
+import base64
+import collections
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 from email.message import EmailMessage
+import google_crc32c
+import hashlib
+import io
+import itertools
 import json
 import jsonschema
+import logging
 import os
 import psutil
+import queue
+import re
+import requests
 from smtplib import SMTP, SMTPException
 import shutil
+import stat
 import subprocess
 import tarfile
+import threading
 import time
 
 import sruns_monitor as srm
+from sruns_monitor import compress_utils
+from sruns_monitor import exceptions as srm_exceptions
+from sruns_monitor import storage_backends
+from sruns_monitor import throttle_utils
+
+logger = logging.getLogger(__name__)
+
+#: The default chunk size in bytes used by `stream_tar_to_gcp` for each request of the resumable
+#: upload session, and hence the amount of the tar stream that is buffered in memory.
+STREAM_CHUNK_SIZE = 64 * 1024 * 1024
+
+#: The default chunk size in bytes used by `resumable_upload_to_gcp` for each request of the
+#: resumable upload session. The committed offset is checkpointed after each chunk.
+UPLOAD_CHUNK_SIZE = 64 * 1024 * 1024
+
+#: The number of seconds to wait for a response to a request in a resumable upload session.
+UPLOAD_REQUEST_TIMEOUT = 300
+
+#: The default number of parts that are uploaded concurrently in a parallel composite upload.
+UPLOAD_WORKERS = 8
+
+#: The default number of bytes that `tar_resumable` writes in-between checkpoints.
+CHECKPOINT_BYTES = 1024 * 1024 * 1024
+
+#: Value for `partition_rundir`'s shard_by parameter to partition a run directory by lane.
+SHARD_BY_LANE = "lane"
+
+#: Value for `partition_rundir`'s shard_by parameter to partition a run directory by top-level
+#: subdirectory.
+SHARD_BY_TOP_LEVEL = "top_level"
+
+#: The name of the shard that holds everything not in another shard.
+SHARD_REST = "rest"
+
+#: Matches the names of lane directories, i.e. L001.
+LANE_DIR_REGEX = re.compile(r"^L\d{3}$")
+
+#: Matches the names of cycle directories within a lane directory, i.e. C25.1. The group captures
+#: the cycle number.
+CYCLE_DIR_REGEX = re.compile(r"^C(\d+)\.1$")
+
+#: The suffix added to a tarball's name to name its member index; see `write_tar_index`.
+TAR_INDEX_SUFFIX = ".index.json"
+
+#: When reading several members of a tarball with ranged reads, members that are at most this many
+#: bytes apart are read together in a single request; see `group_tar_members`.
+TAR_READ_MAX_GAP = 1024 * 1024
+
+#: The maximum number of bytes to read in a single ranged read of several members of a tarball,
+#: unless a single member is larger; see `group_tar_members`.
+TAR_READ_MAX_SPAN = 64 * 1024 * 1024
+
+#: The maximum number of source objects that GCP Storage accepts in a single compose request.
+COMPOSE_MAX_SOURCES = 32
+
+#: The default number of files that `tar` opens and starts reading ahead of the member it's writing;
+#: see `TarPrefetcher`.
+TAR_PREFETCH_FILES = 32
+
+#: The maximum number of threads that open and read files ahead for `tar`.
+TAR_PREFETCH_WORKERS = 8
+
+#: The size in bytes of each read from a file being tarred, and hence how much of each file is read
+#: ahead. This is also the size of each file's read buffer, so `TarPrefetcher` holds at most about
+#: this many bytes for each file it reads ahead.
+TAR_READ_SIZE = 2 * 1024 * 1024
 
 
 def create_subprocess(cmd, check_retcode=True):                                                        
@@ -95,26 +174,704 @@ def clean_completed_runs(basedir, limit):
 
 
 
-def tar(input_dir, tarball_name, compress=False):
+class ChecksumWriter:
+    """
+    A writable file-like object that computes the CRC32C checksum and MD5 hash of everything that is
+    written through it to another file object. This lets a tarball's checksums be computed as it's
+    produced rather than in a second pass over the file.
     """
-    Creates a tar.gz tarball of the provided directory and returns the tarball's name.
-    The tarball's name is the same as the input directory's name, but with a .tar.gz extension.
+
+    def __init__(self, fileobj):
+        """
+        Args:
+            fileobj: A writable file-like object to pass the data on to.
+        """
+        self.fileobj = fileobj
+        self.crc32c = google_crc32c.Checksum()
+        self.md5 = hashlib.md5()
+
+    def update(self, data):
+        """
+        Adds data to the checksums without writing it, i.e. data that was already written.
+        """
+        self.crc32c.update(data)
+        self.md5.update(data)
+
+    def write(self, data):
+        self.update(data)
+        return self.fileobj.write(data)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def checksums(self):
+        """
+        Returns:
+            `dict` with the keys 'crc32c' and 'md5', whose values are the base64-encoded checksums of
+            the data written so far. This is the encoding that GCP Storage uses in object metadata.
+        """
+        return {
+            "crc32c": base64.b64encode(self.crc32c.digest()).decode("ascii"),
+            "md5": base64.b64encode(self.md5.digest()).decode("ascii")
+        }
+
+def get_file_crc32c(filename):
+    """
+    Computes the CRC32C checksum of a file.
+
+    Args:
+        filename: `str`. The path of the file.
+
+    Returns:
+        `str`. The base64-encoded checksum, as GCP Storage has it in object metadata.
+    """
+    crc32c = google_crc32c.Checksum()
+    with open(filename, "rb") as fh:
+        for chunk in iter(lambda: fh.read(STREAM_CHUNK_SIZE), b""):
+            crc32c.update(chunk)
+    return base64.b64encode(crc32c.digest()).decode("ascii")
+
+class IndexingTarFile(tarfile.TarFile):
+    """
+    A `tarfile.TarFile` that records where the data of each regular file lies in the uncompressed
+    tar stream as it's added, for use in a tar member index; see `write_tar_index`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        #: Maps the name of each regular file member to an [offset, size] list, where offset is the
+        #: position of its data in the uncompressed tar stream.
+        self.index = {}
+
+    def addfile(self, tarinfo, fileobj=None):
+        super().addfile(tarinfo, fileobj)
+        if tarinfo.isreg():
+            # The data is followed by padding up to the next block boundary.
+            padded_size = -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            self.index[tarinfo.name] = [self.offset - padded_size, tarinfo.size]
+
+def write_tar_index(index_file, members, compressor=None):
+    """
+    Writes a tar member index, a compact JSON file that maps the name of each regular file in a
+    tarball to the location of its data, so that individual members can be read with ranged reads
+    rather than by reading the whole tarball. The JSON object has the keys:
+
+        * 'members': maps each member name to an [offset, size] list, where offset is the position of
+          the member's data in the uncompressed tar stream.
+        * 'compression': the compression format of the tarball, or null if it isn't compressed.
+        * 'block_size' and 'blocks': only for a compressed tarball. The tarball is a series of
+          independently compressed blocks of 'block_size' uncompressed bytes each (see
+          `sruns_monitor.compress_utils.ParallelCompressor`), and 'blocks' lists the offset in the
+          tarball at which each one starts.
+
+    Args:
+        index_file: `str`. The path of the index file to write.
+        members: `dict`. The index of an `IndexingTarFile`.
+        compressor: The `sruns_monitor.compress_utils.ParallelCompressor` that compressed the
+            tarball, if any.
+    """
+    index = {"compression": None, "members": members}
+    if compressor:
+        index["compression"] = compressor.fmt
+        index["block_size"] = compressor.block_size
+        index["blocks"] = compressor.block_offsets
+    with open(index_file, "w") as fh:
+        json.dump(index, fh, separators=(",", ":"))
+
+def get_tar_span(index, names):
+    """
+    Works out the byte range of a tarball to read in order to get the data of the given members.
+
+    Args:
+        index: `dict`. A tar member index as written by `write_tar_index`.
+        names: `list` of member names in the index.
+
+    Returns:
+        `tuple`. The start offset and the end offset (exclusive) in the tarball. The end is None when
+        the range extends to the end of the tarball.
+    """
+    start = min([index["members"][i][0] for i in names])
+    end = max([sum(index["members"][i]) for i in names])
+    if not index["compression"]:
+        return start, end
+    block_size = index["block_size"]
+    blocks = index["blocks"]
+    # The index of the block after the last one that holds any of the data.
+    end_block = max(-(-end // block_size), start // block_size + 1)
+    end = blocks[end_block] if end_block < len(blocks) else None
+    return blocks[start // block_size], end
+
+def read_tar_members(index, data, names):
+    """
+    Extracts the data of the given members from a byte range of a tarball.
+
+    Args:
+        index: `dict`. A tar member index as written by `write_tar_index`.
+        data: `bytes`. The byte range of the tarball given by `get_tar_span` for `names`, or a
+            larger range that starts at the same offset.
+        names: `list` of member names in the index.
+
+    Returns:
+        `dict`. Maps each member name to its data.
+    """
+    start = min([index["members"][i][0] for i in names])
+    if index["compression"]:
+        # The range starts at a block boundary, so decompressing it gives the uncompressed stream
+        # from the start of that block onwards.
+        start -= start % index["block_size"]
+        data = compress_utils.decompress_blocks(index["compression"], data)
+    res = {}
+    for name in names:
+        offset, size = index["members"][name]
+        res[name] = data[offset - start:offset - start + size]
+    return res
+
+def select_tar_members(index, paths):
+    """
+    Args:
+        index: `dict`. A tar member index as written by `write_tar_index`.
+        paths: `list` of member names and/or directory names in the tarball, i.e.
+            'run_name/RunInfo.xml' or 'run_name/Data/Intensities/BaseCalls/L001'.
+
+    Returns:
+        `list`. The names of the members in the index that are one of `paths` or that are beneath
+        one of them, in the order that they are in the tarball.
+    """
+    prefixes = tuple([i.rstrip("/") + "/" for i in paths])
+    names = [i for i in index["members"] if i in paths or i.startswith(prefixes)]
+    return sorted(names, key=lambda i: index["members"][i][0])
+
+def group_tar_members(index, names, max_gap=TAR_READ_MAX_GAP, max_span=TAR_READ_MAX_SPAN):
+    """
+    Groups members so that members that are close together in a tarball can be read with a single
+    ranged read, which saves a request per member when reading many small files, i.e. a lane.
+
+    Args:
+        index: `dict`. A tar member index as written by `write_tar_index`.
+        names: `list` of member names in the index.
+        max_gap: `int`. The maximum number of bytes in-between two consecutive members in a group.
+        max_span: `int`. The maximum number of bytes that the members of a group span, unless a
+            single member is larger.
+
+    Returns:
+        `list` of `list`s of member names, in the order that they are in the tarball.
+    """
+    members = index["members"]
+    groups = []
+    group_start = group_end = None
+    for name in sorted(names, key=lambda i: members[i][0]):
+        offset, size = members[name]
+        if groups and offset - group_end <= max_gap and offset + size - group_start <= max_span:
+            groups[-1].append(name)
+            group_end = max(group_end, offset + size)
+        else:
+            groups.append([name])
+            group_start = offset
+            group_end = offset + size
+    return groups
+
+def tar(input_dir, tarball_name, compress=False, fileobj=None, compress_workers=None, include=None, exclude=None, index_file=None, prefetch=TAR_PREFETCH_FILES):
+    """
+    Creates a tarball of the provided directory.
+
+    The files are opened and read ahead of the member being written by a `TarPrefetcher`, which
+    hides the per-file latency of a network filesystem. The tarball is the same either way.
+
+    Compression is done by a `sruns_monitor.compress_utils.ParallelCompressor`, which compresses
+    independent blocks of the tar stream on a pool of workers, and its throughput is logged.
+
+    The CRC32C checksum and MD5 hash of the tarball are computed as it's written; see
+    `ChecksumWriter`. The uncompressed tar stream, which is what's read from `input_dir`, is
+    throttled by the installed bandwidth governor, if any; see `sruns_monitor.throttle_utils`.
 
     Args:
         input_dir: `str`. Path to the directory to tar up.
-        tarball_name: `str`. Name of the output tarball.
-        compress: `boolean`. True enables gzip compression. Not recommended with the latest types of
+        tarball_name: `str`. Name of the output tarball. When `fileobj` is provided, this is only
+            used to identify the tarball in log messages.
+        compress: `boolean` or `str`. True enables gzip compression. Can also be set to the name of
+            a compression format, one of `sruns_monitor.compress_utils.FORMAT_GZIP` or
+            `sruns_monitor.compress_utils.FORMAT_ZSTD`. Not recommended with the latest types of
             Illumina runs, i.e. NovaSeq, since the files are mostly binary which isn't compressible.
             For example, I compressed a 428 GB NovaSeq run with 'tar -zcf' and the output was 422 GB.
+        fileobj: A writable file-like object. When provided, the tarball is written to it as a
+            stream (tarfile's 'w|' mode) rather than to a file named `tarball_name`. The stream
+            mode never seeks, so `fileobj` can be a pipe or an upload stream (see `stream_tar_to_gcp`).
+            `fileobj` is not closed.
+        compress_workers: `int`. The number of compression workers. Defaults to the number of CPUs.
+        include: `list` of paths relative to `input_dir`. When provided, only these files and
+            directories are added rather than all of `input_dir`. Member names are still prefixed with
+            the name of `input_dir`, so that extracting several such tarballs rebuilds the directory.
+        exclude: `list` of paths relative to `input_dir` to leave out of the tarball, along with
+            everything beneath them.
+        index_file: `str`. If provided, a tar member index of the tarball is written to this path;
+            see `write_tar_index`.
+        prefetch: `int`. The number of files to read ahead. 0 disables reading ahead.
 
     Returns:
-        `None`.
+        `dict`. The tarball's checksums as returned by `ChecksumWriter.checksums`.
     """
-    mode = 'w'
+    if compress is True:
+        compress = compress_utils.FORMAT_GZIP
+    if fileobj is None:
+        with open(tarball_name, "wb") as fh:
+            return tar(input_dir=input_dir, tarball_name=tarball_name, compress=compress,
+                       fileobj=fh, compress_workers=compress_workers, include=include, exclude=exclude,
+                       index_file=index_file, prefetch=prefetch)
+    fileobj = ChecksumWriter(fileobj)
+    checksum_writer = fileobj
+    compressor = None
     if compress:
-        mode = "w:gz"
-    with tarfile.open(tarball_name, mode=mode) as tb:
-        tb.add(name=input_dir, arcname=os.path.basename(input_dir))
+        compressor = compress_utils.ParallelCompressor(fileobj=fileobj, fmt=compress, workers=compress_workers)
+        fileobj = compressor
+    arc_base = os.path.basename(input_dir)
+    exclude_names = set([os.path.join(arc_base, i) for i in exclude or []])
+    if include is None:
+        entries = iter_tar_paths(input_dir, arc_base, exclude=exclude_names)
+    else:
+        entries = itertools.chain.from_iterable(
+            iter_tar_paths(os.path.join(input_dir, path), os.path.join(arc_base, path), exclude=exclude_names)
+            for path in include)
+    fileobj = throttle_utils.ThrottledWriter(fileobj)
+    try:
+        with IndexingTarFile.open(fileobj=fileobj, mode="w|") as tb:
+            add_tar_members(tb, entries, prefetch=prefetch)
+        if compressor:
+            compressor.close()
+    finally:
+        if compressor:
+            # The compression workers are shut down, without writing out the rest of a tarball
+            # that failed, either way. This does nothing once the compressor is closed.
+            compressor.abort()
+    if compressor:
+        compressor.log_stats(name=tarball_name)
+    if index_file:
+        write_tar_index(index_file=index_file, members=tb.index, compressor=compressor)
+    return checksum_writer.checksums()
+
+def iter_tar_paths(path, arcname, exclude=None):
+    """
+    Generates the paths that `tarfile.TarFile.add` adds when recursively adding `path`, in the same
+    order: depth-first, with the entries of each directory sorted by name. Symbolic links to
+    directories aren't followed.
+
+    Args:
+        path: `str`. The path of a file or directory.
+        arcname: `str`. The name that `path` has in the tarball.
+        exclude: `set` of names in the tarball to leave out, along with everything beneath them.
+
+    Yields:
+        (path, arcname) two-item tuples.
+    """
+    if exclude and arcname in exclude:
+        return
+    yield path, arcname
+    if os.path.isdir(path) and not os.path.islink(path):
+        for name in sorted(os.listdir(path)):
+            yield from iter_tar_paths(os.path.join(path, name), os.path.join(arcname, name), exclude=exclude)
+
+def prefetch_file(path, read_size=TAR_READ_SIZE):
+    """
+    Opens a regular file for reading with a buffer of `read_size` bytes and fills the buffer, so that
+    the file's first `read_size` bytes are in memory and the file is read in chunks of that size from
+    then on. Where supported, the kernel is also advised that the file will be read sequentially
+    and in full, so that it can read ahead, i.e. from NFS, in the background. Used by
+    `TarPrefetcher` as the target of a worker thread.
+
+    Args:
+        path: `str`. The path of the file.
+        read_size: `int`. The size in bytes of the buffer.
+
+    Returns:
+        `io.BufferedReader`, or None if `path` isn't a regular file or can't be opened. In the
+        latter case, tarring the file again raises the error.
+    """
+    try:
+        st = os.lstat(path)
+        # Don't open anything else, i.e. a FIFO would block.
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        # A small file doesn't need the whole buffer.
+        fh = open(path, "rb", buffering=max(min(read_size, st.st_size), io.DEFAULT_BUFFER_SIZE))
+    except OSError:
+        return None
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        fh.peek(1)
+    except OSError:
+        fh.close()
+        return None
+    return fh
+
+class TarPrefetcher:
+    """
+    Opens and starts reading files on a pool of threads ahead of the tar writer, so that the latency
+    of opening and reading each file, which is high on NFS, overlaps with writing the members
+    before it. Iterating over it gives the entries that it was created with, in the same order, each
+    with its prefetched file; see `prefetch_file`. At most `files` files are read ahead at a time,
+    which bounds memory use to about `files` * `read_size` bytes.
+
+    Files that are read ahead but not consumed, i.e. because tarring failed, are closed by `close`.
+    """
+
+    def __init__(self, entries, files=TAR_PREFETCH_FILES, workers=TAR_PREFETCH_WORKERS, read_size=TAR_READ_SIZE):
+        """
+        Args:
+            entries: An iterable of (path, arcname) two-item tuples, as generated by `iter_tar_paths`.
+            files: `int`. The number of files to read ahead.
+            workers: `int`. The maximum number of threads.
+            read_size: `int`. The size in bytes of each file's read buffer.
+        """
+        self.entries = iter(entries)
+        self.files = files
+        self.read_size = read_size
+        self.executor = ThreadPoolExecutor(max_workers=min(workers, files))
+        #: (path, arcname, future) three-item tuples in order.
+        self.pending = collections.deque()
+
+    def __iter__(self):
+        """
+        Yields:
+            (path, arcname, fh) three-item tuples, where fh is the return value of `prefetch_file`.
+            The caller must close fh.
+        """
+        for path, arcname in self.entries:
+            self.pending.append((path, arcname, self.executor.submit(prefetch_file, path, self.read_size)))
+            if len(self.pending) > self.files:
+                yield self._next()
+        while self.pending:
+            yield self._next()
+
+    def _next(self):
+        path, arcname, future = self.pending.popleft()
+        return path, arcname, future.result()
+
+    def close(self):
+        """
+        Waits for the threads and closes the files that were read ahead but not consumed.
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for path, arcname, future in self.pending:
+            if not future.cancelled() and future.exception() is None and future.result():
+                future.result().close()
+        self.pending.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _add_tar_member(tb, path, arcname, fh):
+    """
+    Adds a single member to a tarball as `tarfile.TarFile.add` does with recursive=False, but reads a
+    regular file's data from `fh`, if provided, rather than opening it. Closes `fh`.
+    """
+    try:
+        # As in tarfile.TarFile.add, don't add the tarball to itself, and skip unsupported file
+        # types, i.e. sockets.
+        if tb.name is not None and os.path.abspath(path) == tb.name:
+            return
+        tarinfo = tb.gettarinfo(path, arcname)
+        if tarinfo is None:
+            return
+        if tarinfo.isreg():
+            # If the file couldn't be read ahead, opening it here raises the error as
+            # tarfile.TarFile.add would.
+            if fh is None:
+                fh = open(path, "rb")
+            tb.addfile(tarinfo, fh)
+        else:
+            # I.e. a directory, or a hard link to a member that was already added.
+            tb.addfile(tarinfo)
+    finally:
+        if fh:
+            fh.close()
+
+def add_tar_members(tb, entries, prefetch=TAR_PREFETCH_FILES, callback=None):
+    """
+    Adds the given paths to a tarball, each as a single member. The members are the same as those
+    that `tarfile.TarFile.add` adds with recursive=False, so the tarball is byte-identical either
+    way, but the files are read ahead by a `TarPrefetcher`.
+
+    Args:
+        tb: `tarfile.TarFile` instance open for writing.
+        entries: An iterable of (path, arcname) two-item tuples, as generated by `iter_tar_paths`.
+        prefetch: `int`. The number of files to read ahead. 0 disables reading ahead.
+        callback: A callable that takes no parameters. If provided, it's called after each entry
+            has been added, or skipped as `tarfile.TarFile.add` would.
+
+    Returns:
+        `None`.
+    """
+    if not prefetch:
+        for path, arcname in entries:
+            tb.add(name=path, arcname=arcname, recursive=False)
+            if callback:
+                callback()
+        return
+    with TarPrefetcher(entries, files=prefetch) as prefetcher:
+        for path, arcname, fh in prefetcher:
+            _add_tar_member(tb, path, arcname, fh)
+            if callback:
+                callback()
+
+def tar_resumable(input_dir, tarball_name, members=0, offset=0, checkpoint=None, checkpoint_bytes=CHECKPOINT_BYTES, index_file=None, prefetch=TAR_PREFETCH_FILES):
+    """
+    Creates an uncompressed tarball of the provided directory, like `tar`, while periodically
+    checkpointing its progress so that it can be resumed if interrupted. The tarball is byte-identical
+    to the one that `tar` creates.
+
+    Members are added one at a time in the order given by `iter_tar_paths`. Each time at least
+    `checkpoint_bytes` have been written since the last checkpoint, the tarball is flushed to disk and
+    `checkpoint` is called with the number of members written so far and the byte offset just after
+    the last of them.
+
+    To resume, pass in the values from the last checkpoint. The tarball is then truncated at `offset`,
+    which discards any partially written member, and the first `members` members are skipped. This
+    assumes that the directory hasn't changed in the meantime, which holds for a completed run
+    directory.
+
+    The CRC32C checksum and MD5 hash of the tarball are computed as it's written. When resuming, the
+    part of the tarball that's kept is read once to bring the checksums up to date, since the state
+    of an MD5 hash can't be saved in a checkpoint. Likewise, if a tar member index is requested, the
+    headers of the members that are kept are read to add them to it.
+
+    Args:
+        input_dir: `str`. Path to the directory to tar up.
+        tarball_name: `str`. Name of the output tarball.
+        members: `int`. The number of members already in the tarball, from the last checkpoint.
+        offset: `int`. The byte offset just after the last member already in the tarball, from the
+            last checkpoint.
+        checkpoint: A callable that takes the parameters members and offset. If not provided,
+            no checkpoints are made.
+        checkpoint_bytes: `int`. The minimum number of bytes to write in-between checkpoints.
+        index_file: `str`. If provided, a tar member index of the tarball is written to this path;
+            see `write_tar_index`.
+        prefetch: `int`. The number of files to read ahead; see `tar`.
+
+    Returns:
+        `dict`. The tarball's checksums as returned by `ChecksumWriter.checksums`.
+    """
+    mode = "r+b" if members else "wb"
+    with open(tarball_name, mode) as fh:
+        fh.truncate(offset)
+        index = {}
+        if index_file and offset:
+            # The kept part has no end-of-archive marker, so reading stops at its end.
+            with tarfile.open(tarball_name, mode="r:") as kept:
+                for tarinfo in kept:
+                    if tarinfo.isreg():
+                        index[tarinfo.name] = [tarinfo.offset_data, tarinfo.size]
+        writer = ChecksumWriter(fh)
+        while fh.tell() < offset:
+            writer.update(fh.read(min(STREAM_CHUNK_SIZE, offset - fh.tell())))
+        # In 'w' mode, TarFile starts its offset at the current position in fh.
+        with IndexingTarFile.open(fileobj=throttle_utils.ThrottledWriter(writer), mode="w") as tb:
+            tb.index = index
+            last_checkpoint = tb.offset
+            count = members
+
+            def added():
+                nonlocal count, last_checkpoint
+                count += 1
+                if checkpoint and tb.offset - last_checkpoint >= checkpoint_bytes:
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                    checkpoint(members=count, offset=tb.offset)
+                    last_checkpoint = tb.offset
+
+            entries = itertools.islice(iter_tar_paths(input_dir, os.path.basename(input_dir)), members, None)
+            add_tar_members(tb, entries, prefetch=prefetch, callback=added)
+    if index_file:
+        write_tar_index(index_file=index_file, members=tb.index)
+    return writer.checksums()
+
+def partition_rundir(input_dir, shard_by):
+    """
+    Partitions a run directory into shards that can be tarred independently of one another.
+
+    Args:
+        input_dir: `str`. Path to the run directory.
+        shard_by: `str`. How to partition the run directory:
+
+            * `SHARD_BY_LANE`: One shard per lane, holding the lane's directories beneath
+              Data/Intensities/BaseCalls (BCL/CBCL files) and Data/Intensities (filter and locs files).
+            * `SHARD_BY_TOP_LEVEL`: One shard per top-level subdirectory of the run directory.
+
+            Either way, everything else goes into a final shard named `SHARD_REST`.
+
+    Returns:
+        `list` of (shard_name, include, exclude) three-item tuples, where include and exclude are
+        lists of paths relative to `input_dir` suitable for the parameters of the same name in `tar`.
+        Together, the shards cover every file in the run directory exactly once.
+
+    Raises:
+        `ValueError`: `shard_by` isn't a supported value.
+    """
+    shards = collections.OrderedDict()
+    if shard_by == SHARD_BY_LANE:
+        for parent in [os.path.join("Data", "Intensities", "BaseCalls"), os.path.join("Data", "Intensities")]:
+            parent_path = os.path.join(input_dir, parent)
+            if not os.path.isdir(parent_path):
+                continue
+            for name in sorted(os.listdir(parent_path)):
+                if LANE_DIR_REGEX.match(name) and os.path.isdir(os.path.join(parent_path, name)):
+                    shards.setdefault(name, []).append(os.path.join(parent, name))
+    elif shard_by == SHARD_BY_TOP_LEVEL:
+        for name in sorted(os.listdir(input_dir)):
+            if os.path.isdir(os.path.join(input_dir, name)):
+                shards[name] = [name]
+    else:
+        raise ValueError("Unsupported shard_by value '{}'.".format(shard_by))
+    res = [(name, include, []) for name, include in shards.items()]
+    exclude = [path for include in shards.values() for path in include]
+    res.append((SHARD_REST, None, exclude))
+    return res
+
+def get_completed_cycle_dirs(input_dir, settle_seconds):
+    """
+    Finds the cycle directories of a run directory that the sequencer has finished writing to, while
+    the run is still in progress. These are the directories named like C25.1 within each lane
+    directory in Data/Intensities/BaseCalls. A cycle directory is considered complete when the
+    sequencer has moved on to a later cycle in the same lane, and when the cycle directory hasn't
+    been modified in at least `settle_seconds`. The latest cycle directory of each lane is never
+    considered complete.
+
+    Args:
+        input_dir: `str`. Path to the run directory.
+        settle_seconds: `int`. How long a cycle directory must go unmodified before it's considered
+            complete.
+
+    Returns:
+        `list` of paths relative to `input_dir`, ordered by lane and then by cycle number.
+    """
+    basecalls = os.path.join("Data", "Intensities", "BaseCalls")
+    basecalls_path = os.path.join(input_dir, basecalls)
+    if not os.path.isdir(basecalls_path):
+        return []
+    completed = []
+    for lane in sorted(os.listdir(basecalls_path)):
+        lane_path = os.path.join(basecalls_path, lane)
+        if not LANE_DIR_REGEX.match(lane) or not os.path.isdir(lane_path):
+            continue
+        cycles = []
+        for name in os.listdir(lane_path):
+            match = CYCLE_DIR_REGEX.match(name)
+            if match:
+                cycles.append((int(match.group(1)), name))
+        cycles.sort()
+        # The latest cycle may still be in progress.
+        for cycle_num, name in cycles[:-1]:
+            if get_file_age(os.path.join(lane_path, name)) >= settle_seconds:
+                completed.append(os.path.join(basecalls, lane, name))
+    return completed
+
+def run_in_daemon_thread(func, *args, **kwargs):
+    """
+    Calls a function in a new daemon thread. Unlike the threads of a
+    `concurrent.futures.ThreadPoolExecutor`, a daemon thread isn't waited for when the interpreter
+    exits, so a call that hangs, i.e. on an unresponsive NFS mount, can't keep the process from
+    shutting down.
+
+    Args:
+        func: The function to call.
+        *args: Positional arguments for `func`.
+        **kwargs: Keyword arguments for `func`.
+
+    Returns:
+        `concurrent.futures.Future` for the return value of `func`.
+    """
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def target():
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, name="daemon-{}".format(func.__name__), daemon=True).start()
+    return future
+
+class DaemonThreadExecutor(Executor):
+    """
+    Runs the calls submitted to it one at a time, in order, on a single daemon thread. Unlike the
+    thread of a `concurrent.futures.ThreadPoolExecutor`, it isn't joined at interpreter exit. That
+    matters for a thread that forks child processes: a child forked from a `ThreadPoolExecutor`
+    thread tries to join that thread, i.e. itself, when it exits, and exits with code 1.
+    """
+
+    def __init__(self, name="daemon"):
+        """
+        Args:
+            name: `str`. The name of the thread.
+        """
+        self._queue = queue.SimpleQueue()
+        self._shutdown = False
+        self._thread = threading.Thread(target=self._work, name=name, daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, fn, /, *args, **kwargs):
+        if self._shutdown:
+            raise RuntimeError("cannot schedule new futures after shutdown")
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self._shutdown = True
+        if cancel_futures:
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item:
+                    item[0].cancel()
+        self._queue.put(None)
+        if wait:
+            self._thread.join()
+
+def get_dir_size(path):
+    """
+    Adds up the sizes of all files beneath a directory, without following symlinks. Uses
+    `os.scandir`, which gets the file type of each entry from the directory listing, so that only
+    regular files need a stat call.
+
+    Args:
+        path: `str`. Path to a directory.
+
+    Returns:
+        `int`. The size in bytes.
+    """
+    size = 0
+    dirs = [path]
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    size += entry.stat(follow_symlinks=False).st_size
+    return size
 
 def extract(filename, where):
    """
@@ -130,12 +887,19 @@ def extract(filename, where):
    tf = tarfile.open(filename)
    tf.extractall(path=where)
 
-def upload_to_gcp(bucket, blob_name, source_file):
+def upload_to_gcp(bucket, blob_name, source_file, part_size=None, workers=UPLOAD_WORKERS):
     """
     Uploads a local file to GCP storage in the specified bucket.
 
+    When `part_size` is set and the file is larger than that, a parallel composite upload is
+    performed instead of a single-stream upload; see `composite_upload_to_gcp`.
+
+    The upload is throttled by the installed bandwidth governor, if any; see
+    `sruns_monitor.throttle_utils`.
+
     Args:
-        bucket: `google.cloud.storage.bucket.Bucket` instance, which can be created like so::
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance, which can be created like so::
 
             from google.cloud import storage
             storage_client = storage.Client()
@@ -143,6 +907,9 @@ def upload_to_gcp(bucket, blob_name, source_file):
 
         blob_name: `str`. The name to give the uploaded file in the bucket.
         source_file: `str`. The name of the local file to upload.
+        part_size: `int`. Size in bytes of each part in a parallel composite upload. A false value
+            disables parallel composite uploads.
+        workers: `int`. The number of parts to upload concurrently in a parallel composite upload.
 
     Returns:
         `None`.
@@ -150,8 +917,283 @@ def upload_to_gcp(bucket, blob_name, source_file):
     Raises:
         `FileNotFoundError`: source_file was not locally found.
     """
-    blob = bucket.blob(blob_name)
-    return blob.upload_from_filename(source_file)
+    if part_size and os.path.getsize(source_file) > part_size:
+        return composite_upload_to_gcp(bucket=bucket, blob_name=blob_name, source_file=source_file,
+                                       part_size=part_size, workers=workers)
+    backend = storage_backends.as_backend(bucket)
+    with open(source_file, "rb") as fh:
+        backend.upload_from_file(blob_name, throttle_utils.ThrottledReader(fh), size=os.path.getsize(source_file))
+
+def get_committed_offset(range_header):
+    """
+    Parses the Range header of a response to a request in a resumable upload session, which has the
+    form 'bytes=0-N' where N is the last byte that the server has committed.
+
+    Args:
+        range_header: `str`. The value of the Range header, or None if the header is absent, which
+            means that no bytes have been committed yet.
+
+    Returns:
+        `int`. The number of bytes committed, which is the offset to continue uploading from.
+    """
+    if not range_header:
+        return 0
+    return int(range_header.rsplit("-", 1)[-1]) + 1
+
+def query_resumable_upload(session_url, size):
+    """
+    Asks GCP Storage how far along a resumable upload session is.
+
+    Args:
+        session_url: `str`. The resumable upload session URI.
+        size: `int`. The total size in bytes of the upload.
+
+    Returns:
+        `int`: The number of bytes committed, which is the offset to continue uploading from.
+            This equals `size` if the upload is complete.
+        `None`: The session no longer exists, i.e. because it expired after a week.
+
+    Raises:
+        `requests.HTTPError`: The server responded with an error or an unexpected status.
+    """
+    # The session URI serves as the authentication token, so no credentials are needed.
+    response = requests.put(session_url, headers={"Content-Range": "bytes */{}".format(size)},
+                            timeout=UPLOAD_REQUEST_TIMEOUT)
+    if response.status_code in (200, 201):
+        return size
+    if response.status_code == 308:
+        return get_committed_offset(response.headers.get("Range"))
+    if response.status_code in (404, 410):
+        return None
+    response.raise_for_status()
+    raise unexpected_status_error(response)
+
+def unexpected_status_error(response):
+    """
+    Makes the error for a response to a request of a resumable upload session whose status isn't an
+    error, but isn't one of the statuses that GCP Storage responds with either, i.e. from a proxy.
+    Without it, the caller would lose track of the offset to continue uploading from.
+
+    Args:
+        response: `requests.Response`. The response.
+
+    Returns:
+        `requests.HTTPError`.
+    """
+    return requests.HTTPError("Unexpected status {} {} from resumable upload session {}.".format(
+        response.status_code, response.reason, response.url), response=response)
+
+def resumable_upload_to_gcp(bucket, blob_name, source_file, session_url=None, checkpoint=None, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Uploads a local file to GCP storage in the specified bucket by means of a resumable upload
+    session that can be picked up again if this process dies part way through.
+
+    When `session_url` is provided, the session is queried for the number of bytes that the server
+    has committed and the upload continues from there. If the session has expired, a new session is
+    started and the upload begins from the start of the file.
+
+    Args:
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance.
+        blob_name: `str`. The name to give the uploaded file in the bucket.
+        source_file: `str`. The name of the local file to upload.
+        session_url: `str`. The URI of a resumable upload session for this file from an earlier
+            attempt, as passed to `checkpoint`. For a storage backend other than GCP Storage, this
+            is whatever session the backend uses.
+        checkpoint: A callable that takes the parameters session_url and offset. It is called when a
+            session is started and after each chunk that the server commits, so that the caller can
+            persist them.
+        chunk_size: `int`. The number of bytes sent in each request. Must be a multiple of 256 KB.
+
+    Returns:
+        `None`.
+
+    Raises:
+        `requests.HTTPError`: The server responded to a request with an error.
+    """
+    backend = storage_backends.as_backend(bucket)
+    size = os.path.getsize(source_file)
+    offset = None
+    if session_url:
+        offset = backend.query_resumable_upload(session_url, size=size)
+        if offset is None:
+            logger.info("Resumable upload session for {} expired. Starting a new one.".format(source_file))
+    if offset is None:
+        session_url = backend.create_resumable_upload(blob_name, size=size)
+        offset = 0
+        if checkpoint:
+            checkpoint(session_url=session_url, offset=offset)
+    elif offset:
+        logger.info("Resuming upload of {} at byte offset {} of {}.".format(source_file, offset, size))
+    with open(source_file, "rb") as fh:
+        while offset < size:
+            fh.seek(offset)
+            chunk = fh.read(chunk_size)
+            throttle_utils.throttle(len(chunk))
+            # The server may commit fewer bytes than were sent; the rest are sent again.
+            offset = backend.upload_chunk(session_url, chunk, offset=offset, size=size)
+            if checkpoint:
+                checkpoint(session_url=session_url, offset=offset)
+
+def get_byte_ranges(size, part_size):
+    """
+    Splits a file of the given size into consecutive byte ranges.
+
+    Args:
+        size: `int`. The size of the file in bytes.
+        part_size: `int`. The maximum number of bytes in a range.
+
+    Returns:
+        `list` of (offset, length) two-item tuples. The last range may be shorter than `part_size`.
+    """
+    return [(offset, min(part_size, size - offset)) for offset in range(0, size, part_size)]
+
+def _upload_part(backend, blob_name, source_file, offset, length):
+    """
+    Uploads `length` bytes of a local file, beginning at `offset`, to the named blob.
+    Used by `composite_upload_to_gcp` as the target of a worker thread.
+    """
+    with open(source_file, "rb") as fh:
+        fh.seek(offset)
+        backend.upload_from_file(blob_name, throttle_utils.ThrottledReader(fh), size=length)
+
+def composite_upload_to_gcp(bucket, blob_name, source_file, part_size, workers=UPLOAD_WORKERS):
+    """
+    Uploads a local file to GCP storage by means of a parallel composite upload. The file is
+    split into byte ranges of `part_size` bytes that are uploaded concurrently as temporary part
+    objects named $blob_name.partNNNNN. The parts are then combined server-side into `blob_name`
+    using the compose operation and removed afterwards. Since compose accepts at most 32 source
+    objects, the parts are folded into the destination blob 31 at a time when there are more.
+
+    Note that a composite object doesn't have an MD5 hash in its metadata, only a CRC32C checksum.
+
+    Args:
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance.
+        blob_name: `str`. The name to give the uploaded file in the bucket.
+        source_file: `str`. The name of the local file to upload.
+        part_size: `int`. Size in bytes of each part.
+        workers: `int`. The number of parts to upload concurrently.
+
+    Returns:
+        `None`.
+    """
+    backend = storage_backends.as_backend(bucket)
+    ranges = get_byte_ranges(size=os.path.getsize(source_file), part_size=part_size)
+    part_names = ["{}.part{:05d}".format(blob_name, i) for i in range(len(ranges))]
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for part_name, (offset, length) in zip(part_names, ranges):
+                futures.append(executor.submit(_upload_part, backend, part_name, source_file, offset, length))
+            for f in futures:
+                # Re-raises any exception from the worker thread.
+                f.result()
+        backend.compose(blob_name, part_names[:COMPOSE_MAX_SOURCES])
+        parts_remaining = part_names[COMPOSE_MAX_SOURCES:]
+        while parts_remaining:
+            batch = parts_remaining[:COMPOSE_MAX_SOURCES - 1]
+            parts_remaining = parts_remaining[COMPOSE_MAX_SOURCES - 1:]
+            backend.compose(blob_name, [blob_name] + batch)
+    finally:
+        # Remove the part objects, including any left from a failed attempt. Parts that were never
+        # uploaded are ignored.
+        backend.delete(part_names)
+
+def stream_tar_to_gcp(input_dir, bucket, blob_name, chunk_size=STREAM_CHUNK_SIZE, compress=False, compress_workers=None, index_file=None, prefetch=TAR_PREFETCH_FILES):
+    """
+    Tars the provided directory straight into a GCP storage object without writing a local tarfile.
+    The tar stream is fed into a resumable upload session, so at most `chunk_size` bytes of the
+    tarball are held in memory at any time.
+
+    The object is only finalized once the tar stream has been completely written. If an error occurs
+    part way through, the upload is aborted and no object is created in the bucket.
+
+    Args:
+        input_dir: `str`. Path to the directory to tar up.
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance.
+        blob_name: `str`. The name to give the tarball in the bucket.
+        chunk_size: `int`. The size in bytes of each chunk sent in the resumable upload session.
+            This bounds the in-memory buffer. Must be a multiple of 256 KB.
+        compress: `boolean` or `str`. The compression format, if any. See `tar`.
+        compress_workers: `int`. The number of compression workers. See `tar`.
+        index_file: `str`. If provided, a tar member index of the tarball is written locally to this
+            path; see `write_tar_index`.
+        prefetch: `int`. The number of files to read ahead; see `tar`.
+
+    Returns:
+        `dict`. The tarball's checksums as returned by `ChecksumWriter.checksums`.
+    """
+    backend = storage_backends.as_backend(bucket)
+    writer = backend.open_writer(blob_name, chunk_size=chunk_size)
+    try:
+        # Reading the run directory and uploading are the same stream here, so it's only throttled
+        # once, by tar.
+        checksums = tar(input_dir=input_dir, tarball_name=blob_name, compress=compress,
+                        fileobj=writer, compress_workers=compress_workers, index_file=index_file,
+                        prefetch=prefetch)
+    except BaseException:
+        # Closing the writer, even when it's garbage collected, would upload a truncated tarball.
+        backend.abort_writer(writer)
+        raise
+    # Closing the writer sends the final chunk and finalizes the object.
+    writer.close()
+    return checksums
+
+def blob_matches_file(bucket, blob_name, source_file, crc32c=None):
+    """
+    Checks whether an object in GCP Storage already holds the contents of a local file, by
+    comparing the object's size and CRC32C checksum from its metadata. Nothing is downloaded.
+
+    Args:
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance.
+        blob_name: `str`. The name of the object in the bucket.
+        source_file: `str`. The path of the local file.
+        crc32c: `str`. The base64-encoded CRC32C checksum of `source_file`, if known. Otherwise it's
+            computed, but only if the object exists and has the same size.
+
+    Returns:
+        `boolean`.
+    """
+    info = storage_backends.as_backend(bucket).stat(blob_name)
+    if info is None or info.size != os.path.getsize(source_file):
+        return False
+    if not crc32c:
+        crc32c = get_file_crc32c(source_file)
+    return info.crc32c == crc32c
+
+def verify_blob_checksums(bucket, blob_name, crc32c, md5=None):
+    """
+    Checks that an object in GCP Storage has the given checksums, as computed on the local file it
+    was uploaded from, by comparing them against the object's metadata. Nothing is downloaded.
+
+    The MD5 hash is only compared if the object has one in its metadata, which isn't the case for a
+    composite object (see `composite_upload_to_gcp`).
+
+    Args:
+        bucket: `sruns_monitor.storage_backends.StorageBackend` or
+            `google.cloud.storage.bucket.Bucket` instance.
+        blob_name: `str`. The name of the object in the bucket.
+        crc32c: `str`. The expected base64-encoded CRC32C checksum.
+        md5: `str`. The expected base64-encoded MD5 hash.
+
+    Returns:
+        `None`.
+
+    Raises:
+        `sruns_monitor.exceptions.ChecksumMismatch`: The object is missing or a checksum differs.
+    """
+    info = storage_backends.as_backend(bucket).stat(blob_name)
+    if info is None:
+        raise srm_exceptions.ChecksumMismatch("gs://{}/{} doesn't exist.".format(bucket.name, blob_name))
+    if info.crc32c != crc32c:
+        raise srm_exceptions.ChecksumMismatch("gs://{}/{} has CRC32C {} rather than {}.".format(
+            bucket.name, blob_name, info.crc32c, crc32c))
+    if md5 and info.md5_hash and info.md5_hash != md5:
+        raise srm_exceptions.ChecksumMismatch("gs://{}/{} has MD5 {} rather than {}.".format(
+            bucket.name, blob_name, info.md5_hash, md5))
 
 def get_process(pid):
     """
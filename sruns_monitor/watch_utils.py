@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+"""
+Event-driven detection of finished sequencing runs. A `RunWatcher` uses Linux inotify to learn about
+new run directories and sentinal files as they appear, rather than listing every run directory on
+every cycle. inotify doesn't report changes made by other hosts on network filesystems such as NFS,
+so watch directories on those are instead reconciled with a scan every time the watcher is polled.
+That scan is cheap, since run directories that are already known to be finished aren't listed
+again.
+"""
+
+import collections
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# inotify event masks and flags, from <sys/inotify.h>.
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+#: The events watched for on a watch directory: run directories coming and going.
+WATCHDIR_MASK = IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_ONLYDIR
+
+#: The events watched for on a run directory: a sentinal file appearing.
+RUNDIR_MASK = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE | IN_ATTRIB | IN_ONLYDIR
+
+#: Filesystem types on which inotify doesn't see changes made by other hosts.
+REMOTE_FILESYSTEMS = set(["nfs", "nfs4", "cifs", "smb3", "smbfs", "lustre", "gpfs", "ceph", "fuse.sshfs"])
+
+#: The default number of seconds in-between reconciliation scans of watch directories that are
+#: watched with inotify. These only catch up on events that were missed, i.e. if the event queue
+#: overflowed.
+RECONCILE_SEC = 600
+
+#: An inotify event. `name` is the name of the file within the watched directory, or '' if the event
+#: is about the watched directory itself.
+InotifyEvent = collections.namedtuple("InotifyEvent", ["wd", "mask", "cookie", "name"])
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    A minimal wrapper around the Linux inotify API, called through ctypes so that no extra package
+    is needed. The file descriptor is non-blocking.
+    """
+
+    def __init__(self):
+        """
+        Raises:
+            `OSError`: inotify isn't available, i.e. not on Linux, or the limit on the number of
+                inotify instances was reached.
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify isn't available on this platform.")
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """
+        Returns:
+            `int`. The watch descriptor.
+
+        Raises:
+            `OSError`: The watch couldn't be added, i.e. because the limit on the number of watches
+                was reached.
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd):
+        # Fails if the watch was already removed, i.e. because the directory was deleted.
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """
+        Returns:
+            `list` of `InotifyEvent` instances for all of the events that are queued.
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                events.append(InotifyEvent(wd=wd, mask=mask, cookie=cookie, name=name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_filesystem_type(path):
+    """
+    Args:
+        path: `str`. A path.
+
+    Returns:
+        `str`. The type of the filesystem that the path is on, as listed in /proc/self/mounts, or None
+        if it can't be determined.
+    """
+    path = os.path.realpath(path)
+    fstype = None
+    longest = -1
+    try:
+        with open("/proc/self/mounts") as fh:
+            for line in fh:
+                fields = line.split()
+                # Spaces in mount points are escaped as \040.
+                mount_point = fields[1].replace("\\040", " ")
+                if mount_point == "/" or path == mount_point or path.startswith(mount_point + "/"):
+                    if len(mount_point) > longest:
+                        longest = len(mount_point)
+                        fstype = fields[2]
+    except OSError:
+        return None
+    return fstype
+
+
+class RunWatcher:
+    """
+    Keeps track of the run directories in a set of watch directories that have a sentinal file.
+    Call `poll` to get them.
+
+    Each local watch directory has an inotify watch for run directories coming and going, and each of
+    its run directories that isn't finished yet has one for the sentinal file appearing. Run
+    directories that are finished don't need a watch anymore. Watch directories that are on a
+    network filesystem, or all of them if inotify isn't available, are reconciled on every poll,
+    unless the caller scans them itself; see `poll`.
+    """
+
+    def __init__(self, watchdirs, sentinal_files, reconcile_sec=RECONCILE_SEC, use_inotify=True):
+        """
+        Args:
+            watchdirs: `list` of watch directory paths.
+            sentinal_files: `set` of the names of the files that mark a run directory as finished.
+            reconcile_sec: `int`. How often, in seconds, to reconcile the watch directories that
+                are watched with inotify.
+            use_inotify: `boolean`. False means to reconcile all watch directories on every poll.
+        """
+        self.watchdirs = [os.path.normpath(i) for i in watchdirs]
+        self.sentinal_files = set(sentinal_files)
+        self.reconcile_sec = reconcile_sec
+        #: The paths of the run directories that are known to have a sentinal file.
+        self.ready = set()
+        #: Maps inotify watch descriptors to the paths that they watch.
+        self.watches = {}
+        #: Watch directories that are reconciled on every poll rather than watched with inotify.
+        self.polled_watchdirs = set()
+        self.last_reconcile = 0
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except OSError as e:
+                logger.warning("inotify isn't available ({}); watch directories will be scanned.".format(e))
+        for watchdir in self.watchdirs:
+            fstype = get_filesystem_type(watchdir)
+            if not self.inotify or fstype in REMOTE_FILESYSTEMS:
+                logger.info("Watch directory {} ({}) will be scanned.".format(watchdir, fstype))
+                self.polled_watchdirs.add(watchdir)
+            elif not self._add_watch(watchdir, WATCHDIR_MASK):
+                self.polled_watchdirs.add(watchdir)
+
+    def fileno(self):
+        """
+        Returns:
+            `int`. The inotify file descriptor, which is readable when there are events to
+            process, or None if inotify isn't used.
+        """
+        return self.inotify.fileno() if self.inotify else None
+
+    def _add_watch(self, path, mask):
+        try:
+            wd = self.inotify.add_watch(path, mask)
+        except OSError as e:
+            logger.warning("Can't watch {}: {}".format(path, e))
+            return False
+        self.watches[wd] = path
+        return True
+
+    def _remove_watch(self, path):
+        for wd, watched in list(self.watches.items()):
+            if watched == path:
+                self.inotify.rm_watch(wd)
+                self.watches.pop(wd)
+
+    def check_rundir(self, run_path, watch=False):
+        """
+        Lists a run directory to see if it has a sentinal file, and records it in `self.ready` if so.
+
+        Args:
+            run_path: `str`. The path to a run directory.
+            watch: `boolean`. True means to watch the run directory for a sentinal file if it
+                doesn't have one yet. The watch is added before listing the directory, so that a
+                sentinal file that appears in-between isn't missed.
+        """
+        if watch and run_path not in self.watches.values():
+            if not self._add_watch(run_path, RUNDIR_MASK):
+                self.polled_watchdirs.add(os.path.dirname(run_path))
+        try:
+            contents = os.listdir(run_path)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        if self.sentinal_files.intersection(contents):
+            self.ready.add(run_path)
+            if watch:
+                self._remove_watch(run_path)
+
+    def reconcile(self, watchdir):
+        """
+        Scans a watch directory. Run directories that are already known to be finished aren't
+        listed again, and those that are gone are forgotten.
+        """
+        watch = watchdir not in self.polled_watchdirs
+        present = set()
+        for run_name in os.listdir(watchdir):
+            run_path = os.path.join(watchdir, run_name)
+            if run_path in self.ready:
+                present.add(run_path)
+                continue
+            if not os.path.isdir(run_path):
+                continue
+            present.add(run_path)
+            self.check_rundir(run_path, watch=watch)
+        for run_path in [i for i in self.ready if os.path.dirname(i) == watchdir]:
+            if run_path not in present:
+                self.ready.discard(run_path)
+        if watch:
+            for run_path in [i for i in self.watches.values() if os.path.dirname(i) == watchdir]:
+                if run_path not in present:
+                    self._remove_watch(run_path)
+
+    def process_events(self):
+        """
+        Updates `self.ready` from the queued inotify events.
+
+        Returns:
+            `boolean`. True if events were lost because the queue overflowed, in which case the
+            watch directories need to be reconciled.
+        """
+        overflow = False
+        for event in self.inotify.read_events():
+            if event.mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            path = self.watches.get(event.wd)
+            if path is None:
+                continue
+            if event.mask & IN_IGNORED:
+                # The watched directory was deleted or its filesystem unmounted.
+                self.watches.pop(event.wd)
+                continue
+            if path in self.watchdirs:
+                run_path = os.path.join(path, event.name)
+                if not event.mask & IN_ISDIR:
+                    continue
+                if event.mask & (IN_CREATE | IN_MOVED_TO):
+                    # A run directory that's moved in may already have a sentinal file.
+                    self.check_rundir(run_path, watch=True)
+                elif event.mask & (IN_MOVED_FROM | IN_DELETE):
+                    self.ready.discard(run_path)
+                    self._remove_watch(run_path)
+            elif event.name in self.sentinal_files and path not in self.ready:
+                self.ready.add(path)
+                self._remove_watch(path)
+        return overflow
+
+    def poll(self, reconcile_polled=True):
+        """
+        Args:
+            reconcile_polled: `boolean`. False means to leave the watch directories in
+                `self.polled_watchdirs` to the caller, i.e. to scan them with a timeout in case a
+                network filesystem hangs. Their run directories aren't returned then.
+
+        Returns:
+            `list` of the paths of the run directories that have a sentinal file, sorted.
+        """
+        reconcile_all = False
+        if self.inotify:
+            reconcile_all = self.process_events()
+        if time.time() - self.last_reconcile >= self.reconcile_sec:
+            reconcile_all = True
+        for watchdir in self.watchdirs:
+            if watchdir in self.polled_watchdirs:
+                if reconcile_polled:
+                    self.reconcile(watchdir)
+            elif reconcile_all:
+                self.reconcile(watchdir)
+        if reconcile_all:
+            self.last_reconcile = time.time()
+        if reconcile_polled:
+            return sorted(self.ready)
+        return sorted(i for i in self.ready if os.path.dirname(i) not in self.polled_watchdirs)
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+A pool of long-lived worker processes that run jobs, i.e. workflow stages, one after another.
+Starting a new process for every workflow stage means that every stage also creates new storage and
+Firestore clients, and so pays for authentication, a token fetch and TLS setup each time. A worker
+instead creates its clients once, in the pool's initializer, and keeps them for its whole life.
+
+Each worker has its own job pipe, so that the caller knows which process runs which job, and all of
+the workers report finished jobs on a shared result queue. A worker that dies, i.e. because it was
+killed for running too long, is replaced by `WorkerPool.maintain`.
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """
+    A fixed number of forked worker processes. Forking, rather than spawning, lets the workers
+    inherit the caller's state, such as queues and the shared bandwidth governor. The workers should
+    be started before the caller creates any clients of its own, since clients that hold gRPC or TLS
+    connections don't survive a fork.
+
+    All methods except `get_result` are meant to be called from the same thread.
+    """
+
+    def __init__(self, size, initializer, handler):
+        """
+        Args:
+            size: `int`. The number of worker processes.
+            initializer: Function that each worker process calls once, without arguments, before
+                it takes any jobs.
+            handler: Function that a worker process calls for each job, with the job's arguments.
+                The job's exit code is 1 if it raises an Exception, and 0 otherwise.
+        """
+        self.size = size
+        self.initializer = initializer
+        self.handler = handler
+        #: Queue on which the workers report finished jobs, as (process ID, exit code) tuples.
+        self.results = multiprocessing.Queue()
+        #: Maps the process ID of each worker to its `multiprocessing.Process` instance.
+        self.workers = {}
+        #: Maps the process ID of each worker to the sending end of its job pipe.
+        self.job_pipes = {}
+        #: The process IDs of the workers that are waiting for a job.
+        self.idle = set()
+
+    def maintain(self):
+        """
+        Forgets the workers that died, and starts new ones until there are `self.size`. This also
+        starts the pool.
+
+        Returns:
+            `list` of the process IDs of the workers that died.
+        """
+        died = []
+        for pid, process in list(self.workers.items()):
+            if process.is_alive():
+                continue
+            died.append(pid)
+            self.workers.pop(pid)
+            self.job_pipes.pop(pid).close()
+            self.idle.discard(pid)
+        if died:
+            logger.warning("Worker process(es) {} died.".format(died))
+        while len(self.workers) < self.size:
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=self._work, args=(receiver, sender))
+            process.start()
+            receiver.close()
+            self.workers[process.pid] = process
+            self.job_pipes[process.pid] = sender
+            self.idle.add(process.pid)
+            logger.info("Started worker process {}.".format(process.pid))
+        return died
+
+    def _work(self, receiver, sender):
+        # The sending ends of the job pipes were inherited too. Closing them lets the workers see
+        # that the pool is gone once the caller closes it or exits.
+        sender.close()
+        for other in self.job_pipes.values():
+            other.close()
+        self.initializer()
+        pid = os.getpid()
+        while True:
+            try:
+                job = receiver.recv()
+            except EOFError:
+                return
+            try:
+                self.handler(*job)
+                exit_code = 0
+            except Exception:
+                logger.exception("Job {} failed in worker process {}.".format(job, pid))
+                exit_code = 1
+            self.results.put((pid, exit_code))
+
+    def get_idle_worker(self):
+        """
+        Returns:
+            `int`. The process ID of a worker that's waiting for a job, or None if all are busy.
+        """
+        return min(self.idle) if self.idle else None
+
+    def submit(self, pid, *args):
+        """
+        Hands a job to an idle worker.
+
+        Args:
+            pid: `int`. The process ID of the worker, as returned by `get_idle_worker`.
+            *args: The arguments for the handler.
+        """
+        self.idle.discard(pid)
+        self.job_pipes[pid].send(args)
+
+    def job_done(self, pid):
+        """
+        Marks a worker that reported a finished job as idle again, unless it died since.
+        """
+        if pid in self.workers:
+            self.idle.add(pid)
+
+    def get_result(self, timeout=None):
+        """
+        Args:
+            timeout: `float`. How long in seconds to wait for a finished job. None or 0 means not to
+                wait.
+
+        Returns:
+            `tuple` of the process ID of the worker and the job's exit code, or None if no job
+            finished.
+        """
+        try:
+            if timeout:
+                return self.results.get(timeout=timeout)
+            return self.results.get(block=False)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        """
+        Closes the job pipes, so that the workers exit once they finish the job they're on.
+        """
+        for sender in self.job_pipes.values():
+            sender.close()
+        self.job_pipes = {}
+        self.idle = set()